@@ -2,12 +2,136 @@
 # -*- coding: utf-8 -*-
 from __future__ import annotations
 
+import html
+import json
+import os
+import time
+from functools import lru_cache
+from pathlib import Path
+from types import MappingProxyType
+from typing import NamedTuple
+
 import streamlit as st
 import pandas as pd
+import numpy as np
 import altair as alt
+import pydeck as pdk
 import plotly.express as px
 import plotly.graph_objects as go
 
+# Copy-on-Write (padrão no pandas 3): subconjuntos filtrados podem receber colunas novas
+# sem .copy() defensivo e sem SettingWithCopyWarning
+if int(pd.__version__.split(".")[0]) < 3:
+    pd.options.mode.copy_on_write = True
+
+
+# -------------------------- Constantes --------------------------
+
+# Turismo (WDI): rótulos e “tipos” para formatação
+_TOUR_KMAP = MappingProxyType({
+    "ST.INT.ARVL":       "Chegadas (turistas internacionais)",
+    "ST.INT.DPRT":       "Partidas (turistas internacionais)",
+    "ST.INT.RCPT.CD":    "Receitas do turismo (US$ correntes)",
+    "ST.INT.XPND.CD":    "Despesas do turismo (US$ correntes)",
+    "ST.INT.RCPT.XP.ZS": "Receitas do turismo (% exportações)",
+    "ST.INT.XPND.MP.ZS": "Despesas do turismo (% importações)",
+})
+_TOUR_UNIT = MappingProxyType({
+    "ST.INT.ARVL": "int",
+    "ST.INT.DPRT": "int",
+    "ST.INT.RCPT.CD": "money",
+    "ST.INT.XPND.CD": "money",
+    "ST.INT.RCPT.XP.ZS": "pct",
+    "ST.INT.XPND.MP.ZS": "pct",
+})
+# 3 visões da série temporal (pares de indicadores)
+_TOUR_VIEWS = MappingProxyType({
+    "Receitas vs Despesas (US$ correntes)": MappingProxyType({
+        "codes": ("ST.INT.RCPT.CD", "ST.INT.XPND.CD"),
+        "y_title": "US$ correntes",
+    }),
+    "% Receitas vs % Despesas": MappingProxyType({
+        "codes": ("ST.INT.RCPT.XP.ZS", "ST.INT.XPND.MP.ZS"),
+        "y_title": "%",
+    }),
+    "Chegadas vs Partidas": MappingProxyType({
+        "codes": ("ST.INT.ARVL", "ST.INT.DPRT"),
+        "y_title": "Número de pessoas",
+    }),
+})
+
+
+# mapas (st.map / pydeck): teto de pontos enviados ao browser
+_MAP_MAX_POINTS = 500
+
+# bandeira + factos (scrape): cache em disco por ISO3, válida um dia (sobrevive a reinícios)
+_FLAG_CACHE_DIR = Path(__file__).resolve().parent / "data" / "flag_cache"
+_FLAG_CACHE_TTL = 86400   # segundos
+
+# Religiões: (coluna em religion.csv, rótulo PT) — ordem fixa, partida uma vez
+_REL_ORDER = (
+    ("christian", "Cristianismo"), ("muslim", "Islamismo"), ("unaffiliated", "Sem religião"),
+    ("hindu", "Hinduísmo"), ("buddhist", "Budismo"), ("folk_religions", "Religiões étnicas"),
+    ("other_religions", "Outras"), ("jewish", "Judaísmo"),
+)
+_REL_CODES, _REL_LABELS = (list(t) for t in zip(*_REL_ORDER))
+
+# Specs Vega-Lite fixas (equivalentes ao que o Altair gerava); só os dados mudam por render
+_REL_VL_SPEC = {
+    "height": 300,
+    "layer": [
+        {
+            "mark": {"type": "bar"},
+            "encoding": {
+                "y": {"field": "Religião", "type": "nominal", "sort": "-x", "title": ""},
+                "x": {"field": "% População", "type": "quantitative", "title": "% população",
+                      "scale": {"domain": [0, 100]}},   # eixo fixo 0–100
+                "tooltip": [
+                    {"field": "Religião", "type": "nominal"},
+                    {"field": "% População", "type": "quantitative", "format": ".2f"},
+                ],
+            },
+        },
+        {
+            # texto claro p/ tema escuro
+            "mark": {"type": "text", "align": "left", "baseline": "middle", "dx": 3, "color": "#e6e6e6"},
+            "encoding": {
+                "y": {"field": "Religião", "type": "nominal"},
+                "x": {"field": "label_pos", "type": "quantitative"},
+                "text": {"field": "label", "type": "nominal"},
+            },
+        },
+    ],
+}
+
+_TOUR_LINE_VL_SPEC = {
+    "height": 260,
+    "mark": {"type": "line", "point": True},
+    "encoding": {
+        "x": {"field": "year", "type": "quantitative", "title": "Ano", "axis": {"format": "d"}},
+        "y": {"field": "value", "type": "quantitative"},
+        "color": {"field": "metric", "type": "nominal", "title": ""},
+        "tooltip": [
+            {"field": "metric", "type": "nominal", "title": "Indicador"},
+            {"field": "year", "type": "quantitative", "title": "Ano", "format": "d"},
+            {"field": "value", "type": "quantitative", "title": "Valor", "format": ",.0f"},
+        ],
+    },
+}
+
+def _tour_line_spec(y_min: int, y_max: int, y_title: str, color_sort: list) -> dict:
+    """_TOUR_LINE_VL_SPEC com domínio X, título Y e ordem da legenda da vista atual."""
+    enc = _TOUR_LINE_VL_SPEC["encoding"]
+    return {
+        **_TOUR_LINE_VL_SPEC,
+        "encoding": {
+            **enc,
+            "x": {**enc["x"], "scale": {"domain": [y_min, y_max]}},
+            "y": {**enc["y"], "title": y_title},
+            "color": {**enc["color"], "sort": color_sort},
+        },
+    }
+
 
 # -------------------------- Helpers --------------------------
 
@@ -27,6 +151,157 @@ def _fmt_year(x) -> str:
         s = str(x)
         return s[:4] if len(s) >= 4 and s[:4].isdigit() else s
 
+def _fmt_year_col(s: pd.Series) -> pd.Series:
+    """Versão vetorizada de _fmt_year para colunas numéricas (NaN → "")."""
+    return pd.to_numeric(s, errors="coerce").astype("Int64").astype("string").fillna("")
+
+def _fmt_int_col(s: pd.Series) -> pd.Series:
+    """Versão vetorizada de _fmt_int: inteiros com espaço como separador de milhares (NaN → "")."""
+    num = pd.to_numeric(s, errors="coerce")
+    txt = num.fillna(0).astype("int64").map("{:,}".format).str.replace(",", " ")
+    return txt.where(num.notna(), "")
+
+# separador de milhares com espaço (translate é mais barato que .replace em strings curtas)
+_THOUSANDS_SEP = str.maketrans(",", " ")
+
+def _fmt_thousands(v: float) -> str:
+    return format(int(round(v)), ",").translate(_THOUSANDS_SEP)
+
+def _money_scale(v: float | None) -> str | None:
+    if v is None:
+        return None
+    return "B" if abs(v) >= 1e9 else ("M" if abs(v) >= 1e6 else None)
+
+def _fmt_money(v: float, scale: str | None = None) -> str:
+    if scale is None:
+        scale = _money_scale(v)
+    if scale == "B":
+        return f"{v/1e9:.2f} B"
+    if scale == "M":
+        return f"{v/1e6:.2f} M"
+    return _fmt_thousands(v)
+
+# formatadores por “tipo” de indicador: valor principal e delta (na escala do valor)
+_FMT_VALUE = MappingProxyType({
+    "pct":   lambda v: f"{v:.1f}%",
+    "money": _fmt_money,
+    "int":   _fmt_thousands,
+})
+_FMT_DELTA = MappingProxyType({
+    "pct":   lambda d, ref: f"{d:+.1f} p.p.",
+    "money": lambda d, ref: ("+" if d > 0 else "") + _fmt_money(d, _money_scale(ref)),
+    "int":   lambda d, ref: format(d, "+,.0f").translate(_THOUSANDS_SEP),
+})
+
+# cards de métricas num só st.markdown (1 mensagem ao browser em vez de uma por st.metric)
+_METRIC_CARDS_HTML = True
+
+def _metric_grid_html(cards: list[tuple[str, str, str]], ncols: int = 3) -> str:
+    """Grelha HTML com aspeto de st.metric: (rótulo, valor, delta) por card; delta colorido pelo sinal."""
+    items = []
+    for label, val, delta in cards:
+        d = ""
+        if delta:
+            color = "#ff4b4b" if delta.lstrip().startswith("-") else "#21c354"
+            arrow = "↓" if color == "#ff4b4b" else "↑"
+            d = (f'<div style="font-size:.9rem;color:{color};margin-top:.1rem">'
+                 f'{arrow} {html.escape(delta)}</div>')
+        items.append(
+            f'<div style="padding:.25rem 0">'
+            f'<div style="font-size:.875rem;opacity:.75">{html.escape(label)}</div>'
+            f'<div style="font-size:1.75rem;line-height:1.3">{html.escape(val)}</div>{d}</div>'
+        )
+    return (
+        f'<div style="display:grid;grid-template-columns:repeat({ncols},1fr);gap:.5rem 1rem;margin-bottom:.5rem">'
+        + "".join(items) + "</div>"
+    )
+
+def _render_metric_cards(cards: list[tuple[str, str, str]]) -> None:
+    """Cards (rótulo, valor, delta): grelha HTML numa só mensagem, ou st.metric em 3 colunas."""
+    if not cards:
+        return
+    if _METRIC_CARDS_HTML:
+        st.markdown(_metric_grid_html(cards), unsafe_allow_html=True)
+    else:
+        cols = st.columns(3)
+        for i, (lbl, val_txt, delta_txt) in enumerate(cards):
+            cols[i % 3].metric(lbl, val_txt, delta=delta_txt)
+
+def _migration_cards(latest: pd.DataFrame, ts: pd.DataFrame,
+                     kmap: dict, unit_fmt: dict) -> list[tuple[str, str, str]]:
+    """Cards de migração (WDI): último ano por indicador e delta vs o anterior, na escala do valor."""
+    # uma ordenação + groupby por fonte; cada indicador é só um get_group
+    def _by_indicator(df_iso: pd.DataFrame):
+        if df_iso is None or df_iso.empty:
+            return None
+        return df_iso.sort_values("year", kind="stable").groupby("indicator", sort=False)
+
+    g_latest = _by_indicator(latest)
+    g_ts     = _by_indicator(ts)
+
+    def _latest_and_prev(groups, code: str):
+        if groups is None or code not in groups.groups:
+            return None, None
+        d = groups.get_group(code).dropna(subset=["value"])
+        if d.empty:
+            return None, None
+        last = d.iloc[-1]
+        prev = d.iloc[-2] if len(d) > 1 else None
+        return last, prev
+
+    cards = []
+    for code, label in kmap.items():
+        src = g_latest if g_latest is not None and code in g_latest.groups else g_ts
+        last, prev = _latest_and_prev(src, code)
+        if last is None:
+            continue
+        year = int(last["year"])
+        val  = float(last["value"])
+        kind = unit_fmt.get(code, "int")
+
+        # valor principal (usa B/M quando for dinheiro)
+        val_txt = _FMT_VALUE[kind](val)
+
+        # delta na MESMA escala do valor principal
+        delta_txt = ""
+        if prev is not None and pd.notna(prev["value"]):
+            delta_txt = _FMT_DELTA[kind](val - float(prev["value"]), val)
+
+        cards.append((f"{label} · {year}", val_txt, delta_txt))
+    return cards
+
+def _tourism_cards(tails: pd.DataFrame) -> list[tuple[str, str, str]]:
+    """Cards de turismo a partir de tourism_ts_for_iso3 (ordenado por ano): último valor + delta."""
+    tails = tails.dropna(subset=["value"])
+    by_ind = tails.groupby("indicator", sort=False, observed=True)
+    last_df = by_ind.nth(-1).set_index("indicator")
+    prev_df = by_ind.nth(-2).set_index("indicator")
+    deltas = last_df["value"] - prev_df["value"].reindex(last_df.index)
+
+    cards = []
+    for code, label in _TOUR_KMAP.items():
+        if code not in last_df.index:
+            continue
+        year = int(last_df.at[code, "year"])
+        val  = float(last_df.at[code, "value"])
+
+        kind = _TOUR_UNIT.get(code, "int")
+
+        # valor principal
+        val_txt = _FMT_VALUE[kind](val)
+
+        # delta na mesma escala (pct em p.p.; dinheiro segue a escala do valor)
+        delta = deltas.get(code)
+        delta_txt = _FMT_DELTA[kind](float(delta), val) if pd.notna(delta) else ""
+
+        cards.append((f"{label} · {year}", val_txt, delta_txt))
+    return cards
+
+@lru_cache(maxsize=4)
+def _lower_names(names: tuple[str, ...]) -> tuple[str, ...]:
+    """Nomes em minúsculas para o filtro, uma vez por lista de nomes (chave = o próprio tuple)."""
+    return tuple(n.lower() for n in names)
+
 def _country_selector(countries_df: pd.DataFrame) -> tuple[str | None, str | None]:
     names = countries_df["name"].astype(str).tolist()
     
@@ -36,7 +311,13 @@ def _country_selector(countries_df: pd.DataFrame) -> tuple[str | None, str | Non
 
     with st.form("pais_form", clear_on_submit=False):
         q = st.text_input("Pesquisar (nome contém…)", value="", placeholder="ex.: Por, Bra, Ang…")
-        opts = [n for n in names if q.lower() in n.lower()] if q else names
+        if q:
+            # nomes em minúsculas calculados uma vez por lista (refeitos se algum nome mudar)
+            names_lc = _lower_names(tuple(names))
+            q_lc = q.lower()
+            opts = [names[i] for i, lc in enumerate(names_lc) if q_lc in lc]
+        else:
+            opts = names
         
         if not opts:
             st.warning("Nenhum país corresponde ao filtro.")
@@ -67,16 +348,33 @@ def _country_selector(countries_df: pd.DataFrame) -> tuple[str | None, str | Non
     iso3 = countries_df.loc[countries_df["name"] == chosen, "iso3"].astype(str).str.upper().iloc[0]
     return chosen, iso3
 
+def _lazy_section(key: str, label: str = "Carregar") -> bool:
+    """
+    Gate para secções pesadas dentro de expanders (o corpo corre mesmo fechado).
+    Só devolve True depois do 1.º clique; fica ligado na sessão (para todos os países).
+    """
+    if st.session_state.get(key):
+        return True
+    if st.button(label, key=f"{key}_btn"):
+        st.session_state[key] = True
+        return True
+    st.caption("— clique para carregar —")
+    return False
+
 def render_migration_section(iso3: str) -> None:
 
     from services.offline_store import (
         load_migration_latest_for_iso3,
         load_migration_ts_for_iso3,
-        load_migration_inout,     # UN DESA (full)
+        load_migration_inout_for_iso3,  # UN DESA (só o país)
         MIG_INOUT_CSV,            # Path p/ mostrar nome do ficheiro
     )
 
     with st.expander("Migração"):
+        # nada de loaders/gráficos enquanto o utilizador não abrir a secção
+        if not _lazy_section("exp_mig", "Carregar dados de migração"):
+            return
+
         # ───────── WDI (apenas do país) ─────────
         latest = load_migration_latest_for_iso3(iso3)
         ts     = load_migration_ts_for_iso3(iso3)
@@ -99,70 +397,8 @@ def render_migration_section(iso3: str) -> None:
         }
 
 
-        def _fmt_value(v, kind, *, scale=None):
-            try:
-                v = float(v)
-            except Exception:
-                return "—"
-            if kind == "pct":
-                return f"{v:.1f}%"
-            if kind == "money":
-                # deteta/força escala para alinhar com o delta
-                if scale is None:
-                    scale = "B" if abs(v) >= 1e9 else ("M" if abs(v) >= 1e6 else None)
-                if scale == "B":
-                    return f"{v/1e9:.2f} B"
-                if scale == "M":
-                    return f"{v/1e6:.2f} M"
-                return f"{int(round(v)):,}".replace(",", " ")
-            # int
-            return f"{int(round(v)):,}".replace(",", " ")
-
-        def _fmt_delta(delta, kind, *, ref_value=None):
-            if kind == "pct":
-                return f"{delta:+.1f} p.p."
-            if kind == "money":
-                ref_scale = "B" if (ref_value is not None and abs(ref_value) >= 1e9) else \
-                            ("M" if (ref_value is not None and abs(ref_value) >= 1e6) else None)
-                s = _fmt_value(delta, "money", scale=ref_scale)
-                return ("+" if delta > 0 else "") + s
-            # int
-            return f"{delta:+,.0f}".replace(",", " ")
-
-
-        def _latest_and_prev(df_iso: pd.DataFrame, code: str):
-            d = (
-                df_iso[df_iso["indicator"] == code]
-                .dropna(subset=["value"])
-                .sort_values("year")
-            )
-            if d.empty:
-                return None, None
-            last = d.iloc[-1]
-            prev = d.iloc[-2] if len(d) > 1 else None
-            return last, prev
-
-        cols = st.columns(3)
-        i = 0
-        for code, label in kmap.items():
-            src = latest if not latest.empty and (latest["indicator"] == code).any() else ts
-            last, prev = _latest_and_prev(src, code)
-            if last is None:
-                continue
-            year = int(last["year"])
-            val  = float(last["value"])
-
-            # valor principal (usa B/M quando for dinheiro)
-            val_txt = _fmt_value(val, unit_fmt.get(code, "int"))
-
-            # delta na MESMA escala do valor principal
-            delta_txt = ""
-            if prev is not None and pd.notna(prev["value"]):
-                delta = val - float(prev["value"])
-                delta_txt = _fmt_delta(delta, unit_fmt.get(code, "int"), ref_value=val)
-
-            cols[i % 3].metric(f"{label} · {year}", val_txt, delta=delta_txt)
-            i += 1
+        # cards (ano + delta vs ano anterior): WDI "latest" quando existir, senão a série
+        _render_metric_cards(_migration_cards(latest, ts, kmap, unit_fmt))
 
 
         # Série temporal (últimos 30 anos)
@@ -184,7 +420,7 @@ def render_migration_section(iso3: str) -> None:
             )
             code = code_by_label[sel_lbl]
 
-            base = ts[(ts["iso3"] == iso3) & (ts["indicator"] == code)].copy()
+            base = ts[(ts["iso3"] == iso3) & (ts["indicator"] == code)]
             if base.empty:
                 st.caption("— sem série temporal para o indicador selecionado —")
                 return
@@ -234,57 +470,42 @@ def render_migration_section(iso3: str) -> None:
 
         st.markdown("---")
 
-        # ───────── UN DESA (apenas do país, filtrado localmente) ─────────
-        df_all = load_migration_inout()
+        # ───────── UN DESA (apenas do país, filtrado no loader) ─────────
         csv_name = getattr(MIG_INOUT_CSV, "name", "migration_inout.csv")
-
-        if df_all.empty:
-            st.caption(f"— UN DESA: dataset vazio/não encontrado ({csv_name}) —")
-            return
-
         iso3u = str(iso3).upper()
-
-        # normalização leve de cabeçalhos
-        df = df_all.copy()
-        df.columns = df.columns.str.replace("\ufeff", "", regex=False).str.strip()
-
         want = ["iso3", "year", "immigrants", "emigrants"]
-        missing = [c for c in want if c not in df.columns]
-        if missing:
-            st.caption(f"— UN DESA: cabeçalhos inesperados no {csv_name} — faltam: {missing} — lidos: {list(map(repr, df.columns))}")
-            return
 
-        # coerção + filtro ISO3
-        df["iso3"] = df["iso3"].astype(str).str.upper()
-        df["year"] = pd.to_numeric(df["year"], errors="coerce").astype("Int64")
-        df["immigrants"] = pd.to_numeric(df["immigrants"], errors="coerce")
-        df["emigrants"]  = pd.to_numeric(df["emigrants"],  errors="coerce")
-
-        io_df = (
-            df.loc[df["iso3"] == iso3u, want]
-              .dropna(subset=["year"])
-              .sort_values("year")
-              .drop_duplicates("year", keep="last")
-              .tail(30)
-              .copy()
-        )
+        # loader já devolve tipado, sem anos nulos, ordenado e sem duplicados
+        io_df = load_migration_inout_for_iso3(iso3u).tail(30)
 
         if io_df.empty:
-            st.caption(f"— sem dados UN DESA para este país — (no {csv_name} não há linhas para ISO3={iso3u})")
+            # diagnóstico: só neste caso se importa/lê o ficheiro completo
+            from services.offline_store import load_migration_inout
+            df_all = load_migration_inout()
+            if df_all.empty:
+                st.caption(f"— UN DESA: dataset vazio/não encontrado ({csv_name}) —")
+                return
+            cols_all = df_all.columns.str.replace("\ufeff", "", regex=False).str.strip()
+            missing = [c for c in want if c not in cols_all]
+            if missing:
+                st.caption(f"— UN DESA: cabeçalhos inesperados no {csv_name} — faltam: {missing} — lidos: {list(map(repr, cols_all))}")
+                return
+            n_iso = int(df_all["iso3"].astype(str).str.upper().value_counts().get(iso3u, 0))
+            st.caption(f"— sem dados UN DESA para este país — ({csv_name}: {n_iso} linhas para ISO3={iso3u})")
             return
 
         # dataset longo para as duas séries
-        long = (
-            io_df.melt(
-                id_vars="year",
-                value_vars=["immigrants", "emigrants"],
-                var_name="tipo",
-                value_name="valor",
-            )
-            .assign(tipo=lambda d: d["tipo"].map({"immigrants": "Imigração", "emigrants": "Emigração"}))
+        # (só 2 colunas → construção direta, sem melt + map de rótulos)
+        long = pd.concat(
+            [
+                pd.DataFrame({"year": io_df["year"], "tipo": "Imigração", "valor": io_df["immigrants"]}),
+                pd.DataFrame({"year": io_df["year"], "tipo": "Emigração", "valor": io_df["emigrants"]}),
+            ],
+            ignore_index=True,
         )
 
-        years_sorted = sorted(int(y) for y in long["year"].dropna().unique())
+        # anos de io_df já são únicos (drop_duplicates no loader) → ordenação numpy, sem int() por elemento
+        years_sorted = np.sort(io_df["year"].dropna().to_numpy(dtype="int64")).tolist()
 
         color_enc = alt.Color(
             "tipo:N", title="",
@@ -294,10 +515,11 @@ def render_migration_section(iso3: str) -> None:
         x_enc = alt.X("year:O", title="Ano", sort=years_sorted)
 
         # ── cálculo do delta e posição média (entre as linhas) ──
-        ann = io_df.copy()
-        ann["diff"]  = ann["emigrants"] - ann["immigrants"]              # >0: sai mais gente
+        ann = io_df.assign(
+            diff=io_df["emigrants"] - io_df["immigrants"],                # >0: sai mais gente
+            mid=(io_df["emigrants"] + io_df["immigrants"]) / 2,           # meio entre as séries
+        )
         ann["label"] = ann["diff"].apply(lambda x: f"{x/1_000:+.0f} K")  # em K, com sinal
-        ann["mid"]   = (ann["emigrants"] + ann["immigrants"]) / 2        # meio entre as séries
 
         # linhas principais
         lines = (
@@ -332,26 +554,127 @@ def render_migration_section(iso3: str) -> None:
 
         st.altair_chart((lines + labels).properties(height=260), use_container_width=True)
 
-        # last_year = int(io_df["year"].max())
-        # last_row  = io_df[io_df["year"] == last_year].iloc[0]
+        # io_df já vem ordenado por ano → a última linha é o último ano
+        # last_row  = io_df.iloc[-1]
+        # last_year = int(last_row["year"])
         # c1, c2 = st.columns(2)
         # c1.metric(f"Imigração · {last_year}", f"{last_row['immigrants']:,.0f}".replace(",", " "))
         # c2.metric(f"Emigração · {last_year}", f"{last_row['emigrants']:,.0f}".replace(",", " "))
 
-def _profile_by_iso3(iso3: str) -> dict:
+@st.cache_data(show_spinner=False, ttl=3600)
+def _profiles_index() -> dict:
+    """{ISO3: linha do profiles} construído uma vez (1.ª ocorrência por ISO3)."""
     from services.offline_store import load_profiles_master
     df = load_profiles_master()
-    if not df.empty:
-        row = df[df["iso3"].astype(str).str.upper() == str(iso3).upper()]
-        if not row.empty:
-            return row.iloc[0].to_dict()
-    return {"iso3": iso3, "name": iso3}
+    if df.empty or "iso3" not in df.columns:
+        return {}
+    key = df["iso3"].astype(str).str.upper()
+    df = df[~key.duplicated()]
+    return df.set_index(key[df.index]).to_dict("index")
+
+def _profile_by_iso3(iso3: str) -> dict:
+    return _profiles_index().get(str(iso3).upper(), {"iso3": iso3, "name": iso3})
+
+@st.cache_data(ttl=_FLAG_CACHE_TTL, show_spinner=False)
+def _flag_info(name: str, iso3: str) -> dict | None:
+    """
+    Bandeira + factos (scrape HTTP) por país durante um dia: em memória (st.cache_data) e em
+    data/flag_cache/<ISO3>.json (mtime), para o scrape não se repetir a cada reinício.
+    """
+    path = _FLAG_CACHE_DIR / f"{str(iso3).upper()}.json" if iso3 else None
+    if path is not None:
+        try:
+            if time.time() - path.stat().st_mtime <= _FLAG_CACHE_TTL:
+                return json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            pass
+
+    from services.offline_store import load_flag_info
+    info = load_flag_info(name, iso3)
+    if info is not None and path is not None:   # falhas não ficam em disco: tenta de novo no reinício
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+            tmp.write_text(json.dumps(info, ensure_ascii=False), encoding="utf-8")
+            os.replace(tmp, path)
+        except OSError:
+            pass
+    return info
+
+@st.cache_data(show_spinner=False)
+def _leaders(iso3: str) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """(atuais, histórico) de líderes para o ISO3 — partilhado pelo topo e pelo expander."""
+    from services.offline_store import leaders_for_iso3
+    return leaders_for_iso3(iso3)
+
+class _CurrentLeaders(NamedTuple):
+    pres: str | None
+    pm: str | None
+    pm_party: str | None
+
+def _party_of(r) -> str | None:
+    return (r.get("party_label") or r.get("party_pt") or r.get("party") or "").strip() or None
+
+def _by_role(df: pd.DataFrame | None) -> dict:
+    """{role: sub-DataFrame} numa só passagem (role é categoria → só grupos observados)."""
+    if df is None or df.empty:
+        return {}
+    return {k: g for k, g in df.groupby("role", sort=False, observed=True)}
+
+def _current_leaders(cur_df: pd.DataFrame, hist_df: pd.DataFrame) -> _CurrentLeaders:
+    """Presidente e chefe de governo atuais; se faltarem, o mandato mais recente do histórico."""
+    pres = pm = pm_party = None
+    cur = _by_role(cur_df)
+    r = cur.get("head_of_state")
+    if r is not None:
+        pres = (r.iloc[0].get("person") or "").strip() or None
+    r = cur.get("head_of_government")
+    if r is not None:
+        r = r.iloc[0]
+        pm = (r.get("person") or "").strip() or None
+        pm_party = _party_of(r)
+
+    if pres is None or pm is None:
+        # start já vem em datetime do loader → mandato mais recente com nlargest (sem ordenar)
+        hist = _by_role(hist_df)
+        r = hist.get("head_of_state")
+        if pres is None and r is not None:
+            pres = (r.nlargest(1, "start").iloc[0].get("person") or "").strip() or None
+        r = hist.get("head_of_government")
+        if pm is None and r is not None:
+            r = r.nlargest(1, "start").iloc[0]
+            pm = (r.get("person") or "").strip() or None
+            pm_party = _party_of(r)
+    return _CurrentLeaders(pres, pm, pm_party)
+
+@st.cache_data(show_spinner=False)
+def _sites_layer(pts: tuple) -> pdk.Layer:
+    """Layer de pontos (lat, lon) do mapa UNESCO; pts já arredondados a 4 casas → cache estável."""
+    return pdk.Layer(
+        "ScatterplotLayer",
+        data=[{"lat": a, "lon": b} for a, b in pts],
+        get_position="[lon, lat]",
+        get_fill_color=[255, 75, 75, 180],
+        get_radius=5000,
+        radius_min_pixels=3,
+    )
 
-def _mini_line(df: pd.DataFrame, ycol: str, ytitle: str):
+def _fit_view(lat: np.ndarray, lon: np.ndarray, max_zoom: float = 8) -> pdk.ViewState:
+    """
+    Vista que enquadra todos os pontos (o auto-fit que o st.map fazia): centro da caixa
+    lat/lon e zoom ≈ log2(360 / maior lado), limitado a [1, max_zoom] (um só sítio → max_zoom).
+    """
+    lat_min, lat_max = float(lat.min()), float(lat.max())
+    lon_min, lon_max = float(lon.min()), float(lon.max())
+    span = max(lat_max - lat_min, lon_max - lon_min)
+    zoom = max_zoom if span <= 0 else float(np.clip(np.log2(360.0 / span), 1, max_zoom))
+    return pdk.ViewState(latitude=(lat_min + lat_max) / 2, longitude=(lon_min + lon_max) / 2, zoom=zoom)
+
+def _mini_line_spec(df: pd.DataFrame, ycol: str, ytitle: str) -> dict | None:
+    """Spec Vega-Lite (dict) da mini-série; None se não houver dados."""
     if df.empty or ycol not in df.columns or df[ycol].notna().sum() == 0:
-        st.caption(f"— sem dados de {ytitle.lower()} —")
-        return
-    d = df.dropna(subset=["year", ycol]).copy()
+        return None
+    d = df.dropna(subset=["year", ycol])
     d["year"] = pd.to_numeric(d["year"], errors="coerce")
 
     chart = (
@@ -368,7 +691,23 @@ def _mini_line(df: pd.DataFrame, ycol: str, ytitle: str):
         )
         .properties(height=170)
     )
-    st.altair_chart(chart, use_container_width=True)
+    return chart.to_dict()
+
+# (título, coluna, unidade) das mini-séries do World Bank
+_WB_MINI = (
+    ("População total", "pop_total", "habitantes"),
+    ("Densidade (hab/km²)", "pop_density", "hab/km²"),
+    ("População urbana (%)", "urban_pct", "%"),
+)
+
+@st.cache_data(show_spinner=False)
+def _wb_charts(iso3: str) -> dict | None:
+    """{coluna: spec|None} das 3 mini-séries; None se o país não tiver séries WB."""
+    from services.offline_store import wb_series_for_country
+    wb = wb_series_for_country(iso3)
+    if wb.empty:
+        return None
+    return {ycol: _mini_line_spec(wb, ycol, ytitle) for _, ycol, ytitle in _WB_MINI}
 
 
 # -------------------------- UI principal --------------------------
@@ -376,15 +715,11 @@ def _mini_line(df: pd.DataFrame, ycol: str, ytitle: str):
 def render_paises_tab():
     from services.offline_store import (
         list_available_countries,
-        wb_series_for_country,
         cities_for_iso3,
         unesco_for_iso3,
-        leaders_for_iso3,
-        load_olympics_summer_csv,
-        load_religion,
-        load_flag_info,
-        load_tourism_ts,
-        load_tourism_latest,
+        load_olympics_summer_csv_for_iso3,
+        religion_for_iso3,
+        tourism_ts_for_iso3,
         tourism_origin_for_iso3,
         tourism_purpose_for_iso3,
     )
@@ -410,7 +745,7 @@ def render_paises_tab():
         st.subheader(prof.get("name") or country_name)
 
         # --- BANDEIRA IMEDIATA (após o nome) ---
-        info = load_flag_info(prof.get("name") or country_name, iso3)
+        info = _flag_info(prof.get("name") or country_name, iso3)
         moeda_txt = None
         if info:
             if info.get("flag_url"):
@@ -429,38 +764,7 @@ def render_paises_tab():
         pm_name = None
         pm_party = None
         try:
-            cur_df, hist_df = leaders_for_iso3(iso3)
-            # Presidente (head_of_state)
-            if cur_df is not None and not cur_df.empty:
-                r = cur_df[cur_df["role"] == "head_of_state"]
-                if not r.empty:
-                    pres_name = (r.iloc[0].get("person") or "").strip() or None
-            if pres_name is None and hist_df is not None and not hist_df.empty:
-                h = hist_df[hist_df["role"] == "head_of_state"].copy()
-                if not h.empty:
-                    h["__start"] = pd.to_datetime(h.get("start"), errors="coerce")
-                    pres_name = (h.sort_values("__start", ascending=False).iloc[0].get("person") or "").strip() or None
-
-            # Chefe de governo
-            if cur_df is not None and not cur_df.empty:
-                r = cur_df[cur_df["role"] == "head_of_government"]
-                if not r.empty:
-                    r = r.iloc[0]
-                    pm_name = (r.get("person") or "").strip() or None
-                    pm_party = (
-                        (r.get("party_label") or r.get("party_pt") or r.get("party") or "").strip()
-                        or None
-                    )
-            if pm_name is None and hist_df is not None and not hist_df.empty:
-                h = hist_df[hist_df["role"] == "head_of_government"].copy()
-                if not h.empty:
-                    h["__start"] = pd.to_datetime(h.get("start"), errors="coerce")
-                    r = h.sort_values("__start", ascending=False).iloc[0]
-                    pm_name = (r.get("person") or "").strip() or None
-                    pm_party = (
-                        (r.get("party_label") or r.get("party_pt") or r.get("party") or "").strip()
-                        or None
-                    )
+            pres_name, pm_name, pm_party = _current_leaders(*_leaders(iso3))
         except Exception:
             pass
 
@@ -517,19 +821,16 @@ def render_paises_tab():
                 #    st.caption(f"Fonte: bandeirasnacionais.com — {info['site_url']}")
 
     with colR:
-        wb = wb_series_for_country(iso3)
-        if not wb.empty:
-            wb = wb.copy()
-            wb["year"] = pd.to_numeric(wb["year"], errors="coerce")
-
-            st.markdown("**População total**")
-            _mini_line(wb, "pop_total", "habitantes")
-
-            st.markdown("**Densidade (hab/km²)**")
-            _mini_line(wb, "pop_density", "hab/km²")
-
-            st.markdown("**População urbana (%)**")
-            _mini_line(wb, "urban_pct", "%")
+        # specs já construídos e em cache por ISO3 (nada a filtrar/codificar nos reruns)
+        charts = _wb_charts(iso3)
+        if charts is not None:
+            for title, ycol, ytitle in _WB_MINI:
+                st.markdown(f"**{title}**")
+                spec = charts.get(ycol)
+                if spec is None:
+                    st.caption(f"— sem dados de {ytitle.lower()} —")
+                else:
+                    st.vega_lite_chart(spec, use_container_width=True)
         else:
             st.caption("— sem séries do World Bank —")
 
@@ -542,17 +843,18 @@ def render_paises_tab():
     
     # -------- Histórico de liderança
     with st.expander("Histórico de liderança"):
-        cur_df, hist_df = leaders_for_iso3(iso3)
+        cur_df, hist_df = _leaders(iso3)
         base = hist_df if (hist_df is not None and not hist_df.empty) else cur_df
 
         if base is not None and not base.empty:
-            h = base.copy()
+            h = base   # frame novo por rerun (cache_data devolve cópia) → pode ser alterado
 
             # ─ normalizações (datas + labels PT)
             role_map = {"head_of_state": "Presidente", "head_of_government": "Chefe de governo"}
-            h["Função"] = h.get("role").map(role_map).fillna(h.get("role"))
-            h["__start_dt"] = pd.to_datetime(h.get("start"), errors="coerce")
-            h["__end_dt"]   = pd.to_datetime(h.get("end"),   errors="coerce")
+            # role é categoria: renomeia só as categorias (códigos sem tradução ficam iguais)
+            h["Função"] = h["role"].astype("category").cat.rename_categories(lambda r: role_map.get(r, r))
+            h["__start_dt"] = h["start"]   # já em datetime (leaders_for_iso3)
+            h["__end_dt"]   = h["end"]
             h["Início"] = h["__start_dt"].dt.strftime("%Y-%m-%d").fillna("")
             h["Fim"]    = h["__end_dt"].dt.strftime("%Y-%m-%d").fillna("")
 
@@ -576,8 +878,9 @@ def render_paises_tab():
                             .sort_values(["__ord"], ascending=[False])
                             .drop(columns="__ord"))
 
-            pres = _prep(h[h.get("role") == "head_of_state"])
-            gov  = _prep(h[h.get("role") == "head_of_government"])
+            by_role = _by_role(h)
+            pres = _prep(by_role.get("head_of_state"))
+            gov  = _prep(by_role.get("head_of_government"))
 
             c1, c2 = st.columns(2)
             with c1:
@@ -595,7 +898,7 @@ def render_paises_tab():
         if cities.empty:
             st.info("Sem cidades. Corre `scripts/fetch_cities.py`.")
         else:
-            c = cities.copy()
+            c = cities   # já é uma cópia própria (cache_data)
 
             # garantir colunas esperadas (incluindo lat/lon)
             for k in ("city","admin","type","is_capital","population","year","lat","lon"):
@@ -618,33 +921,25 @@ def render_paises_tab():
                 c["__year"] = pd.to_numeric(c["year"], errors="coerce")
                 c["__pop"]  = pd.to_numeric(c["population"], errors="coerce")
 
-                def _join_unique(series: pd.Series) -> str:
-                    vals = [str(x) for x in series.dropna().astype(str) if x]
-                    return ", ".join(sorted(set(vals))) if vals else ""
-
-                idx_latest = (
-                    c.sort_values(["city", "__year"], ascending=[True, True])
-                    .groupby("city", observed=False)["__year"].idxmax()
-                    .dropna()
-                    .astype(int)
-                )
-                if idx_latest.empty:
-                    idx_latest = (
-                        c.sort_values(["city", "__pop"], ascending=[True, True])
-                        .groupby("city", observed=False)["__pop"].idxmax()
-                        .dropna()
-                        .astype(int)
-                    )
-                if idx_latest.empty:
-                    idx_latest = c.groupby("city", observed=False).head(1).index
+                # linha "mais recente" por cidade num só groupby: ano mais recente;
+                # sem ano → maior população; sem nenhum → 1.ª linha (pop < 1e10, chave exata em float64)
+                key = c["__year"].fillna(-1).mul(1e10).add(c["__pop"].fillna(0))
+                idx_latest = key.groupby(c["city"], sort=False, observed=True).idxmax()
 
                 latest = c.loc[idx_latest, ["city","is_capital","population","__year"]].rename(
                     columns={"__year":"year"}
                 )
+                # valores únicos por cidade (agregação nativa) e join só uma vez por cidade;
+                # "type" não é agregado: a coluna Tipo é descartada antes de mostrar
                 agg = (
-                    c.groupby("city", as_index=False, observed=False)
-                    .agg(admin=("admin", _join_unique), type=("type", _join_unique))
+                    c.groupby("city", sort=False, observed=True)
+                    .agg(admin=("admin", "unique"))
+                    .reset_index()
                 )
+                agg["admin"] = [
+                    ", ".join(sorted({str(x) for x in a if pd.notna(x) and str(x)}))
+                    for a in agg["admin"]
+                ]
                 show = latest.merge(agg, on="city", how="left").rename(columns={
                     "city": "Cidade",
                     "admin": "Região (P131)",
@@ -657,17 +952,13 @@ def render_paises_tab():
                 if "Capital?" in show.columns:
                     show["Capital?"] = show["Capital?"].map({1:"Sim",0:"Não",True:"Sim",False:"Não"}).fillna("")
                 if "Ano" in show.columns:
-                    show["Ano"] = show["Ano"].apply(lambda x: "" if pd.isna(x) else str(int(x)))
+                    show["Ano"] = _fmt_year_col(show["Ano"])
+                # chave de ordenação numérica paralela à coluna de texto (merge "left" mantém a ordem de latest)
+                show["_pop"] = c.loc[idx_latest, "__pop"].fillna(0).to_numpy()
                 if "População" in show.columns:
-                    show["População"] = show["População"].apply(
-                        lambda v: "" if pd.isna(v) else f"{int(v):,}".replace(",", " ")
-                    )
+                    show["População"] = _fmt_int_col(show["População"])
 
                 show["_cap"] = show["Capital?"].eq("Sim") if "Capital?" in show.columns else False
-                show["_pop"] = (
-                    pd.to_numeric(show.get("População", 0).astype(str).str.replace(" ","").str.replace(",",""),
-                                errors="coerce").fillna(0)
-                )
                 show = show.sort_values(["_cap","_pop","Cidade"], ascending=[False, False, True]) \
                         .drop(columns=["_cap","_pop","Tipo"], errors="ignore")
                 cols = [c for c in ["Cidade","Capital?","Região (P131)","População","Ano"] if c in show.columns]
@@ -682,26 +973,24 @@ def render_paises_tab():
                 with colR:
                     st.markdown("**Mapa**")
 
-                    # garantir colunas e converter para float
-                    for k in ("lat", "lon"):
-                        if k not in c.columns:
-                            c[k] = pd.NA
-                    cc = c.copy()
-                    cc["lat"] = pd.to_numeric(cc["lat"], errors="coerce")
-                    cc["lon"] = pd.to_numeric(cc["lon"], errors="coerce")
+                    # lat/lon como colunas 1-D float64 (sem cópia do frame inteiro)
+                    lat = pd.to_numeric(c["lat"], errors="coerce").astype("float64")
+                    lon = pd.to_numeric(c["lon"], errors="coerce").astype("float64")
 
-                    # 1º par válido por cidade + valores plausíveis
+                    # 1º par válido por cidade + valores plausíveis (between com NaN → False)
+                    ok = lat.between(-90, 90) & lon.between(-180, 180)
                     pts = (
-                        cc.dropna(subset=["lat","lon"])
-                        .loc[cc["lat"].between(-90, 90) & cc["lon"].between(-180, 180),
-                            ["city","lat","lon"]]
+                        pd.DataFrame({"city": c["city"], "lat": lat, "lon": lon, "__pop": c["__pop"]})[ok]
                         .drop_duplicates(subset=["city"], keep="first")
                     )
+                    # muitos pontos → só os mais populosos (menos JSON para o browser)
+                    if len(pts) > _MAP_MAX_POINTS:
+                        pts = pts.nlargest(_MAP_MAX_POINTS, "__pop")
 
                     # diagnóstico rápido
                     n_total = len(c)
-                    n_has_any_lat = int(cc["lat"].notna().sum())
-                    n_has_any_lon = int(cc["lon"].notna().sum())
+                    n_has_any_lat = int(lat.notna().sum())
+                    n_has_any_lon = int(lon.notna().sum())
                     n_pts = len(pts)
 
                     if n_pts > 0:
@@ -712,14 +1001,14 @@ def render_paises_tab():
                             f"(linhas: {n_total}, com lat: {n_has_any_lat}, com lon: {n_has_any_lon}, válidas: {n_pts})"
                         )
                         if st.checkbox("ver amostra das coords brutas", key=f"dbg_map_{iso3}"):
-                            st.dataframe(cc[["city","lat","lon"]].head(20), use_container_width=True, hide_index=True)
+                            raw = pd.DataFrame({"city": c["city"], "lat": lat, "lon": lon}).head(20)
+                            st.dataframe(raw, use_container_width=True, hide_index=True)
 
     # -------- UNESCO
     with st.expander("Património Mundial (UNESCO)"):
         u = unesco_for_iso3(iso3)
 
         if not u.empty:
-            u = u.copy()
             for k in ("site_qid","site","type","year","lat","lon"):
                 if k not in u.columns:
                     u[k] = pd.NA
@@ -743,10 +1032,12 @@ def render_paises_tab():
                 })
             )
             u = u.rename(columns={"site":"Sítio","type":"Tipo","year":"Ano"})
-            u["Ano"] = u["Ano"].apply(_fmt_year)
+            u["Ano"] = _fmt_year_col(u["Ano"])
 
             if "Tipo" in u.columns:
-                u = u.sort_values("Tipo", ascending=True, kind="mergesort")
+                # poucas categorias distintas → ordenar pelos códigos (int) em vez de comparar strings
+                u["Tipo"] = u["Tipo"].astype("category")
+                u = u.sort_values("Tipo", ascending=True, kind="stable")
 
             cols = ["Sítio","Tipo","Ano","lat","lon"]
 
@@ -771,33 +1062,37 @@ def render_paises_tab():
             )
 
             if {"lat","lon"}.issubset(u.columns):
-                st.map(u[["lat","lon"]].dropna(), use_container_width=True)
+                ll = pd.DataFrame({
+                    "lat": pd.to_numeric(u["lat"], errors="coerce"),
+                    "lon": pd.to_numeric(u["lon"], errors="coerce"),
+                }).dropna().round(4)
+                if not ll.empty:
+                    # coluna a coluna (1-D) em vez de um bloco 2-D por linhas
+                    lat, lon = ll["lat"].to_numpy(), ll["lon"].to_numpy()
+                    pts = tuple(zip(lat.tolist(), lon.tolist()))
+                    st.pydeck_chart(
+                        pdk.Deck(layers=[_sites_layer(pts)], initial_view_state=_fit_view(lat, lon)),
+                        use_container_width=True,
+                    )
         else:
             st.caption("—")
 
     # -------- Medalhas olímpicas
     with st.expander("Medalhas olímpicas (Totais e por edição)"):
-        cdf = load_olympics_summer_csv()
-        if not cdf.empty:
-            cdf = cdf[cdf["iso3"].astype(str).str.upper() == iso3].copy()
+        cdf = load_olympics_summer_csv_for_iso3(iso3)   # já filtrado (e em cache) no loader
 
         if cdf.empty:
             st.caption("— sem dados de medalhas de Verão no CSV manual —")
         else:
             # ---- totais e gráfico ----
-            vals = (
+            # loader já devolve inteiros; uma só redução 2D (colunas em falta → 0)
+            arr = np.nan_to_num(
                 cdf.reindex(columns=["summer_gold", "summer_silver", "summer_bronze"])
-                .apply(pd.to_numeric, errors="coerce")
-                .fillna(0).astype(int)
-            )
-            g = int(vals["summer_gold"].sum())
-            s = int(vals["summer_silver"].sum())
-            b = int(vals["summer_bronze"].sum())
-
-            bar_df = pd.DataFrame(
-                {"Medalha": ["Ouro", "Prata", "Bronze"], "Quantidade": [int(g), int(s), int(b)]}
-            )
-            ymax = max(1, int(bar_df["Quantidade"].max() * 1.20))
+                   .to_numpy(dtype=np.float64, na_value=np.nan)
+            ).astype(np.int64)
+            qty = arr.sum(axis=0)
+            ymax = max(1, int(qty.max() * 1.20))
+            bar_df = pd.DataFrame({"Medalha": ["Ouro", "Prata", "Bronze"], "Quantidade": qty})
 
             fig = px.bar(
                 bar_df,
@@ -833,33 +1128,21 @@ def render_paises_tab():
             )
 
             # ---- tabela por edição ----
-            df_local = cdf.copy()
-            for c in ("year", "city", "host_country"):
-                if c not in df_local.columns:
-                    df_local[c] = pd.NA
+            # colunas em falta entram de uma vez (NaN); medalhas em falta ficam 0 após a coerção
+            needed = ["year", "city", "host_country", "summer_gold", "summer_silver", "summer_bronze"]
+            df_local = cdf.reindex(columns=list(cdf.columns) + [c for c in needed if c not in cdf.columns])
             for c in ("summer_gold", "summer_silver", "summer_bronze"):
-                if c not in df_local.columns:
-                    df_local[c] = 0
                 df_local[c] = pd.to_numeric(df_local[c], errors="coerce").fillna(0).astype(int)
             if "summer_total" not in df_local.columns:
                 df_local["summer_total"] = (
                     df_local["summer_gold"] + df_local["summer_silver"] + df_local["summer_bronze"]
                 )
-            if "year" in df_local.columns:
-                df_local["__year_num"] = pd.to_numeric(df_local["year"], errors="coerce")
-                sort_cols = ["__year_num"]
-            else:
-                sort_cols = ["summer_total"]
-
             show_cols = ["year", "city", "host_country",
                         "summer_gold", "summer_silver", "summer_bronze", "summer_total"]
-            show = (
-                df_local[show_cols + (["__year_num"] if "__year_num" in df_local.columns else [])]
-                .sort_values(by=sort_cols, ascending=True, na_position="last")
-                .drop(columns=["__year_num"], errors="ignore")
-                .reset_index(drop=True)
-            )
-            show_pt = show.rename(columns={
+            # ordem por ano (NaN no fim) sem coluna auxiliar
+            year_num = pd.to_numeric(df_local["year"], errors="coerce").to_numpy(dtype=float, na_value=np.nan)
+            order = np.argsort(year_num, kind="stable")
+            show_pt = df_local.iloc[order][show_cols].rename(columns={
                 "year": "Ano",
                 "city": "Cidade",
                 "host_country": "País anfitrião",
@@ -867,11 +1150,9 @@ def render_paises_tab():
                 "summer_silver": "Prata",
                 "summer_bronze": "Bronze",
                 "summer_total": "Total",
-            })
+            }).reset_index(drop=True)
             if "Ano" in show_pt.columns:
-                show_pt["Ano"] = show_pt["Ano"].apply(
-                    lambda v: "" if pd.isna(v) or str(v).strip()=="" else f"{int(pd.to_numeric(v, errors='coerce'))}"
-                )
+                show_pt["Ano"] = _fmt_year_col(show_pt["Ano"])
 
             # ---- layout lado a lado: tabela (esq) + gráfico (dir) ----
             col_tab, col_fig = st.columns([3, 2], gap="medium")
@@ -895,60 +1176,28 @@ def render_paises_tab():
     # -------- Religiões
     with st.expander("Religiões"):
         try:
-            rel = load_religion()
-            rr = rel[rel["iso3"] == iso3]
+            rr = religion_for_iso3(iso3)
         except Exception:
             rr = pd.DataFrame()
 
         if not rr.empty:
             r = rr.iloc[0]
-            items = [
-                ("Cristianismo",      float(r.get("christian",        0))),
-                ("Islamismo",         float(r.get("muslim",           0))),
-                ("Sem religião",      float(r.get("unaffiliated",     0))),
-                ("Hinduísmo",         float(r.get("hindu",            0))),
-                ("Budismo",           float(r.get("buddhist",         0))),
-                ("Religiões étnicas", float(r.get("folk_religions",   0))),
-                ("Outras",            float(r.get("other_religions",  0))),
-                ("Judaísmo",          float(r.get("jewish",           0))),
-            ]
-            df_rel = pd.DataFrame(items, columns=["Religião", "% População"])
-            df_rel["% População"] = pd.to_numeric(df_rel["% População"], errors="coerce").fillna(0.0)
+            # uma única coerção vetorizada (colunas em falta → 0)
+            vals = pd.to_numeric(r.reindex(_REL_CODES), errors="coerce").fillna(0.0).to_numpy(dtype=float)
+            df_rel = pd.DataFrame({"Religião": _REL_LABELS, "% População": vals})
             df_rel = df_rel.sort_values("% População", ascending=False).reset_index(drop=True)
 
             # texto formatado e posição do rótulo (ligeiro offset e clamp para não sair do gráfico)
-            df_rel["label"] = df_rel["% População"].map(lambda v: f"{v:.2f}")
-            df_rel["label_pos"] = (df_rel["% População"] + 0.8).clip(upper=99.2)  # 0.8 à direita, máximo 99.2
-
-            base = (
-                alt.Chart(df_rel)
-                .mark_bar()
-                .encode(
-                    y=alt.Y("Religião:N", sort="-x", title=""),
-                    x=alt.X("% População:Q",
-                            title="% população",
-                            scale=alt.Scale(domain=[0, 100])),   # eixo fixo 0–100
-                    tooltip=["Religião", alt.Tooltip("% População:Q", format=".2f")],
-                )
-                .properties(height=300)
-            )
-
-            labels = (
-                alt.Chart(df_rel)
-                .mark_text(align="left", baseline="middle", dx=3, color="#e6e6e6")  # texto claro p/ tema escuro
-                .encode(
-                    y="Religião:N",
-                    x="label_pos:Q",
-                    text="label:N",
-                )
-            )
+            pct = df_rel["% População"].to_numpy()
+            df_rel["label"] = np.char.mod("%.2f", pct)
+            df_rel["label_pos"] = np.minimum(pct + 0.8, 99.2)  # 0.8 à direita, máximo 99.2
 
             c1, c2,c3 = st.columns([1,8, 1])
             with c2:
-                st.altair_chart(base + labels, use_container_width=True)
+                st.vega_lite_chart(df_rel, dict(_REL_VL_SPEC), use_container_width=True)
 
 
-            st.caption(f"Ano de referência: {int(pd.to_numeric(r.get('source_year', 2010), errors='coerce'))}")
+            st.caption(f"Ano de referência: {_fmt_year(r.get('source_year', 2010))}")
         else:
             st.caption("— sem dados de religião em data/religion.csv —")
 
@@ -957,175 +1206,61 @@ def render_paises_tab():
     # -------- Turismo
     with st.expander("Turismo"):
         # Carrega dados (World Bank WDI + Eurostat quando existir)
-        #t_latest = load_tourism_latest()
-        t_ts     = load_tourism_ts()
-
-        # Mapas de rótulos e “tipos” para formatação
-        kmap = {
-            "ST.INT.ARVL":       "Chegadas (turistas internacionais)",
-            "ST.INT.DPRT":       "Partidas (turistas internacionais)",
-            "ST.INT.RCPT.CD":    "Receitas do turismo (US$ correntes)",
-            "ST.INT.XPND.CD":    "Despesas do turismo (US$ correntes)",
-            "ST.INT.RCPT.XP.ZS": "Receitas do turismo (% exportações)",
-            "ST.INT.XPND.MP.ZS": "Despesas do turismo (% importações)",
-        }
-        unit = {
-            "ST.INT.ARVL": "int",
-            "ST.INT.DPRT": "int",
-            "ST.INT.RCPT.CD": "money",
-            "ST.INT.XPND.CD": "money",
-            "ST.INT.RCPT.XP.ZS": "pct",
-            "ST.INT.XPND.MP.ZS": "pct",
-        }
-
-        def _fmt_value(v, kind, *, scale=None):
-            try:
-                v = float(v)
-            except Exception:
-                return "—"
-            if kind == "pct":
-                return f"{v:.1f}%"
-            if kind == "money":
-                # força escala (para o delta igualar a do valor principal)
-                if scale is None:
-                    scale = "B" if abs(v) >= 1e9 else ("M" if abs(v) >= 1e6 else None)
-                if scale == "B":
-                    return f"{v/1e9:.2f} B"
-                if scale == "M":
-                    return f"{v/1e6:.2f} M"
-                return f"{int(round(v)):,}".replace(",", " ")
-            # int
-            return f"{int(round(v)):,}".replace(",", " ")
-
-        def _fmt_delta(delta, kind, *, ref_value=None):
-            # pct em p.p.; dinheiro segue a escala do valor principal
-            if kind == "pct":
-                return f"{delta:+.1f} p.p."
-            if kind == "money":
-                ref_scale = "B" if (ref_value is not None and abs(ref_value) >= 1e9) else \
-                            ("M" if (ref_value is not None and abs(ref_value) >= 1e6) else None)
-                s = _fmt_value(delta, "money", scale=ref_scale)
-                return ("+" if delta > 0 else "") + s
-            # int
-            return f"{delta:+,.0f}".replace(",", " ")
-
-        def _latest_and_prev(df_all, code):
-            """Devolve (último, anterior) para um indicador."""
-            d = (
-                df_all[(df_all["iso3"]==iso3) & (df_all["indicator"]==code)]
-                .dropna(subset=["value"])
-                .sort_values("year")
-            )
-            if d.empty:
-                return None, None
-            last = d.iloc[-1]
-            prev = d.iloc[-2] if len(d) > 1 else None
-            return last, prev
-
         # ───────────────────────── Cards (mostram o ANO e delta vs ano anterior)
-        cols = st.columns(3)
-        i = 0
-        for code, label in kmap.items():
-            last, prev = _latest_and_prev(t_ts, code)
-            if last is None:
-                continue
-            year = int(last["year"])
-            val  = float(last["value"])
-
-            # valor principal
-            val_txt = _fmt_value(val, unit.get(code, "int"))
-
-            # delta na mesma escala
-            delta_txt = ""
-            if prev is not None and pd.notna(prev["value"]):
-                delta = val - float(prev["value"])
-                delta_txt = _fmt_delta(delta, unit.get(code, "int"), ref_value=val)
-
-            cols[i % 3].metric(f"{label} · {year}", val_txt, delta=delta_txt)
-            i += 1
-
-       
+        # lookup (iso3, indicador) pré-indexado e já ordenado por ano; último/penúltimo por grupo
+        _render_metric_cards(_tourism_cards(tourism_ts_for_iso3(iso3, _TOUR_KMAP)))
+
         # ───────────────────────── Série temporal (turismo — últimos 20 anos, comparativo)
         _FRAG = getattr(st, "fragment", None)
-
-        def _tourism_timeseries_compare(iso3: str, t_ts: pd.DataFrame, kmap: dict):
-            # 3 visões (pares de indicadores)
-            VIEWS = {
-                "Receitas vs Despesas (US$ correntes)": {
-                    "codes": ["ST.INT.RCPT.CD", "ST.INT.XPND.CD"],
-                    "y_title": "US$ correntes",
-                },
-                "% Receitas vs % Despesas": {
-                    "codes": ["ST.INT.RCPT.XP.ZS", "ST.INT.XPND.MP.ZS"],
-                    "y_title": "%",
-                },
-                "Chegadas vs Partidas": {
-                    "codes": ["ST.INT.ARVL", "ST.INT.DPRT"],
-                    "y_title": "Número de pessoas",
-                },
-            }
-
-            view_label = st.selectbox(
-                "Série temporal (turismo — últimos 20 anos)",
-                list(VIEWS.keys()),
-                index=0,
-                key=f"tour_series_cmp_{iso3}",
-            )
-            codes = VIEWS[view_label]["codes"]
-            y_title = VIEWS[view_label]["y_title"]
+        _SEG  = getattr(st, "segmented_control", None)  # Streamlit ≥ 1.40
+
+        def _tourism_timeseries_compare(iso3: str, kmap: dict):
+            views = list(_TOUR_VIEWS.keys())
+            if _SEG is not None:
+                # 3 vistas fixas: botões em vez de dropdown (sem ciclo abrir/fechar)
+                view_label = _SEG(
+                    "Série temporal (turismo — últimos 20 anos)",
+                    views,
+                    default=views[0],
+                    key=f"tour_series_cmp_{iso3}",
+                ) or views[0]  # desmarcar devolve None
+            else:
+                view_label = st.selectbox(
+                    "Série temporal (turismo — últimos 20 anos)",
+                    views,
+                    index=0,
+                    key=f"tour_series_cmp_{iso3}",
+                )
+            codes = list(_TOUR_VIEWS[view_label]["codes"])
+            y_title = _TOUR_VIEWS[view_label]["y_title"]
 
             # prepara dataset longo (year, metric, value)
-            base = (
-                t_ts[(t_ts["iso3"] == iso3) & (t_ts["indicator"].isin(codes))]
-                .dropna(subset=["value"]).copy()
-            )
+            base = tourism_ts_for_iso3(iso3, codes).dropna(subset=["value"])
             if base.empty:
                 st.caption("— sem série temporal para os indicadores selecionados —")
                 return
 
-            base["year"] = pd.to_numeric(base["year"], errors="coerce").astype("Int64")
-            base = (
-                base.dropna(subset=["year"])
-                    .sort_values(["indicator", "year"])
-                    .drop_duplicates(subset=["indicator", "year"], keep="last")
+            # já vem ordenado por (indicador, ano) do índice pré-construído: sem sort aqui
+            base = base.assign(year=pd.to_numeric(base["year"], errors="coerce")).dropna(subset=["year"])
+            base = base.assign(year=base["year"].astype("int64")).drop_duplicates(
+                subset=["indicator", "year"], keep="last"
             )
 
-            # últimos 20 anos (por segurança, corta após unir tudo)
-            # renomeia para label PT na legenda
-            label_map = {c: kmap.get(c, c) for c in codes}
-            base["metric"] = base["indicator"].map(label_map)
-
             # recorte estrito 20 anos mais recentes considerando o conjunto
-            most_recent_years = (
-                base[["year"]].drop_duplicates().sort_values("year").tail(20)["year"].tolist()
-            )
-            sub = base[base["year"].isin(most_recent_years)].copy()
-
-            if sub.empty:
+            # (np.unique já devolve ordenado; os 20 últimos anos distintos = tudo >= ao 20.º)
+            years = np.unique(base["year"].to_numpy())
+            if years.size == 0:
                 st.caption("— sem observações nos últimos 20 anos —")
                 return
+            y_min, y_max = int(years[-20:][0]), int(years[-1])
 
-            y_min, y_max = int(min(most_recent_years)), int(max(most_recent_years))
+            # renomeia para label PT na legenda
+            label_map = {c: kmap.get(c, c) for c in codes}
+            sub = base[base["year"] >= y_min].assign(metric=lambda d: d["indicator"].map(label_map))
 
-            st.altair_chart(
-                alt.Chart(sub)
-                .mark_line(point=True)
-                .encode(
-                    x=alt.X(
-                        "year:Q",
-                        title="Ano",
-                        scale=alt.Scale(domain=[y_min, y_max]),
-                        axis=alt.Axis(format="d"),
-                    ),
-                    y=alt.Y("value:Q", title=y_title),
-                    color=alt.Color("metric:N", title="", sort=list(label_map.values())),
-                    tooltip=[
-                        alt.Tooltip("metric:N", title="Indicador"),
-                        alt.Tooltip("year:Q", title="Ano", format="d"),
-                        alt.Tooltip("value:Q", title="Valor", format=",.0f"),
-                    ],
-                )
-                .properties(height=260),
+            st.vega_lite_chart(
+                sub[["year", "metric", "value"]],
+                _tour_line_spec(y_min, y_max, y_title, list(label_map.values())),
                 use_container_width=True,
             )
 
@@ -1133,7 +1268,7 @@ def render_paises_tab():
         if _FRAG:
             _tourism_timeseries_compare = _FRAG(_tourism_timeseries_compare)
 
-        _tourism_timeseries_compare(iso3, t_ts, kmap)
+        _tourism_timeseries_compare(iso3, _TOUR_KMAP)
 
 
         st.markdown("---")
@@ -0,0 +1,69 @@
+# scripts/build_parquet_cache.py
+# -*- coding: utf-8 -*-
+"""
+Converte os CSVs por ISO3 em parquet ao lado do original:
+  data/migration_timeseries.csv -> data/migration_timeseries.parquet
+  data/migration_latest.csv     -> data/migration_latest.parquet
+  data/tourism_timeseries.csv   -> data/tourism_timeseries.parquet
+  data/tourism_latest.csv       -> data/tourism_latest.parquet
+  data/religion.csv             -> data/religion.parquet
+
+O services/offline_store.py usa o .parquet quando existe e é mais recente que o CSV
+(migração: filtro por ISO3 na leitura, via pyarrow; turismo/religião: tipos já gravados,
+iso3/indicator como category); caso contrário continua a ler o CSV.
+Voltar a correr sempre que os CSVs forem regenerados. Requer pyarrow.
+"""
+
+from __future__ import annotations
+from pathlib import Path
+
+import pandas as pd
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+DATA_DIR = PROJECT_ROOT / "data"
+
+_WB_LONG = {"iso3": "string", "country": "string", "indicator": "category",
+            "indicator_name": "category", "year": "Int64", "value": "float64"}
+_RELIGION = {"iso3": "string", "country": "string",
+             **{c: "float64" for c in ("christian","muslim","unaffiliated","hindu","buddhist",
+                                       "folk_religions","other_religions","jewish")},
+             "source_year": "Int64"}
+
+# CSV -> (dtypes, separador, ordenação, iso3 categórico?)
+# iso3 ordenado: row groups ficam agrupados por país. A migração mantém iso3 string (filtro pyarrow na leitura).
+TARGETS = {
+    DATA_DIR / "migration_timeseries.csv": ({"iso3": "string", "indicator": "string", "year": "Int64", "value": "float"},
+                                            ",", ["iso3", "indicator", "year"], False),
+    DATA_DIR / "migration_latest.csv":     ({"iso3": "string", "indicator": "string", "year": "Int64", "value": "float"},
+                                            ",", ["iso3", "indicator", "year"], False),
+    DATA_DIR / "tourism_timeseries.csv":   (_WB_LONG, ";", ["iso3", "indicator", "year"], True),
+    DATA_DIR / "tourism_latest.csv":       (_WB_LONG, ";", ["iso3", "indicator", "year"], True),
+    DATA_DIR / "religion.csv":             (_RELIGION, ",", ["iso3"], True),
+}
+
+
+def convert(csv_path: Path, dtypes: dict[str, str], sep: str = ",",
+            sort_by: list[str] | None = None, iso3_category: bool = False) -> Path | None:
+    if not csv_path.exists():
+        print(f"[skip] {csv_path.name} não existe")
+        return None
+    head = pd.read_csv(csv_path, sep=sep, nrows=0).columns
+    usecols = [c for c in dtypes if c in head]
+    df = pd.read_csv(csv_path, sep=sep, usecols=usecols, dtype={c: dtypes[c] for c in usecols})
+    df["iso3"] = df["iso3"].str.upper()
+    df = df.sort_values(sort_by or ["iso3"], kind="stable").reset_index(drop=True)
+    if iso3_category:
+        df["iso3"] = df["iso3"].astype("category")   # dicionário no parquet; volta como category
+    out = csv_path.with_suffix(".parquet")
+    df.to_parquet(out, index=False, engine="pyarrow", compression="zstd", row_group_size=50_000)
+    print(f"[ok] {csv_path.name} -> {out.name} ({len(df)} linhas)")
+    return out
+
+
+def main() -> None:
+    for csv_path, (dtypes, sep, sort_by, iso3_category) in TARGETS.items():
+        convert(csv_path, dtypes, sep, sort_by, iso3_category)
+
+
+if __name__ == "__main__":
+    main()
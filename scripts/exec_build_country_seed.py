@@ -2,20 +2,43 @@
 # -*- coding: utf-8 -*-
 from __future__ import annotations
 from pathlib import Path
-import csv, re, sys, os
+import re, sys, os
 import subprocess
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import pandas as pd
 
 PROJECT_ROOT = Path(__file__).resolve().parent.parent
 DATA_DIR     = PROJECT_ROOT / "data"
 OUT_SEED     = DATA_DIR / "countries_seed.csv"
 
+# Scripts auxiliares: quantos correm em paralelo (são I/O-bound, HTTP) e dependências entre eles
+AUX_MAX_WORKERS = 4
+# o WDQS (e a API do Wikidata) limita pedidos em simultâneo por IP e o fetch_cities sozinho já usa
+# esse limite todo: estes scripts correm um de cada vez, por esta ordem
+WIKIDATA_CHAIN = [
+    "extract_country_data.py",
+    "fetch_leaders.py",
+    "fetch_unesco.py",
+    "fetch_cities.py",
+    "fetch_cities - Copy.py",
+    "fetch_olympics.py",
+]
+AUX_DEPENDS_ON = {
+    "build_parquet_cache.py": {"fetch_migration.py"},     # converte os CSVs de migração
+    # cada um espera por todos os anteriores da cadeia (continua sequencial se faltar algum)
+    **{n: set(WIKIDATA_CHAIN[:i]) for i, n in enumerate(WIKIDATA_CHAIN) if i},
+}
+AUX_LOG_DIR = PROJECT_ROOT / "logs"   # saída de cada script auxiliar: logs/<script>.log
+
 # Quais CSVs manter durante a limpeza
 KEEP_CSV_NAMES = {"demografia_mundial.csv","index.csv","olympics_summer_manual.csv"}  # case-insensitive
 
+# uma só passagem, pré-compilada: corridas de não-palavra e "_" → um "_"
+_SLUG_RE = re.compile(r"(?:[^\w\-]|_)+")
+
 def slugify(s: str) -> str:
-    s = re.sub(r"[^\w\-]+", "_", s, flags=re.U)
-    s = re.sub(r"_+", "_", s).strip("_")
-    return s or "pais"
+    return _SLUG_RE.sub("_", s).strip("_") or "pais"
 
 def purge_csvs_except_demografia() -> None:
     """
@@ -23,18 +46,29 @@ def purge_csvs_except_demografia() -> None:
     Útil para forçar refresh limpo antes de reconstruir datasets.
     """
     DATA_DIR.mkdir(parents=True, exist_ok=True)
+    keep = {n.lower() for n in KEEP_CSV_NAMES}   # uma vez, fora do loop
     deleted = 0
-    for p in DATA_DIR.rglob("*.csv"):
-        try:
-            if p.name.lower() in {n.lower() for n in KEEP_CSV_NAMES}:
+    # os.walk + strings: não cria Path por ficheiro (a árvore de data/ pode ser grande)
+    for root, _, files in os.walk(DATA_DIR):
+        for fn in files:
+            low = fn.lower()
+            if not low.endswith(".csv") or low in keep:
                 continue
-            p.unlink()
-            deleted += 1
-        except Exception as e:
-            print(f"⚠️ Não consegui apagar {p}: {e}", file=sys.stderr)
+            fp = os.path.join(root, fn)
+            try:
+                os.unlink(fp)
+                deleted += 1
+            except Exception as e:
+                print(f"⚠️ Não consegui apagar {fp}: {e}", file=sys.stderr)
     print(f"🧹 Limpeza concluída: removidos {deleted} CSV(s) (preservado(s): {', '.join(KEEP_CSV_NAMES)})")
 
-def build_seed() -> None:
+SEED_COLS = ["iso2", "iso3", "name_en", "name_pt", "slug"]
+
+def build_seed_df() -> pd.DataFrame:
+    """
+    Seed de países (pycountry + nomes PT via Babel, se houver) como DataFrame.
+    Usado aqui e no ensure_seed do extract_country_data.py (uma só fonte).
+    """
     try:
         import pycountry
     except Exception:
@@ -52,29 +86,42 @@ def build_seed() -> None:
     except Exception:
         pass
 
-    rows = []
-    for c in pycountry.countries:
-        iso2 = getattr(c, "alpha_2", "").upper()
-        iso3 = getattr(c, "alpha_3", "").upper()
-        if not iso2:
-            continue
-        name_en = (
-            getattr(c, "common_name", None)
-            or getattr(c, "official_name", None)
-            or getattr(c, "name", "")
-        )
-        nm_pt = name_pt.get(iso2, "")
-        slug = slugify(nm_pt or name_en or iso2)
-        rows.append(
-            {"iso2": iso2, "iso3": iso3, "name_en": name_en, "name_pt": nm_pt, "slug": slug}
+    # uma passagem pelo pycountry; o resto é por coluna
+    recs = [
+        (
+            getattr(c, "alpha_2", "").upper(),
+            getattr(c, "alpha_3", "").upper(),
+            getattr(c, "common_name", None) or getattr(c, "official_name", None) or getattr(c, "name", ""),
         )
+        for c in pycountry.countries
+    ]
+    df = pd.DataFrame(recs, columns=["iso2", "iso3", "name_en"])
+    df = df[df["iso2"] != ""].reset_index(drop=True)
+    df["name_pt"] = df["iso2"].map(name_pt).fillna("")
+    base = df["name_pt"].where(df["name_pt"] != "", df["name_en"])
+    base = base.where(base != "", df["iso2"])
+    df["slug"] = base.map(slugify)
+    return df[SEED_COLS]
 
+def build_seed() -> None:
+    df = build_seed_df()
     OUT_SEED.parent.mkdir(parents=True, exist_ok=True)
-    with OUT_SEED.open("w", newline="", encoding="utf-8") as f:
-        w = csv.DictWriter(f, fieldnames=["iso2", "iso3", "name_en", "name_pt", "slug"])
-        w.writeheader()
-        w.writerows(rows)
-    print(f"✔️ Escrevi {OUT_SEED} ({len(rows)} países)")
+    df.to_csv(OUT_SEED, index=False, encoding="utf-8")
+    print(f"✔️ Escrevi {OUT_SEED} ({len(df)} países)")
+
+def _is_entry_point(path: Path) -> bool:
+    """Script executável (tem bloco if __name__ == "__main__"), não um módulo auxiliar."""
+    try:
+        return '__name__ == "__main__"' in path.read_text(encoding="utf-8", errors="ignore")
+    except OSError:
+        return False
+
+def _log_tail(path: Path, n: int = 20) -> str:
+    """Últimas n linhas de um log (para mostrar junto ao erro)."""
+    try:
+        return "\n".join(path.read_text(encoding="utf-8", errors="replace").splitlines()[-n:])
+    except OSError:
+        return ""
 
 def run_aux_scripts() -> None:
     """
@@ -102,21 +149,71 @@ def run_aux_scripts() -> None:
     # 1) pega nos preferidos que existam
     to_run = [SCRIPTS_DIR / s for s in preferred_order if (SCRIPTS_DIR / s).exists()]
 
-    # 2) acrescenta quaisquer outros .py na pasta (exclui este próprio ficheiro e já listados)
+    # 2) acrescenta quaisquer outros .py na pasta (exclui este próprio ficheiro, já listados e
+    #    módulos só importados pelos scripts, como wdqs_cache.py: sem bloco __main__ não correm)
     others = [
         p for p in sorted(SCRIPTS_DIR.glob("*.py"))
-        if p.name not in preferred_order and p.name != SELF_NAME
+        if p.name not in preferred_order and p.name != SELF_NAME and _is_entry_point(p)
     ]
     to_run.extend(others)
 
-    print("\n=== A executar scripts auxiliares ===")
-    for script in to_run:
-        print(f"▶ {script.name}")
-        result = subprocess.run([sys.executable, str(script)], cwd=str(SCRIPTS_DIR))
-        if result.returncode != 0:
-            print(f"✖ {script.name} falhou (exit {result.returncode}). A interromper.")
-            break
-    else:
+    # dependências: as declaradas + "outros" só depois dos preferidos (mantém a ordem antiga)
+    names = [p.name for p in to_run]
+    preferred_set = {n for n in names if n in preferred_order}
+    deps = {}
+    for n in names:
+        d = set(AUX_DEPENDS_ON.get(n, set()))
+        if n not in preferred_set:
+            d |= preferred_set
+        deps[n] = d & set(names)   # ignora dependências que não existem na pasta
+
+    # saída em ficheiro por script (-u: sem buffer, dá para seguir com tail -f enquanto corre)
+    AUX_LOG_DIR.mkdir(parents=True, exist_ok=True)
+
+    def _log_path(script: Path) -> Path:
+        return AUX_LOG_DIR / f"{script.stem}.log"
+
+    def _run(script: Path) -> subprocess.CompletedProcess:
+        with _log_path(script).open("w", encoding="utf-8") as log:
+            return subprocess.run([sys.executable, "-u", str(script)], cwd=str(SCRIPTS_DIR),
+                                  stdout=log, stderr=subprocess.STDOUT, text=True)
+
+    print(f"\n=== A executar scripts auxiliares (até {AUX_MAX_WORKERS} em paralelo; saída em {AUX_LOG_DIR}) ===")
+    pending = list(to_run)
+    done, failed = set(), None
+    running = {}
+    with ThreadPoolExecutor(max_workers=AUX_MAX_WORKERS) as ex:
+        while pending or running:
+            if failed is None:
+                for script in [p for p in pending if deps[p.name] <= done]:
+                    print(f"▶ {script.name}  → {_log_path(script)}")
+                    running[ex.submit(_run, script)] = script
+                    pending.remove(script)
+            if not running:
+                break   # dependências por satisfazer (falha a montante)
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for fut in finished:
+                script = running.pop(fut)
+                try:
+                    result = fut.result()
+                except Exception as e:
+                    print(f"✖ {script.name} não arrancou: {e}")
+                    failed = failed or script.name
+                    continue
+                if result.returncode != 0:
+                    print(f"✖ {script.name} falhou (exit {result.returncode}). A interromper.")
+                    print(_log_tail(_log_path(script)), file=sys.stderr)
+                    failed = failed or script.name
+                else:
+                    print(f"✔ {script.name}")
+                    done.add(script.name)
+            if failed is not None:
+                # os que ainda não arrancaram já não correm; os que estão a correr terminam
+                for fut in running:
+                    fut.cancel()
+                pending.clear()
+
+    if failed is None:
         print("✔ Todos os scripts concluídos.")
 
 if __name__ == "__main__":
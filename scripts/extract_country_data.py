@@ -1,7 +1,8 @@
 # scripts/extract_country_data.py
 # -*- coding: utf-8 -*-
 from __future__ import annotations
-import csv, os, re, sys, time, gc
+import csv, json, os, sys, time, gc
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Dict, Any, List, Optional
 
@@ -14,6 +15,7 @@ from urllib3.util.retry import Retry
 PROJECT_ROOT = Path(__file__).resolve().parent.parent
 SEED_PATH    = PROJECT_ROOT / "data" / "countries_seed.csv"
 OUT_PATH     = PROJECT_ROOT / "data" / "countries_profiles.csv"
+QID_CACHE_PATH = PROJECT_ROOT / "data" / "wd_qid_cache.json"   # iso2 -> QID (wbsearchentities)
 
 # ───────── http ─────────
 WIKIDATA_API  = "https://www.wikidata.org/w/api.php"
@@ -31,6 +33,8 @@ def session() -> requests.Session:
 
 SESSION = session()
 HTTP_SLEEP_SECONDS = 0.15
+# pedidos Wikidata em simultâneo (keep-alive na mesma Session; cada um mantém o sleep de cortesia)
+WD_MAX_WORKERS = 4
 
 def _sleep():
     if HTTP_SLEEP_SECONDS: time.sleep(HTTP_SLEEP_SECONDS)
@@ -42,10 +46,11 @@ def http_get(url, params=None, timeout=12):
     return r
 
 # ───────── utils ─────────
-def slugify(s: str) -> str:
-    s = re.sub(r"[^\w\-]+", "_", s, flags=re.U)
-    s = re.sub(r"_+", "_", s).strip("_")
-    return s or "pais"
+# o mesmo slugify do seed (nomes de país → slug)
+try:
+    from exec_build_country_seed import slugify
+except ImportError:   # python -m scripts.extract_country_data
+    from scripts.exec_build_country_seed import slugify
 
 def claim_quantity(claim: dict) -> Optional[float]:
     try:
@@ -65,7 +70,23 @@ def claim_time_year(claim: dict) -> Optional[int]:
         return None
 
 # ───────── Wikidata helpers ─────────
-def wd_search_qid_by_name(name_pt: str, name_en: str) -> Optional[str]:
+def load_qid_cache() -> Dict[str, str]:
+    try:
+        return json.loads(QID_CACHE_PATH.read_text(encoding="utf-8"))
+    except Exception:
+        return {}
+
+def save_qid_cache(cache: Dict[str, str]) -> None:
+    # escrita atómica: tmp + replace (um crash não deixa JSON truncado)
+    tmp = QID_CACHE_PATH.with_suffix(".json.tmp")
+    tmp.write_text(json.dumps(cache, ensure_ascii=False, indent=0, sort_keys=True), encoding="utf-8")
+    os.replace(tmp, QID_CACHE_PATH)
+
+def wd_search_qid_by_name(name_pt: str, name_en: str, iso2: str = "",
+                          cache: Optional[Dict[str, str]] = None) -> Optional[str]:
+    """QID do país; com `cache` (iso2 -> QID) só vai à API quando o iso2 ainda não é conhecido."""
+    if cache is not None and iso2 and cache.get(iso2):
+        return cache[iso2]
     for lang, name in (("pt", name_pt), ("en", name_en)):
         if not name: continue
         try:
@@ -74,80 +95,102 @@ def wd_search_qid_by_name(name_pt: str, name_en: str) -> Optional[str]:
                 "type":"item","limit":1,"format":"json"
             }, timeout=10)
             arr = r.json().get("search", [])
-            if arr: return arr[0]["id"]
+            if arr:
+                if cache is not None and iso2:
+                    cache[iso2] = arr[0]["id"]
+                return arr[0]["id"]
         except Exception:
             continue
     return None
 
 def wd_getentities(ids: List[str], props="labels|claims|sitelinks", languages="pt|en") -> Dict[str, Any]:
-    out: Dict[str, Any] = {}
-    for i in range(0, len(ids), 50):
-        chunk = ids[i:i+50]
+    def _fetch(chunk: List[str]) -> Dict[str, Any]:
         try:
             r = http_get(WIKIDATA_API, {
                 "action":"wbgetentities","ids":"|".join(chunk),
                 "props":props,"languages":languages,"format":"json"
             }, timeout=12)
-            out.update(r.json().get("entities", {}))
+            return r.json().get("entities", {})
         except Exception as e:
             print(f"[wbgetentities] {e}", file=sys.stderr)
+            return {}
+
+    chunks = [ids[i:i+50] for i in range(0, len(ids), 50)]
+    out: Dict[str, Any] = {}
+    if len(chunks) <= 1:
+        for chunk in chunks:
+            out.update(_fetch(chunk))
+        return out
+    with ThreadPoolExecutor(max_workers=min(WD_MAX_WORKERS, len(chunks))) as ex:
+        for ents in ex.map(_fetch, chunks):
+            out.update(ents)
     return out
 
+def _pick_label(e: dict, lang="pt") -> Optional[str]:
+    lbl = e.get("labels", {})
+    return (lbl.get(lang, {}) or {}).get("value") or (lbl.get("en", {}) or {}).get("value")
+
 def wd_label(qid: str, lang="pt") -> Optional[str]:
     ents = wd_getentities([qid], props="labels", languages=f"{lang}|en")
-    e = ents.get(qid, {})
-    return e.get("labels", {}).get(lang, {}).get("value") or e.get("labels", {}).get("en", {}).get("value")
+    return _pick_label(ents.get(qid, {}), lang)
+
+def wd_labels_bulk(qids, lang="pt") -> Dict[str, str]:
+    """{qid: label pt (ou en)} para muitos QIDs — wbgetentities em lotes de 50."""
+    qids = sorted({q for q in qids if q})
+    if not qids:
+        return {}
+    ents = wd_getentities(qids, props="labels", languages=f"{lang}|en")
+    return {q: lab for q in qids if (lab := _pick_label(ents.get(q, {}) or {}, lang))}
 
 # ───────── seed helpers ─────────
 def ensure_seed() -> pd.DataFrame:
     if SEED_PATH.exists():
-        return pd.read_csv(SEED_PATH)
-    # criar seed com pycountry (sem Babel para não exigir deps)
+        return pd.read_csv(SEED_PATH, dtype=str, keep_default_na=False)  # "NA" = Namíbia
+    # mesmo seed que o exec_build_country_seed.py (pycountry + nomes PT se houver Babel)
     try:
-        import pycountry
-    except Exception:
-        print("❌ Falta 'pycountry'. Instala com: pip install pycountry", file=sys.stderr)
-        sys.exit(1)
-    rows = []
-    for c in pycountry.countries:
-        iso2 = getattr(c, "alpha_2", "").upper()
-        iso3 = getattr(c, "alpha_3", "").upper()
-        if not iso2: continue
-        name_en = getattr(c, "common_name", None) or getattr(c, "official_name", None) or getattr(c, "name", "")
-        rows.append({"iso2": iso2, "iso3": iso3, "name_en": name_en, "name_pt": "", "slug": slugify(name_en or iso2)})
-    df = pd.DataFrame(rows, columns=["iso2","iso3","name_en","name_pt","slug"])
+        from exec_build_country_seed import build_seed_df
+    except ImportError:   # python -m scripts.extract_country_data
+        from scripts.exec_build_country_seed import build_seed_df
+    df = build_seed_df()
     SEED_PATH.parent.mkdir(parents=True, exist_ok=True)
     df.to_csv(SEED_PATH, index=False, encoding="utf-8")
     print(f"[seed] criado {SEED_PATH} ({len(df)} países)", file=sys.stderr)
     return df
 
 # ───────── perfil por QID (sem SPARQL) ─────────
-def profile_from_qid(qid: str, fallback_name: str) -> Dict[str, Any]:
-    prof = {
-        "qid": qid, "name": fallback_name, "capital": "", "capital_qid": "",
+def _empty_profile(qid: str, name: str) -> Dict[str, Any]:
+    return {
+        "qid": qid, "name": name, "capital": "", "capital_qid": "",
         "inception": "", "area_km2": "", "head_of_government": "", "hog_party": "",
         "population": "", "population_year": ""
     }
+
+def _claim_id(claims: list) -> Optional[str]:
+    try:
+        return claims[0]["mainsnak"]["datavalue"]["value"]["id"]
+    except Exception:
+        return None
+
+def _profile_from_entity(ent: dict, qid: str, fallback_name: str) -> tuple[Dict[str, Any], Optional[str]]:
+    """
+    Perfil a partir de uma entidade já descarregada (sem HTTP).
+    Devolve (perfil, hog_qid); os labels de capital/HOG/partido são resolvidos depois, em lote.
+    """
+    prof = _empty_profile(qid, fallback_name)
+    hog_q = None
     try:
-        ent = wd_getentities([qid], props="labels|claims|sitelinks", languages="pt|en").get(qid, {}) or {}
+        claims = ent.get("claims", {})
         # nome
-        lbl = ent.get("labels", {})
-        prof["name"] = (lbl.get("pt", {}) or {}).get("value") or (lbl.get("en", {}) or {}).get("value") or fallback_name
-        # capital (P36)
-        cap = (ent.get("claims", {}).get("P36") or [])
-        if cap:
-            try:
-                cap_qid = cap[0]["mainsnak"]["datavalue"]["value"]["id"]
-                prof["capital_qid"] = cap_qid
-                prof["capital"] = wd_label(cap_qid, "pt") or wd_label(cap_qid, "en") or ""
-            except Exception: pass
+        prof["name"] = _pick_label(ent) or fallback_name
+        # capital (P36) — label resolvido em lote
+        prof["capital_qid"] = _claim_id(claims.get("P36") or []) or ""
         # área (P2046)
-        ar = (ent.get("claims", {}).get("P2046") or [])
+        ar = (claims.get("P2046") or [])
         if ar:
             v = claim_quantity(ar[0]); prof["area_km2"] = int(v) if v else ""
         # população (P1082) mais recente
         best = None
-        for c in (ent.get("claims", {}).get("P1082") or []):
+        for c in (claims.get("P1082") or []):
             v = claim_quantity(c); y = claim_time_year(c)
             if v is None: continue
             key = (y if y is not None else -1, v)
@@ -155,17 +198,17 @@ def profile_from_qid(qid: str, fallback_name: str) -> Dict[str, Any]:
         if best:
             prof["population"] = best[1]; prof["population_year"] = best[2] or ""
         # independência (P730) ou P571
-        indep = ent.get("claims", {}).get("P730") or []
+        indep = claims.get("P730") or []
         if indep:
             try: prof["inception"] = indep[0]["mainsnak"]["datavalue"]["value"]["time"][1:11]
             except Exception: pass
         else:
-            p571 = ent.get("claims", {}).get("P571") or []
+            p571 = claims.get("P571") or []
             if p571:
                 try: prof["inception"] = p571[0]["mainsnak"]["datavalue"]["value"]["time"][1:11]
                 except Exception: pass
-        # chefe de governo (P6)
-        hog_claims = ent.get("claims", {}).get("P6") or []
+        # chefe de governo (P6): o sem fim (P582) ou, na falta, o de início (P580) mais recente
+        hog_claims = claims.get("P6") or []
         def _claim_year(cl):
             try:
                 q = cl.get("qualifiers", {}).get("P580", [])
@@ -182,32 +225,52 @@ def profile_from_qid(qid: str, fallback_name: str) -> Dict[str, Any]:
         if current is None and hog_claims:
             current = max(hog_claims, key=_claim_year)
         if current:
-            try:
-                hog_q = current["mainsnak"]["datavalue"]["value"]["id"]
-                prof["head_of_government"] = wd_label(hog_q, "pt") or wd_label(hog_q, "en") or ""
-                ent_hog = wd_getentities([hog_q], props="claims", languages="en").get(hog_q, {}) or {}
-                party = ent_hog.get("claims", {}).get("P102") or []
-                if party:
-                    party_q = party[0]["mainsnak"]["datavalue"]["value"]["id"]
-                    prof["hog_party"] = wd_label(party_q, "pt") or wd_label(party_q, "en") or ""
-            except Exception:
-                pass
-
+            hog_q = _claim_id([current])
     except Exception as e:
         print(f"[enrich] {qid}: {e}", file=sys.stderr)
-    return prof
+    return prof, hog_q
+
+def profiles_from_qids(items: List[tuple[str, str]]) -> List[Dict[str, Any]]:
+    """
+    Perfis para vários (qid, nome_fallback) com poucos pedidos HTTP:
+      1) entidades dos países (lotes de 50)
+      2) labels de capitais + chefes de governo (lotes de 50)
+      3) claims P102 dos chefes de governo (lotes de 50) → 4) labels dos partidos
+    """
+    ents = wd_getentities([q for q, _ in items], props="labels|claims|sitelinks", languages="pt|en")
+    parsed = [_profile_from_entity(ents.get(q, {}) or {}, q, name) for q, name in items]
+
+    hog_qids = {h for _, h in parsed if h}
+    # 2) e 3) não dependem um do outro: vão em paralelo
+    with ThreadPoolExecutor(max_workers=2) as ex:
+        f_labels = ex.submit(wd_labels_bulk, {p["capital_qid"] for p, _ in parsed} | hog_qids)
+        f_hog = ex.submit(wd_getentities, sorted(hog_qids), "claims", "en") if hog_qids else None
+        labels = f_labels.result()
+        hog_ents = f_hog.result() if f_hog is not None else {}
+    party_of = {h: _claim_id((hog_ents.get(h, {}) or {}).get("claims", {}).get("P102") or []) for h in hog_qids}
+    labels.update(wd_labels_bulk(party_of.values()))
+
+    out = []
+    for prof, hog_q in parsed:
+        prof["capital"] = labels.get(prof["capital_qid"], "") if prof["capital_qid"] else ""
+        if hog_q:
+            prof["head_of_government"] = labels.get(hog_q, "")
+            prof["hog_party"] = labels.get(party_of.get(hog_q) or "", "")
+        out.append(prof)
+    return out
+
+def profile_from_qid(qid: str, fallback_name: str) -> Dict[str, Any]:
+    return profiles_from_qids([(qid, fallback_name)])[0]
 
 def profile_min(name: str) -> Dict[str, Any]:
-    return {
-        "qid": "", "name": name, "capital": "", "capital_qid": "",
-        "inception": "", "area_km2": "", "head_of_government": "", "hog_party": "",
-        "population": "", "population_year": ""
-    }
+    return _empty_profile("", name)
 
 # ───────── main ─────────
 FIELDS = ["qid","name","capital","capital_qid","inception","area_km2",
           "head_of_government","hog_party","population","population_year",
           "iso2","iso3","slug"]
+BATCH_SIZE = 50    # países por lote de wbgetentities (máx. da API); fsync por lote
+QID_CACHE_SAVE_EVERY = 20   # novas pesquisas entre gravações do cache de QIDs
 
 def main() -> None:
     seed = ensure_seed()
@@ -215,37 +278,76 @@ def main() -> None:
 
     header = not OUT_PATH.exists()
     written = 0
+    qid_cache = load_qid_cache()
+    n_cached = len(qid_cache)
+
+    # resume: (iso3, name) já escritos — lido UMA vez, atualizado em memória
+    seen: set[tuple[str, str]] = set()
+    if not header:
+        try:
+            prev = pd.read_csv(OUT_PATH, usecols=["iso3","name"], dtype=str).fillna("")
+            seen = {(iso3.upper(), name) for iso3, name in prev.itertuples(index=False)}
+        except Exception:
+            pass
 
     with OUT_PATH.open("a", newline="", encoding="utf-8") as f:
         w = csv.DictWriter(f, fieldnames=FIELDS)
         if header: w.writeheader()
 
-        for _, r in seed.iterrows():
-            iso2 = str(r["iso2"]).upper()
-            iso3 = str(r["iso3"]).upper()
-            name = str(r.get("name_pt") or r.get("name_en") or iso3 or iso2)
-            slug = str(r.get("slug") or slugify(name))
+        # países resolvidos (qid) à espera de perfil; os perfis saem em lotes de BATCH_SIZE
+        pending: List[tuple] = []
+
+        def flush_pending() -> int:
+            if not pending:
+                return 0
+            with_qid = [(q, n) for q, n, *_ in pending if q]
+            profs = iter(profiles_from_qids(with_qid)) if with_qid else iter(())
+            for qid, name, iso2, iso3, slug in pending:
+                prof = next(profs) if qid else profile_min(name)
+                w.writerow({**prof, "iso2": iso2, "iso3": iso3, "slug": slug})
+            # fsync por lote (por linha dominava o tempo total)
+            f.flush(); os.fsync(f.fileno())
+            n = len(pending)
+            pending.clear()
+            gc.collect()
+            return n
+
+        # cast único para string (sem str(...)/r.get por linha); tuplos simples no loop
+        cols = ["iso2","iso3","name_en","name_pt","slug"]
+        seed = seed.reindex(columns=cols).astype("string").fillna("")
+        todo: List[tuple] = []
+        for iso2, iso3, name_en, name_pt, slug in seed.itertuples(index=False, name=None):
+            iso2, iso3 = iso2.upper(), iso3.upper()
+            name = name_pt or name_en or iso3 or iso2
+            slug = slug or slugify(name)
 
             # skip se já existir linha para este iso3+name (resume simples)
-            if not header:
-                try:
-                    # leitura rápida (~O(n)): ok p/ uma vez; para produção usar índice.
-                    df_prev = pd.read_csv(OUT_PATH, usecols=["iso3","name"])
-                    if ((df_prev["iso3"].astype(str).str.upper()==iso3) &
-                        (df_prev["name"].astype(str)==name)).any():
-                        print(f"[SKIP] {name}")
-                        continue
-                except Exception:
-                    pass
+            if (iso3, name) in seen:
+                print(f"[SKIP] {name}")
+                continue
+            seen.add((iso3, name))
+            todo.append((name_pt, name_en, name, iso2, iso3, slug))
 
+        def _resolve(t: tuple) -> Optional[str]:
+            name_pt, name_en, name, iso2, *_ = t
             print(f"[START] {name}")
-            qid = wd_search_qid_by_name(str(r.get("name_pt","")), str(r.get("name_en","")))
-            prof = profile_from_qid(qid, name) if qid else profile_min(name)
+            return wd_search_qid_by_name(name_pt, name_en, iso2=iso2, cache=qid_cache)
 
-            row = {**prof, "iso2": iso2, "iso3": iso3, "slug": slug}
-            w.writerow(row); f.flush(); os.fsync(f.fileno())
-            written += 1
-            gc.collect()
+        # pesquisas de QID em paralelo (ordem preservada pelo map); perfis e escrita por lote.
+        # fsync só no fim de cada lote (flush_pending) e, aconteça o que acontecer, à saída.
+        try:
+            with ThreadPoolExecutor(max_workers=WD_MAX_WORKERS) as ex:
+                for i in range(0, len(todo), BATCH_SIZE):
+                    chunk = todo[i:i+BATCH_SIZE]
+                    for qid, (_, _, name, iso2, iso3, slug) in zip(ex.map(_resolve, chunk), chunk):
+                        pending.append((qid, name, iso2, iso3, slug))
+                    if len(qid_cache) - n_cached >= QID_CACHE_SAVE_EVERY:
+                        save_qid_cache(qid_cache); n_cached = len(qid_cache)
+                    written += flush_pending()
+        finally:
+            f.flush(); os.fsync(f.fileno())
+            if len(qid_cache) != n_cached:
+                save_qid_cache(qid_cache)
 
     print(f"✔️ Escrevi/atualizei {OUT_PATH} (linhas novas: {written})")
 
@@ -2,9 +2,24 @@
 # -*- coding: utf-8 -*-
 from __future__ import annotations
 from pathlib import Path
-import csv, os, sys, time, random
+import os, sys, time, random, threading, pickle
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
 import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import ijson  # opcional: lê results.bindings em streaming em vez de r.json()
+except ImportError:
+    ijson = None
+try:
+    import pyarrow  # noqa: F401  (opcional: armazenamento incremental em parquet)
+    HAVE_PARQUET = True
+except ImportError:
+    HAVE_PARQUET = False
+
+import wdqs_cache  # cache em disco das respostas WDQS (partilhada com fetch_cities.py)
 
 # ──────────────────────────────────────────────────────────────────────────────
 # Caminhos
@@ -13,6 +28,10 @@ PROJECT_ROOT = Path(__file__).resolve().parent.parent
 SEED_PATH    = PROJECT_ROOT / "data" / "countries_seed.csv"
 OUT_PATH     = PROJECT_ROOT / "data" / "cities_all.csv"
 TMP_DIR      = PROJECT_ROOT / "data" / "tmp_cities"
+PARQUET_PATH = OUT_PATH.with_suffix(".parquet")                # sidecar lido por services/offline_store.py
+PARTS_DIR    = OUT_PATH.with_name(OUT_PATH.stem + ".parts")     # lotes parquet ainda não exportados p/ CSV
+LABEL_CACHE_PATH = PROJECT_ROOT / "data" / "label_cache.pkl"   # {(qid, lang): label} entre execuções
+CACHE_DIR    = PROJECT_ROOT / "data" / "wdqs_cache"     # respostas WDQS (gzip) por sha256 da query
 
 # ──────────────────────────────────────────────────────────────────────────────
 # Config
@@ -22,12 +41,19 @@ RAW_LIMIT = 1200                 # nº bruto sem ORDER BY (LIMIT obrigatório pa
 REFRESH_ALL: bool = False        # True: recria ficheiro de saída
 REFRESH_ISO3: set[str] = set()   # ex.: {"PRT","ESP"} para reprocessar só estes
 SKIP_DONE: bool = True           # salta ISO3 já presentes quando não em refresh
+USE_CACHE = True                 # também desligável com --no-cache
+CACHE_TTL = 7 * 24 * 3600        # segundos
 
 # Ritmo / tolerância
 TIMEOUT = 90
 BASE_PAUSE = 0.35
+MAX_TRIES      = 4               # erros genéricos (timeout, 5xx, JSON inválido)
+MAX_TRIES_429  = 6               # throttling explícito do WDQS (429/503, 405 com Retry-After)
+BACKOFF_CAP    = 60.0
 COOLDOWN_EVERY = 20
 COOLDOWN_SECS  = 8
+MAX_WORKERS    = 4               # países em simultâneo (WDQS aceita até 5 queries paralelas por IP)
+BATCH_SIZE     = 8               # ISO3 por query (VALUES); 1 = uma query por país como antes
 
 # HTTP
 WDQS = "https://query.wikidata.org/sparql"
@@ -58,50 +84,177 @@ def remove_iso3_from_csv(path: Path, iso3s: set[str]) -> None:
     if not keep.all():
         df[keep].to_csv(path, index=False, encoding="utf-8")
 
+def _fresh_parquet() -> Path | None:
+    """cities_all.parquet, se existir e não for mais antigo que o CSV."""
+    if not PARQUET_PATH.exists():
+        return None
+    if OUT_PATH.exists() and PARQUET_PATH.stat().st_mtime_ns < OUT_PATH.stat().st_mtime_ns:
+        return None
+    return PARQUET_PATH
+
 def read_done_iso3() -> set[str]:
-    if not OUT_PATH.exists():
-        return set()
     try:
-        return set(pd.read_csv(OUT_PATH, usecols=["iso3"])["iso3"].astype(str).str.upper().unique())
+        pq = _fresh_parquet() if HAVE_PARQUET else None
+        if pq is not None:
+            # só a coluna iso3 do parquet: não lê o resto do ficheiro
+            col = pd.read_parquet(pq, columns=["iso3"])["iso3"]
+        elif OUT_PATH.exists():
+            col = pd.read_csv(OUT_PATH, usecols=["iso3"])["iso3"]
+        else:
+            return set()
+        return set(col.astype(str).str.upper().unique())
     except Exception:
         return set()
 
+def flush_rows(pending: list[pd.DataFrame], f) -> None:
+    """
+    Grava o lote pendente: com pyarrow, uma parte parquet (atómica) em PARTS_DIR;
+    sem pyarrow, append ao CSV aberto. Um só fsync por lote, não por país.
+    """
+    pending = [d for d in pending if not d.empty]
+    if not pending:
+        return
+    df = pd.concat(pending, ignore_index=True)
+    if HAVE_PARQUET:
+        PARTS_DIR.mkdir(parents=True, exist_ok=True)
+        part = PARTS_DIR / f"part-{time.time_ns()}.parquet"
+        tmp = part.with_suffix(".tmp")
+        df.to_parquet(tmp, index=False, engine="pyarrow", compression="zstd")
+        os.replace(tmp, part)
+    else:
+        df.to_csv(f, header=False, index=False)
+        f.flush(); os.fsync(f.fileno())
+
+def consolidate_parts() -> None:
+    """Partes parquet pendentes → cities_all.csv (export de uma vez) + cities_all.parquet; apaga as partes."""
+    parts = sorted(PARTS_DIR.glob("part-*.parquet")) if PARTS_DIR.exists() else []
+    if not parts:
+        return
+    # inteiros anuláveis: com NaN o pandas lia float e o export passava a escrever "1234.0"
+    ints = {"is_capital": "Int64", "population": "Int64", "year": "Int64"}
+    frames = [pd.read_csv(OUT_PATH, dtype=ints)] if OUT_PATH.exists() else []
+    frames += [pd.read_parquet(p) for p in parts]
+    full = pd.concat(frames, ignore_index=True).reindex(columns=HEAD)
+    tmp = OUT_PATH.with_name(OUT_PATH.name + ".tmp")
+    full.to_csv(tmp, index=False, encoding="utf-8")
+    os.replace(tmp, OUT_PATH)
+    # depois do CSV, para o sidecar ficar mais recente (offline_store compara mtimes)
+    full.to_parquet(PARQUET_PATH, index=False, engine="pyarrow", compression="zstd")
+    for p in parts:
+        p.unlink()
+    print(f"[debug] {len(parts)} partes parquet exportadas → {OUT_PATH}")
+
 # ──────────────────────────────────────────────────────────────────────────────
 # HTTP helpers
 # ──────────────────────────────────────────────────────────────────────────────
+# sessões com keep-alive: a ligação TLS ao WDQS / API é reutilizada entre países
 SQS = requests.Session()
 SQS.headers.update({"User-Agent": UA, "Accept": "application/sparql-results+json"})
+SQS.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8))   # pool >= MAX_WORKERS
 SWD = requests.Session()
 SWD.headers.update({"User-Agent": UA})
+SWD.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
+
+def _retry_after(r) -> float:
+    # Retry-After do WDQS vem em segundos; formato data HTTP (raro) → ignora
+    try:
+        return max(0.0, float(r.headers.get("Retry-After", "0")))
+    except (TypeError, ValueError):
+        return 0.0
+
+def _throttled(r) -> bool:
+    # o WDQS às vezes responde 405 em vez de 429 quando está a banir; o Retry-After denuncia
+    return r.status_code in (429, 503) or (r.status_code == 405 and "Retry-After" in r.headers)
+
+def _read_json(r) -> dict:
+    """Corpo SPARQL JSON → dict. Com ijson só as bindings são materializadas (sem o texto inteiro em memória)."""
+    if ijson is None:
+        return r.json()
+    r.raw.decode_content = True   # o WDQS responde em gzip
+    return {"results": {"bindings": list(ijson.items(r.raw, "results.bindings.item"))}}
 
 def sparql_post(q: str) -> dict | None:
-    headers_q = {
-        "User-Agent": UA,
-        "Accept": "application/sparql-results+json",
-        "Content-Type": "application/sparql-query",
-    }
-    headers_form = {
-        "User-Agent": UA,
-        "Accept": "application/sparql-results+json",
-    }
-    for attempt in range(4):
+    """Como _sparql_fetch, mas lê/grava a cache em disco (CACHE_DIR, CACHE_TTL; ver wdqs_cache)."""
+    js = wdqs_cache.cache_get(CACHE_DIR, q, CACHE_TTL) if USE_CACHE else None
+    if js is not None:
+        return js
+    js = _sparql_fetch(q)
+    if js is not None and USE_CACHE:
+        wdqs_cache.cache_put(CACHE_DIR, q, js)
+    return js
+
+def _sparql_fetch(q: str) -> dict | None:
+    # User-Agent/Accept vêm da sessão; só o Content-Type muda por chamada
+    stream = ijson is not None
+    attempt = 0
+    while True:
+        attempt += 1
+        retry_after = 0.0
+        throttled = False
+        r = None
         try:
-            r = requests.post(WDQS, data=q.encode("utf-8"), headers=headers_q, timeout=TIMEOUT)
+            r = SQS.post(WDQS, data=q.encode("utf-8"),
+                         headers={"Content-Type": "application/sparql-query"}, timeout=TIMEOUT, stream=stream)
             if r.status_code == 400:
-                r = requests.post(WDQS, data={"query": q, "format": "json"}, headers=headers_form, timeout=TIMEOUT)
+                r.close()
+                # form-encoded: o requests põe o Content-Type certo
+                r = SQS.post(WDQS, data={"query": q, "format": "json"}, timeout=TIMEOUT, stream=stream)
+            if _throttled(r):
+                throttled = True
+                retry_after = _retry_after(r)
             r.raise_for_status()
-            return r.json()
+            return _read_json(r)
         except Exception as e:
-            wait = BASE_PAUSE * (2**attempt) + random.uniform(0, 0.4)
-            print(f"  … SPARQL falhou ({e}); retry em {wait:.1f}s", file=sys.stderr)
-            time.sleep(wait)
-    return None
+            err = e
+        finally:
+            if r is not None:
+                r.close()   # em stream a ligação só volta ao pool depois de fechar
+        if attempt >= (MAX_TRIES_429 if throttled else MAX_TRIES):
+            print(f"  … SPARQL falhou ({err}); desisto após {attempt} tentativas", file=sys.stderr)
+            return None
+        if retry_after > 0:
+            # o servidor disse quanto esperar: respeita e só espalha um pouco
+            wait = retry_after + random.uniform(0, BASE_PAUSE)
+        else:
+            # full jitter: uniform(0, cap) evita que os workers voltem todos ao mesmo tempo
+            wait = random.uniform(0, min(BACKOFF_CAP, BASE_PAUSE * 2**attempt))
+        print(f"  … SPARQL falhou ({err}); tentativa {attempt}, retry em {wait:.1f}s", file=sys.stderr)
+        time.sleep(wait)
+
+# memo partilhado pelas threads; carregado/gravado em disco por main()
+LABEL_CACHE: dict[tuple[str,str], str] = {}
+_LABEL_LOCK = threading.Lock()
+
+def load_label_cache() -> None:
+    if not USE_CACHE:
+        return
+    try:
+        with LABEL_CACHE_PATH.open("rb") as fh:
+            LABEL_CACHE.update(pickle.load(fh))
+        print(f"[debug] labels em cache: {len(LABEL_CACHE)}")
+    except (OSError, pickle.UnpicklingError, EOFError):
+        pass
+
+def save_label_cache() -> None:
+    tmp = LABEL_CACHE_PATH.with_name(LABEL_CACHE_PATH.name + ".tmp")
+    try:
+        with _LABEL_LOCK, tmp.open("wb") as fh:
+            pickle.dump(LABEL_CACHE, fh, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, LABEL_CACHE_PATH)
+    except OSError as e:
+        print(f"  … cache de labels não gravada ({e})", file=sys.stderr)
 
 def wd_get_labels(qids: list[str], lang="pt") -> dict[str,str]:
+    """Labels lang → en → QID; só pede à API os QIDs que não estão em LABEL_CACHE."""
     out: dict[str,str] = {}
     if not qids:
         return out
     ids = [q for q in dict.fromkeys([q for q in qids if q])]
+    with _LABEL_LOCK:
+        for q in ids:
+            if (q, lang) in LABEL_CACHE:
+                out[q] = LABEL_CACHE[(q, lang)]
+    ids = [q for q in ids if q not in out]
     for i in range(0, len(ids), 50):
         chunk = ids[i:i+50]
         for attempt in range(3):
@@ -112,14 +265,26 @@ def wd_get_labels(qids: list[str], lang="pt") -> dict[str,str]:
                 }, timeout=20)
                 r.raise_for_status()
                 ents = r.json().get("entities", {})
+                got = {}
                 for q, e in ents.items():
                     lab = e.get("labels", {})
-                    out[q] = lab.get(lang, {}).get("value") or lab.get("en", {}).get("value") or q
+                    got[q] = lab.get(lang, {}).get("value") or lab.get("en", {}).get("value") or q
+                out.update(got)
+                with _LABEL_LOCK:
+                    LABEL_CACHE.update({(q, lang): v for q, v in got.items()})
                 break
             except Exception:
                 time.sleep(0.4 * (attempt+1))
     return out
 
+def apply_labels(df: pd.DataFrame) -> pd.DataFrame:
+    """Frame de collect_iso3 → colunas HEAD com labels PT (um só wd_get_labels, depois map)."""
+    admin_q = df["admin_q"]
+    labels = pd.Series(wd_get_labels(df["city_qid"].tolist() + admin_q[admin_q != ""].tolist(), "pt"),
+                       dtype=object)
+    return df.assign(city=df["city_qid"].map(labels).fillna(df["city_qid"]),
+                     admin=admin_q.map(labels).fillna(""))[HEAD]
+
 # ──────────────────────────────────────────────────────────────────────────────
 # SPARQL SEM ORDER BY (LIMIT obrigatório para evitar timeouts)
 # ──────────────────────────────────────────────────────────────────────────────
@@ -128,6 +293,17 @@ def q_block_no_order(iso3: str, raw_limit: int) -> str:
     Sem ORDER BY e sem filtro de população.
     Aceita cidade/município/assentamento humano e liga ao país por P17 direto OU via cadeia P131+.
     """
+    return _q_block("?city ?admin ?pop ?yr ?isCap ?lat ?lon",
+                    f'?country wdt:P298 "{iso3}" .', raw_limit)
+
+def q_block_batch(iso3_list: list[str], raw_limit_per_country: int) -> str:
+    """Como q_block_no_order, mas para vários países de uma vez (VALUES ?iso3); devolve ?iso3 por linha."""
+    vals = " ".join(f'"{i}"' for i in iso3_list)
+    return _q_block("?iso3 ?city ?admin ?pop ?yr ?isCap ?lat ?lon",
+                    f"VALUES ?iso3 {{ {vals} }}\n  ?country wdt:P298 ?iso3 .",
+                    raw_limit_per_country * len(iso3_list))
+
+def _q_block(select_vars: str, country_clause: str, limit: int) -> str:
     return f"""
 PREFIX wd: <http://www.wikidata.org/entity/>
 PREFIX wdt: <http://www.wikidata.org/prop/direct/>
@@ -137,9 +313,9 @@ PREFIX pq: <http://www.wikidata.org/prop/qualifier/>
 PREFIX psv: <http://www.wikidata.org/prop/statement/value/>
 PREFIX wikibase: <http://wikiba.se/ontology#>
 
-SELECT ?city ?admin ?pop ?yr ?isCap ?lat ?lon WHERE {{
+SELECT {select_vars} WHERE {{
   # país por ISO3
-  ?country wdt:P298 "{iso3}" .
+  {country_clause}
 
   # capital (opcional)
   OPTIONAL {{ ?country wdt:P36 ?capital . }}
@@ -174,7 +350,7 @@ SELECT ?city ?admin ?pop ?yr ?isCap ?lat ?lon WHERE {{
 
   BIND(IF(BOUND(?capital) && ?city = ?capital, 1, 0) AS ?isCap)
 }}
-LIMIT {raw_limit}
+LIMIT {limit}
 """
 
 
@@ -182,40 +358,89 @@ LIMIT {raw_limit}
 # ──────────────────────────────────────────────────────────────────────────────
 # Parse bruto
 # ──────────────────────────────────────────────────────────────────────────────
-def parse_rows(js: dict) -> list[tuple]:
-    """Tuplos: (city_qid, admin_q, is_cap, pop, yr, lat, lon)."""
-    out = []
-    for r in js.get("results", {}).get("bindings", []):
-        g = lambda k: r.get(k, {}).get("value")
-        city_qid = (g("city") or "").split("/")[-1]
-        admin_q  = (g("admin") or "").split("/")[-1] if g("admin") else ""
-        cap      = 1 if g("isCap") in ("1","true","True") else 0
-        pop, yr, lat, lon = g("pop"), g("yr"), g("lat"), g("lon")
-
-        try: pop = int(float(pop)) if pop else None
-        except: pop = None
-        try: yr = int(yr) if yr else None
-        except: yr = None
-        try: lat = float(lat) if lat else None
-        except: lat = None
-        try: lon = float(lon) if lon else None
-        except: lon = None
-
-        out.append((city_qid, admin_q, cap, pop, yr, lat, lon))
+_RAW_COLS = ["city_qid","admin_q","is_cap","pop","yr","lat","lon"]
+
+def parse_rows(js: dict) -> pd.DataFrame:
+    """DataFrame com _RAW_COLS (+ iso3 se a query o devolver); conversões em coluna, sem try/except por linha."""
+    df = pd.json_normalize(js.get("results", {}).get("bindings", []))
+
+    def col(k: str) -> pd.Series:
+        c = f"{k}.value"
+        return df[c] if c in df.columns else pd.Series(None, index=df.index, dtype=object)
+
+    def qid(k: str) -> pd.Series:
+        return col(k).fillna("").astype(str).str.rsplit("/", n=1).str[-1]
+
+    def num(k: str) -> pd.Series:
+        return pd.to_numeric(col(k), errors="coerce")
+
+    def coord(k: str) -> pd.Series:
+        # to_numeric arredonda o último dígito de alguns floats; valida com ele mas converte com float()
+        s = col(k)
+        return s.where(num(k).notna()).astype(float)
+
+    out = pd.DataFrame({
+        "city_qid": qid("city"),
+        "admin_q":  qid("admin"),
+        "is_cap":   col("isCap").isin(["1","true","True"]).astype(int),
+        "pop":      np.trunc(num("pop")).astype("Int64"),     # int(float(x)) como antes
+        "yr":       num("yr").astype("Int64"),                # datas completas (xsd:dateTime) ficam NA, como antes
+        "lat":      coord("lat"),
+        "lon":      coord("lon"),
+    }, columns=_RAW_COLS)
+    if "iso3.value" in df.columns:
+        out.insert(0, "iso3", df["iso3.value"].astype(str).str.upper())
     return out
 
+def fetch_batch(iso3_list: list[str]) -> tuple[dict[str, pd.DataFrame], bool] | None:
+    """
+    Uma query para o lote; devolve ({iso3: frame parse_rows}, truncado) ou None se a query falhou.
+    truncado=True quando a resposta bateu no LIMIT (algum país pode ter ficado cortado).
+    """
+    limit = RAW_LIMIT * len(iso3_list)
+    js = sparql_post(q_block_batch(iso3_list, raw_limit_per_country=RAW_LIMIT))
+    if not js:
+        return None
+    df = parse_rows(js)
+    if "iso3" not in df.columns:
+        return {}, False
+    by_iso3 = {k: g[_RAW_COLS].reset_index(drop=True) for k, g in df.groupby("iso3", sort=False)}
+    return by_iso3, len(df) >= limit
+
 # ──────────────────────────────────────────────────────────────────────────────
 # Pipeline por país: query -> tmp -> dedupe+sort local -> Top-N -> final -> apaga tmp
 # ──────────────────────────────────────────────────────────────────────────────
-def process_iso3(iso3: str, country_name: str, writer: csv.writer) -> bool:
+# cooldown partilhado entre threads: a cada COOLDOWN_EVERY países os próximos arranques esperam
+_COOLDOWN_LOCK = threading.Lock()
+_COOLDOWN_UNTIL = 0.0
+
+def _start_cooldown(secs: float) -> None:
+    global _COOLDOWN_UNTIL
+    with _COOLDOWN_LOCK:
+        _COOLDOWN_UNTIL = max(_COOLDOWN_UNTIL, time.monotonic() + secs)
+
+def _wait_cooldown() -> None:
+    with _COOLDOWN_LOCK:
+        wait = _COOLDOWN_UNTIL - time.monotonic()
+    if wait > 0:
+        time.sleep(wait)
+
+def collect_iso3(iso3: str, country_name: str, raw: pd.DataFrame | None = None) -> pd.DataFrame:
+    """
+    Query -> tmp -> dedupe -> Top-N; devolve as linhas finais (HEAD + admin_q) sem escrever;
+    as labels de city/admin vêm depois, por lote, em apply_labels.
+    raw: frame já obtido por fetch_batch (salta a query individual).
+    """
     # 1) Query SEM ORDER BY (LIMIT obrigatório)
-    js = sparql_post(q_block_no_order(iso3, raw_limit=RAW_LIMIT))
-    raw = parse_rows(js) if js else []
+    if raw is None:
+        _wait_cooldown()
+        js = sparql_post(q_block_no_order(iso3, raw_limit=RAW_LIMIT))
+        raw = parse_rows(js) if js else pd.DataFrame(columns=_RAW_COLS)
 
     # 2) Guardar RAW em tmp SEMPRE (mesmo vazio) e mostrar caminho absoluto
     TMP_DIR.mkdir(parents=True, exist_ok=True)
     tmp_path = (TMP_DIR / f"{iso3}.csv").resolve()
-    df_raw = pd.DataFrame(raw, columns=["city_qid","admin_q","is_cap","pop","yr","lat","lon"])
+    df_raw = raw   # parse_rows já devolve o frame tipado; não há reconstrução
     df_raw.insert(0, "iso3", iso3)
     df_raw.insert(1, "country", country_name)
     df_raw.to_csv(tmp_path, index=False, encoding="utf-8")
@@ -223,61 +448,45 @@ def process_iso3(iso3: str, country_name: str, writer: csv.writer) -> bool:
 
     if df_raw.empty:
         # nada para processar; deixa o tmp para inspecionar
-        return False  # marca como 'falhou' para reaparecer na lista de retries
-
-    # 3) (mantém o teu dedupe + sort por população desc + Top-N) …
-    by_city: dict[str, dict] = {}
-    for (cq, aq, cap, pop, yr, lat, lon) in raw:
-        if not cq:
-            continue
-        cur = by_city.get(cq)
-        if cur is None or (pop or -1) > (cur.get("pop") or -1):
-            by_city[cq] = {"admin_q": aq, "is_cap": int(bool(cap)), "pop": pop, "yr": yr, "lat": lat, "lon": lon}
-        else:
-            if cap:
-                cur["is_cap"] = 1
-            if not cur.get("admin_q") and aq:
-                cur["admin_q"] = aq
-
-    rows = []
-    for cq, d in by_city.items():
-        rows.append([cq, d.get("admin_q",""), d.get("is_cap",0), d.get("pop"), d.get("yr"), d.get("lat"), d.get("lon")])
-    df = pd.DataFrame(rows, columns=["city_qid","admin_q","is_cap","pop","yr","lat","lon"])
-
-    df["_pop_sort"] = df["pop"].fillna(-1)
-    df = df.sort_values(["_pop_sort","city_qid"], ascending=[False, True]).drop(columns=["_pop_sort"])
-    df_top = df.head(TOP_N).copy()
+        return pd.DataFrame(columns=HEAD + ["admin_q"])  # vazio = 'falhou', reaparece nos retries
+
+    # 3) dedupe por cidade: fica a linha de maior população (statement inteiro: pop/ano/coords);
+    #    capital se alguma linha o disser, admin da própria linha ou o primeiro não vazio
+    df = df_raw.loc[df_raw["city_qid"] != "", _RAW_COLS]
+    df = df.sort_values(["pop","is_cap"], ascending=[False,False], na_position="last", kind="mergesort")
+    g = df.groupby("city_qid", sort=False)
+    cap_any = g["is_cap"].max()
+    admin_any = df.loc[df["admin_q"] != ""].groupby("city_qid", sort=False)["admin_q"].first()
+    df = df.drop_duplicates(subset=["city_qid"], keep="first").reset_index(drop=True)
+    df["is_cap"] = df["city_qid"].map(cap_any).astype(int)
+    df["admin_q"] = df["admin_q"].where(df["admin_q"] != "", df["city_qid"].map(admin_any).fillna(""))
+
+    # Top-N sem ordenar o país inteiro: nlargest (keep="all" para não perder empates no corte)
+    # e só o recorte é ordenado, com o desempate por city_qid de sempre; pop em falta conta como -1
+    df = df.assign(_p=pd.to_numeric(df["pop"], errors="coerce").fillna(-1))
+    df_top = (df.nlargest(TOP_N, "_p", keep="all")
+                .sort_values(["_p","city_qid"], ascending=[False, True])
+                .head(TOP_N).drop(columns=["_p"]))
 
     # 4) Salva também um preview das Top-N ao lado do tmp
     top_path = (TMP_DIR / f"{iso3}_top.csv").resolve()
-    df_prev = df_top.copy()
-    df_prev.insert(0, "iso3", iso3)
-    df_prev.insert(1, "country", country_name)
-    df_prev.to_csv(top_path, index=False, encoding="utf-8")
+    # df_top já é um frame próprio (drop devolve cópia): as colunas entram direto, sem outra cópia
+    df_top.insert(0, "iso3", iso3)
+    df_top.insert(1, "country", country_name)
+    df_top.to_csv(top_path, index=False, encoding="utf-8")
     print(f"[debug] {iso3}: Top {len(df_top)} preview → {top_path}")
 
-    # 5) Labels e escrita no ficheiro final (igual ao teu)
-    lbl_city  = wd_get_labels(df_top["city_qid"].tolist(), "pt")
-    admin_qids = [x for x in df_top["admin_q"].tolist() if x]
-    lbl_admin = wd_get_labels(admin_qids, "pt") if admin_qids else {}
-
-    wrote = 0
-    for _, r in df_top.iterrows():
-        cq = r["city_qid"]; aq = r["admin_q"] or ""
-        cap = int(r["is_cap"] or 0)
-        pop = int(r["pop"]) if pd.notna(r["pop"]) else None
-        yr  = int(r["yr"]) if pd.notna(r["yr"]) else None
-        lat = float(r["lat"]) if pd.notna(r["lat"]) else None
-        lon = float(r["lon"]) if pd.notna(r["lon"]) else None
-        writer.writerow([
-            iso3, country_name,
-            lbl_city.get(cq, cq), cq,
-            lbl_admin.get(aq, ""), cap, pop, yr,
-            lat, lon
-        ])
-        wrote += 1
-
-    print(f"[ok] {iso3}: Top {len(df_top)} escritas")
+    # 5) Linhas finais (colunas HEAD + admin_q); city/admin só são preenchidas em apply_labels
+    out = pd.DataFrame({
+        "iso3": iso3, "country": country_name,
+        "city": df_top["city_qid"], "city_qid": df_top["city_qid"],
+        "admin": "", "is_capital": df_top["is_cap"].fillna(0).astype(int),
+        "population": df_top["pop"].astype("Int64"), "year": df_top["yr"].astype("Int64"),
+        "lat": df_top["lat"], "lon": df_top["lon"],
+        "admin_q": df_top["admin_q"].fillna(""),
+    })
+
+    print(f"[ok] {iso3}: Top {len(df_top)} recolhidas")
     # 6) REMOVE os temporários (como pediste)
     try:
         os.remove(tmp_path)
@@ -285,12 +494,15 @@ def process_iso3(iso3: str, country_name: str, writer: csv.writer) -> bool:
     except OSError:
         pass
 
-    return wrote > 0
+    return out
 
 # ──────────────────────────────────────────────────────────────────────────────
 # Main
 # ──────────────────────────────────────────────────────────────────────────────
 def main():
+    global USE_CACHE
+    if "--no-cache" in sys.argv[1:]:
+        USE_CACHE = False
     seed = load_seed()
 
     # Processar APENAS os ISO3 pedidos (se REFRESH_ISO3 definido)
@@ -303,58 +515,114 @@ def main():
     OUT_PATH.parent.mkdir(parents=True, exist_ok=True)
     TMP_DIR.mkdir(parents=True, exist_ok=True)
 
-    if REFRESH_ALL and OUT_PATH.exists():
-        OUT_PATH.unlink()
+    if REFRESH_ALL:
+        for p in [OUT_PATH, PARQUET_PATH, *(PARTS_DIR.glob("part-*") if PARTS_DIR.exists() else [])]:
+            if p.exists():
+                p.unlink()
+    # partes de uma execução interrompida entram no CSV antes de tudo o resto
+    consolidate_parts()
     if REFRESH_ISO3:
         remove_iso3_from_csv(OUT_PATH, REFRESH_ISO3)
 
     write_head = not OUT_PATH.exists()
     done = read_done_iso3()
+    load_label_cache()
 
     f = OUT_PATH.open("a", newline="", encoding="utf-8")
-    w = csv.writer(f)
     if write_head:
-        w.writerow(HEAD); f.flush(); os.fsync(f.fileno())
+        pd.DataFrame(columns=HEAD).to_csv(f, index=False); f.flush(); os.fsync(f.fileno())
 
     processed = 0
     failed: list[tuple[str,str]] = []
 
-    for _, r in seed.iterrows():
-        iso3 = str(r["iso3"]).upper().strip()
-        country = r.get("name_pt") or r.get("name_en") or iso3
-        if not iso3:
-            continue
-
-        if SKIP_DONE and not REFRESH_ALL and (not REFRESH_ISO3 or iso3 not in {i.upper() for i in REFRESH_ISO3}):
-            if iso3 in done:
-                continue
-
-        print(f"[cities] {iso3} {country}")
-        ok = process_iso3(iso3, country, w)
-        f.flush(); os.fsync(f.fileno())
-        if ok:
-            done.add(iso3)
-        else:
-            failed.append((iso3, country))
-
-        processed += 1
+    # só o que falta fazer: filtro em coluna antes de montar a lista (sem iterrows)
+    iso3s = seed["iso3"].astype(str).str.upper().str.strip()
+    keep = iso3s.ne("") & seed["iso3"].notna()
+    if SKIP_DONE and not REFRESH_ALL and not REFRESH_ISO3:
+        # (com REFRESH_ISO3 a seed já vem filtrada e esses países são sempre refeitos)
+        keep &= ~iso3s.isin(done)
+    names = [seed[c].fillna("").astype(str).str.strip() for c in ("name_pt", "name_en")]
+    country = names[0].where(names[0] != "", names[1]).where(lambda x: x != "", iso3s)
+    todo: list[tuple[str,str]] = list(zip(iso3s[keep], country[keep]))
+    print(f"[debug] por fazer: {len(todo)}/{len(seed)} países")
+
+    def _work(batch: list[tuple[str,str]]) -> list[tuple[str,str,pd.DataFrame]]:
+        print(f"[cities] {' '.join(i for i, _ in batch)}")
+        got = None
+        if len(batch) > 1:
+            _wait_cooldown()
+            got = fetch_batch([i for i, _ in batch])
+            if got is None:
+                print("  … lote falhou; sigo país a país", file=sys.stderr)
+            elif got[1]:
+                # sem ORDER BY não se sabe que país ficou cortado → não confia no lote
+                print("  … lote bateu no LIMIT; sigo país a país", file=sys.stderr)
+                got = None
+        res = []
+        for iso3, country in batch:
+            # sem resultado no lote (ou lote falhado) → query individual
+            raw = got[0].get(iso3) if got else None
+            try:
+                df = collect_iso3(iso3, country, raw)
+            except Exception as e:
+                print(f"  … {iso3}: erro inesperado ({e})", file=sys.stderr)
+                df = pd.DataFrame(columns=HEAD + ["admin_q"])
+            res.append((iso3, country, df))
+        # labels do lote inteiro num só passo (cidades + admins, os já conhecidos saem da cache)
+        wd_get_labels([q for _, _, df in res for c in ("city_qid", "admin_q") for q in df[c] if q], "pt")
+        res = [(iso3, country, apply_labels(df)) for iso3, country, df in res]
         time.sleep(BASE_PAUSE + random.uniform(0,0.2))
-        if processed % COOLDOWN_EVERY == 0:
-            print(f"  … cooldown {COOLDOWN_SECS}s", file=sys.stderr)
-            time.sleep(COOLDOWN_SECS)
-
-    # (opcional) segunda passada nos que falharam
-    if failed:
-        print(f"\n↻ Repetir países que falharam: {len(failed)}")
-        time.sleep(3)
-        for iso3, country in failed:
-            print(f"[retry] {iso3} {country}")
-            ok = process_iso3(iso3, country, w)
-            f.flush(); os.fsync(f.fileno())
-            time.sleep(BASE_PAUSE * 1.8 + random.uniform(0, 0.2))
-
-    f.close()
+        return res
+
+    # lotes de BATCH_SIZE países numa só query; até MAX_WORKERS lotes em voo.
+    # a escrita fica só nesta thread, acumulada e gravada a cada COOLDOWN_EVERY países
+    pending: list[pd.DataFrame] = []
+    batches = [todo[i:i + BATCH_SIZE] for i in range(0, len(todo), max(1, BATCH_SIZE))]
+    interrupted = False
+    try:
+        ex = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+        try:
+            futs = [ex.submit(_work, b) for b in batches]
+            for fut in as_completed(futs):
+                for iso3, country, df in fut.result():
+                    pending.append(df)
+                    if not df.empty:
+                        done.add(iso3)
+                    else:
+                        failed.append((iso3, country))
+
+                    processed += 1
+                    if processed % COOLDOWN_EVERY == 0:
+                        flush_rows(pending, f); pending.clear()
+                        print(f"  … cooldown {COOLDOWN_SECS}s", file=sys.stderr)
+                        _start_cooldown(COOLDOWN_SECS)
+        except BaseException:
+            # Ctrl-C / erro: os lotes ainda na fila são cancelados (sem isto o shutdown esperava
+            # que todos fossem ao WDQS); os que já estão em voo acabam mas são descartados
+            ex.shutdown(wait=False, cancel_futures=True)
+            raise
+        ex.shutdown()
+
+        # (opcional) segunda passada nos que falharam
+        if failed:
+            print(f"\n↻ Repetir países que falharam: {len(failed)}")
+            time.sleep(3)
+            for iso3, country in failed:
+                print(f"[retry] {iso3} {country}")
+                pending.append(apply_labels(collect_iso3(iso3, country)))
+                time.sleep(BASE_PAUSE * 1.8 + random.uniform(0, 0.2))
+    except KeyboardInterrupt:
+        interrupted = True
+        print("\n[interrompido] a gravar os países já recolhidos", file=sys.stderr)
+    finally:
+        # grava os lotes já recebidos (também em erro); os que estavam em voo ficam para a próxima
+        flush_rows(pending, f)
+        f.close()
+        consolidate_parts()
+    save_label_cache()
     print(f"✔️ Atualizado {OUT_PATH}")
+    if interrupted:
+        sys.exit(130)
 
 if __name__ == "__main__":
     main()
@@ -4,17 +4,35 @@ from __future__ import annotations
 
 from pathlib import Path
 import csv
+import io
 import os
 import sys
 import time
 import random
-import heapq
-from typing import Dict, List, Tuple, Optional
-
+from string import Template
+import hashlib
+import gzip
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import multiprocessing as mp
+from typing import Dict, Iterable, List, Tuple, Optional
+
+import numpy as np
 import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
-from json import JSONDecodeError
+from json import JSONDecodeError   # orjson.JSONDecodeError é subclasse desta
+try:
+    import orjson                  # opcional: decode/encode em C, bem mais rápido para respostas WDQS grandes
+except ImportError:
+    orjson = None
+from urllib.parse import urlencode
+try:
+    import wdqs_cache              # cache em disco das respostas WDQS (partilhada com o "fetch_cities - Copy.py")
+except ImportError:                # python -m scripts.fetch_cities
+    from scripts import wdqs_cache
 
 # ──────────────────────────────────────────────────────────────────────────────
 # Caminhos
@@ -22,7 +40,9 @@ from json import JSONDecodeError
 PROJECT_ROOT = Path(__file__).resolve().parent.parent
 SEED_PATH    = PROJECT_ROOT / "data" / "countries_seed.csv"
 OUT_PATH     = PROJECT_ROOT / "data" / "cities_all.csv"
+DONE_PATH    = PROJECT_ROOT / "data" / "cities_all.done.json"   # {iso3: sha256 dos city_qid escritos} (SKIP_DONE)
 TMP_DIR      = PROJECT_ROOT / "data" / "tmp_cities"
+CACHE_DIR    = PROJECT_ROOT / "data" / "wdqs_cache"     # respostas WDQS (gzip) por sha256 da query
 
 # ──────────────────────────────────────────────────────────────────────────────
 # Config
@@ -38,18 +58,33 @@ TIMEOUT = 90
 BASE_PAUSE = 0.35
 COOLDOWN_EVERY = 20
 COOLDOWN_SECS  = 8
+MAX_WORKERS    = 4                # países em simultâneo (WDQS aceita até 5 queries paralelas por IP)
+USE_PROCESSES  = False            # True: países em processos (parse/JSON em paralelo real, não só o I/O)
+WDQS_MAX_CONCURRENT = 5           # teto de pedidos WDQS em voo, partilhado entre threads/processos
+
+# Cache em disco das respostas WDQS (re-execuções não voltam a consultar o endpoint)
+USE_CACHE = True                  # também desligável com --no-cache
+CACHE_TTL = 7 * 24 * 3600         # segundos
 
 # Comportamento de queries
-PREFER_ORDERED = False            # evita queries agregadas pesadas por defeito
+PREFER_ORDERED = False            # tenta também o fallback filtrado por pop. mínima (q_block_ordered)
 STABLE_MIN_POP: Optional[int] = None  # ex.: 1000 para filtrar micro-povoados
+# capital + população paginada + atributos do Top-N. Desligado por omissão: cada página repete o
+# P31/P279* + (P131)+ e ordena por ?city, o que pode custar ao WDQS mais do que a query monolítica
+SPLIT_QUERIES = False
+POP_PAGE = 500                    # linhas por página de população
 
 # HTTP
 WDQS = "https://query.wikidata.org/sparql"
+GET_MAX_URL = 8000                # query-string maior que isto → POST (limite prático de URL)
 UA   = "GeografiaApp/1.0 (+coloca-o-teu-email-ou-site; contacto WDQS)"  # ← TROCAR POR CONTACTO REAL
 WD_API = "https://www.wikidata.org/w/api.php"
 
 # Cabeçalho do CSV final
 HEAD = ["iso3","country","city","city_qid","admin","is_capital","population","year","lat","lon"]
+_HEAD_DTYPES = {"iso3": str, "country": str, "city": str, "city_qid": str, "admin": str,
+                "is_capital": "int8", "population": "Int64", "year": "Int64", "lat": "float64", "lon": "float64"}
+_HEAD_NUM = ("population", "year", "lat", "lon")
 
 # ──────────────────────────────────────────────────────────────────────────────
 # Util
@@ -58,10 +93,12 @@ def load_seed() -> pd.DataFrame:
     if not SEED_PATH.exists():
         print(f"❌ Falta {SEED_PATH}.", file=sys.stderr)
         sys.exit(1)
-    df = pd.read_csv(SEED_PATH)
+    # tudo texto e sem NaN ("NA" = Namíbia); iso3 já normalizado aqui, uma vez
+    df = pd.read_csv(SEED_PATH, dtype="string", na_filter=False)
     for c in ("name_pt","name_en"):
         if c not in df.columns:
             df[c] = ""
+    df["iso3"] = df["iso3"].str.upper().str.strip()
     return df
 
 def remove_iso3_from_csv(path: Path, iso3s: set[str]) -> None:
@@ -76,72 +113,149 @@ def read_done_iso3() -> set[str]:
     if not OUT_PATH.exists():
         return set()
     try:
-        return set(pd.read_csv(OUT_PATH, usecols=["iso3"])["iso3"].astype(str).str.upper().unique())
+        return set(pd.read_csv(OUT_PATH, usecols=["iso3"], dtype="string", engine="c")["iso3"].str.upper().unique())
     except Exception:
         return set()
 
+def _qids_hash(qids) -> str:
+    return hashlib.sha256("\n".join(sorted(qids)).encode("utf-8")).hexdigest()
+
+def load_done_rows() -> Dict[str, List[List]]:
+    """
+    Linhas já escritas em OUT_PATH dos países cujo conjunto de city_qid ainda bate com o hash
+    gravado em DONE_PATH (escrita anterior completa) → {iso3: linhas}; o resto volta a ser recolhido.
+    """
+    try:
+        hashes: Dict[str, str] = json.loads(DONE_PATH.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+    if not hashes.keys() & read_done_iso3():
+        return {}
+    df = pd.read_csv(OUT_PATH, dtype=_HEAD_DTYPES, keep_default_na=False, na_values={c: [""] for c in _HEAD_NUM},
+                     engine="c")
+    # de volta a valores Python (None nos vazios), iguais aos das linhas acabadas de recolher
+    df = df[HEAD].astype(object).where(df[HEAD].notna(), None)
+    out: Dict[str, List[List]] = {}
+    for iso3, g in df.groupby("iso3", sort=False):
+        if hashes.get(iso3) == _qids_hash(g["city_qid"]):
+            out[iso3] = [list(r) for r in g.itertuples(index=False, name=None)]
+    return out
+
+def save_done_hashes(rows_by_iso3: Dict[str, List[List]]) -> None:
+    hashes = {iso3: _qids_hash(r[3] for r in rows) for iso3, rows in rows_by_iso3.items() if rows}
+    tmp = DONE_PATH.with_name(DONE_PATH.name + ".tmp")
+    tmp.write_text(json.dumps(hashes, indent=0, sort_keys=True), encoding="utf-8")
+    os.replace(tmp, DONE_PATH)
+
 # ──────────────────────────────────────────────────────────────────────────────
 # HTTP helpers
 # ──────────────────────────────────────────────────────────────────────────────
-SQS = requests.Session()
-SQS.headers.update({"User-Agent": UA})
-SWD = requests.Session()
-SWD.headers.update({"User-Agent": UA})
-
-def _tsv_to_bindings(tsv_text: str) -> dict:
+def _session() -> requests.Session:
+    # keep-alive (1 ligação TLS reutilizada) + retries do urllib3 para 429/5xx;
+    # pool >= MAX_WORKERS para as threads não abrirem ligações extra
+    s = requests.Session()
+    s.headers.update({"User-Agent": UA})
+    s.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=Retry(
+        total=3, backoff_factor=0.5,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(["GET", "POST"]),
+    )))
+    return s
+
+SQS = _session()   # WDQS (SPARQL)
+SWD = _session()   # API Wikidata (wbgetentities)
+_WDQS_SEM = threading.BoundedSemaphore(WDQS_MAX_CONCURRENT)   # em modo processos: multiprocessing.Semaphore
+
+def _tsv_to_bindings(tsv: str | Iterable[str]) -> dict:
     """
-    Converte resposta TSV da WDQS num "pseudo-JSON" compatível com parse_rows().
+    Converte resposta TSV da WDQS num "pseudo-JSON" compatível com parse_frame().
+    Aceita o texto todo ou um iterável de linhas (ex.: r.iter_lines(), sem bufferizar o corpo).
     Assume cabeçalhos alinhados com as variáveis SPARQL (city, admin, pop, yr, lat, lon, isCap).
     """
-    lines = [ln for ln in tsv_text.strip().splitlines() if ln.strip() != ""]
-    if not lines:
+    lines = io.StringIO(tsv.strip()) if isinstance(tsv, str) else tsv
+    # QUOTE_NONE: os literais TSV da WDQS trazem aspas ("123"^^xsd:…) que não delimitam campos
+    reader = csv.reader(lines, delimiter="\t", quoting=csv.QUOTE_NONE)
+    headers = next((row for row in reader if any(c.strip() for c in row)), None)
+    if not headers:
         return {"results": {"bindings": []}}
-    headers = lines[0].split("\t")
-    bindings = []
-    for ln in lines[1:]:
-        cols = ln.split("\t")
-        row = {}
-        for h, v in zip(headers, cols):
-            if v == "":
-                continue
-            row[h] = {"type": "literal", "value": v}
-        bindings.append(row)
+    idx = list(enumerate(headers))
+    n = len(headers)
+    bindings = [
+        {h: {"type": "literal", "value": cols[i]} for i, h in idx if i < len(cols) and cols[i]}
+        for cols in reader
+        if any(c.strip() for c in cols[:n])
+    ]
     return {"results": {"bindings": bindings}}
 
+def _json_loads(b: bytes):
+    return orjson.loads(b) if orjson is not None else json.loads(b)
+
+def _json_dumps(obj) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
 def sparql_post(q: str) -> dict | None:
+    """Como _sparql_fetch, mas lê/grava a cache em disco (CACHE_DIR, CACHE_TTL; ver wdqs_cache)."""
+    js = wdqs_cache.cache_get(CACHE_DIR, q, CACHE_TTL) if USE_CACHE else None
+    if js is not None:
+        return js
+    js = _sparql_fetch(q)
+    if js is not None and USE_CACHE:
+        wdqs_cache.cache_put(CACHE_DIR, q, js)
+    return js
+
+def _sparql_fetch(q: str) -> dict | None:
     """
     Estratégia robusta:
-      1) POST (form) JSON
-      2) GET JSON
+      1) GET JSON (queries curtas → elegível para a cache HTTP da WDQS); POST (form) se a query
+         não couber no URL
+      2) o outro método, JSON
       3) POST (form) TSV → converter para 'bindings'
     Retorna dict estilo WDQS (com 'results'/'bindings') ou None.
     """
     headers_json = {
         "User-Agent": UA,
         "Accept": "application/sparql-results+json; charset=utf-8",
+        "Accept-Encoding": "gzip, deflate",
     }
     headers_tsv = {
         "User-Agent": UA,
         "Accept": "text/tab-separated-values; charset=utf-8",
+        "Accept-Encoding": "gzip, deflate",
     }
+    params = {"query": q, "format": "json"}
+    use_get = len(urlencode(params)) < GET_MAX_URL
+
+    def _get():
+        with _WDQS_SEM:
+            return SQS.get(WDQS, params=params, headers=headers_json, timeout=TIMEOUT)
+
+    def _post():
+        with _WDQS_SEM:
+            return SQS.post(WDQS, data=params, headers=headers_json, timeout=TIMEOUT)
+
+    first, second = (_get, _post) if use_get else (_post, _get)
 
     for attempt in range(4):
         try:
-            r = requests.post(WDQS, data={"query": q, "format": "json"},
-                              headers=headers_json, timeout=TIMEOUT)
+            r = first()
             r.raise_for_status()
             try:
-                return r.json()
+                return _json_loads(r.content)
             except JSONDecodeError:
-                r2 = requests.get(WDQS, params={"query": q, "format": "json"},
-                                  headers=headers_json, timeout=TIMEOUT)
+                r2 = second()
                 r2.raise_for_status()
                 try:
-                    return r2.json()
+                    return _json_loads(r2.content)
                 except JSONDecodeError:
-                    r3 = requests.post(WDQS, data={"query": q}, headers=headers_tsv, timeout=TIMEOUT)
-                    r3.raise_for_status()
-                    return _tsv_to_bindings(r3.text)
+                    # TSV em streaming: linhas vão direto ao csv.reader, sem r.text inteiro em memória
+                    with _WDQS_SEM:
+                        with SQS.post(WDQS, data={"query": q}, headers=headers_tsv,
+                                      timeout=TIMEOUT, stream=True) as r3:
+                            r3.raise_for_status()
+                            r3.encoding = r3.encoding or "utf-8"
+                            return _tsv_to_bindings(r3.iter_lines(chunk_size=1 << 16, decode_unicode=True))
 
         except Exception as e:
             wait = BASE_PAUSE * (2 ** attempt) + random.uniform(0, 0.4)
@@ -150,52 +264,90 @@ def sparql_post(q: str) -> dict | None:
 
     return None
 
+LABELS_CACHE_PATH = PROJECT_ROOT / "data" / "wd_labels_cache.json.gz"   # {lang: {qid: label}}
+LABEL_WORKERS = 8                 # lotes de 50 QIDs pedidos em simultâneo
+_LABELS: Dict[str, Dict[str, str]] | None = None
+
+def _labels_cache() -> Dict[str, Dict[str, str]]:
+    global _LABELS
+    if _LABELS is None:
+        _LABELS = {}
+        if USE_CACHE:
+            try:
+                if time.time() - LABELS_CACHE_PATH.stat().st_mtime <= CACHE_TTL:
+                    with gzip.open(LABELS_CACHE_PATH, "rb") as fh:
+                        _LABELS = _json_loads(fh.read())
+            except (OSError, ValueError):
+                _LABELS = {}
+    return _LABELS
+
+def _save_labels_cache() -> None:
+    if not USE_CACHE or _LABELS is None:
+        return
+    try:
+        tmp = LABELS_CACHE_PATH.with_name(LABELS_CACHE_PATH.name + ".tmp")
+        with gzip.open(tmp, "wb") as fh:
+            fh.write(_json_dumps(_LABELS))
+        os.replace(tmp, LABELS_CACHE_PATH)
+    except OSError as e:
+        print(f"  … cache de labels não gravada ({e})", file=sys.stderr)
+
+def _fetch_labels_chunk(chunk: List[str], langs: List[str]) -> Dict[str, str]:
+    out: Dict[str, str] = {}
+    for attempt in range(3):
+        try:
+            r = SWD.get(WD_API, params={
+                "action":"wbgetentities", "ids":"|".join(chunk),
+                "props":"labels", "languages": "|".join(langs), "format":"json"
+            }, timeout=20)
+            r.raise_for_status()
+            ents = _json_loads(r.content).get("entities", {})
+            for q, e in ents.items():
+                lab = e.get("labels", {})
+                chosen = None
+                for L in langs:
+                    if L in lab:
+                        chosen = lab[L].get("value")
+                        break
+                out[q] = chosen or q
+            break
+        except Exception:
+            time.sleep(0.4 * (attempt+1))
+    return out
+
 def wd_get_labels(qids: List[str], lang="pt", fallbacks=("pt-br","en")) -> Dict[str, str]:
     """
     Devolve labels priorizando português; fallbacks pt-br → en.
+    Só pede à API os QIDs que ainda não estão na cache (lotes de 50 em paralelo).
     """
-    out: Dict[str,str] = {}
-    if not qids:
-        return out
+    ids = [q for q in dict.fromkeys([q for q in qids if q])]
+    if not ids:
+        return {}
 
     langs = [lang] + [l for l in fallbacks if l != lang]
-    lang_param = "|".join(langs)
-
-    ids = [q for q in dict.fromkeys([q for q in qids if q])]
-    for i in range(0, len(ids), 50):
-        chunk = ids[i:i+50]
-        for attempt in range(3):
-            try:
-                r = SWD.get(WD_API, params={
-                    "action":"wbgetentities", "ids":"|".join(chunk),
-                    "props":"labels", "languages": lang_param, "format":"json"
-                }, timeout=20)
-                r.raise_for_status()
-                ents = r.json().get("entities", {})
-                for q, e in ents.items():
-                    lab = e.get("labels", {})
-                    chosen = None
-                    for L in langs:
-                        if L in lab:
-                            chosen = lab[L].get("value")
-                            break
-                    out[q] = chosen or q
-                break
-            except Exception:
-                time.sleep(0.4 * (attempt+1))
-    return out
+    cache = _labels_cache().setdefault(lang, {})
+    missing = [q for q in ids if q not in cache]
+    if missing:
+        chunks = [missing[i:i+50] for i in range(0, len(missing), 50)]
+        with ThreadPoolExecutor(max_workers=min(LABEL_WORKERS, len(chunks))) as ex:
+            for got in ex.map(lambda c: _fetch_labels_chunk(c, langs), chunks):
+                cache.update(got)
+        _save_labels_cache()
+    return {q: cache[q] for q in ids if q in cache}
+
+def apply_labels(rows: List[List]) -> List[List]:
+    """
+    Linhas de collect_iso3 (city/admin ainda com QIDs) → labels PT.
+    Um só wd_get_labels para todas as linhas (de um ou vários países).
+    """
+    labels = wd_get_labels([r[3] for r in rows] + [r[4] for r in rows if r[4]], "pt")
+    return [[r[0], r[1], labels.get(r[3], r[3]), r[3], labels.get(r[4], "") if r[4] else "", *r[5:]]
+            for r in rows]
 
 # ──────────────────────────────────────────────────────────────────────────────
 # Queries SPARQL
 # ──────────────────────────────────────────────────────────────────────────────
-def q_chn_user(limit: int = 200, min_pop: int = 1000000) -> str:
-    """
-    China — exatamente a query fornecida pelo utilizador (funciona no WDQS dele):
-    - Capital via P36 garantida.
-    - Cidades = P31/P279* Q515 com P17=Q148 e P1082 >= min_pop.
-    - Sem ORDER BY. Devolve múltiplas linhas por cidade (uma por P1082).
-    """
-    return f"""
+_Q_CHN_TMPL = Template("""
 PREFIX wd:   <http://www.wikidata.org/entity/>
 PREFIX wdt:  <http://www.wikidata.org/prop/direct/>
 PREFIX p:    <http://www.wikidata.org/prop/>
@@ -205,48 +357,50 @@ PREFIX psv:  <http://www.wikidata.org/prop/statement/value/>
 PREFIX wikibase: <http://wikiba.se/ontology#>
 
 SELECT ?city ?admin ?pop ?yr ?lat ?lon ?isCap
-WHERE {{
+WHERE {
   # Capital
-  {{
+  {
     wd:Q148 wdt:P36 ?city .
     BIND(1 AS ?isCap)
-  }}
+  }
   UNION
   # Cidades com população >= min_pop
-  {{
+  {
     ?city wdt:P31/wdt:P279* wd:Q515 ;
           wdt:P17 wd:Q148 ;
           wdt:P1082 ?pop .
-    FILTER(?pop >= {min_pop})
+    FILTER(?pop >= ${min_pop})
     BIND(0 AS ?isCap)
-  }}
+  }
   
-  OPTIONAL {{ ?city wdt:P131 ?admin }}
+  OPTIONAL { ?city wdt:P131 ?admin }
   
-  OPTIONAL {{ 
+  OPTIONAL { 
     ?city p:P625 ?coordStmt .
     ?coordStmt psv:P625 ?coordValue .
     ?coordValue wikibase:geoLatitude ?lat ;
                 wikibase:geoLongitude ?lon .
-  }}
+  }
   
-  OPTIONAL {{
+  OPTIONAL {
     ?city p:P1082 ?popStmt .
     ?popStmt ps:P1082 ?pop .
-    OPTIONAL {{ ?popStmt pq:P585 ?date . BIND(YEAR(?date) AS ?yr) }}
-  }}
-}}
-LIMIT {limit}
-"""
+    OPTIONAL { ?popStmt pq:P585 ?date . BIND(YEAR(?date) AS ?yr) }
+  }
+}
+LIMIT ${limit}
+""")
 
-def q_fra_wide(limit: int = 300, min_pop: int = 50000) -> str:
+def q_chn_user(limit: int = 200, min_pop: int = 1000000) -> str:
     """
-    França — padrão “largo” alinhado com o da China:
+    China — exatamente a query fornecida pelo utilizador (funciona no WDQS dele):
     - Capital via P36 garantida.
-    - Cidades = P31/P279* (Q515 ou Q484170) com P17=Q142 e P1082 >= min_pop.
+    - Cidades = P31/P279* Q515 com P17=Q148 e P1082 >= min_pop.
     - Sem ORDER BY. Devolve múltiplas linhas por cidade (uma por P1082).
     """
-    return f"""
+    return _Q_CHN_TMPL.substitute(limit=limit, min_pop=min_pop)
+
+_Q_FRA_TMPL = Template("""
 PREFIX wd:   <http://www.wikidata.org/entity/>
 PREFIX wdt:  <http://www.wikidata.org/prop/direct/>
 PREFIX p:    <http://www.wikidata.org/prop/>
@@ -256,61 +410,66 @@ PREFIX psv:  <http://www.wikidata.org/prop/statement/value/>
 PREFIX wikibase: <http://wikiba.se/ontology#>
 
 SELECT ?city ?admin ?pop ?yr ?lat ?lon ?isCap
-WHERE {{
+WHERE {
   # A) Capital — entra sempre e não depende de população
-  {{
-    SELECT ?city (1 AS ?isCap) WHERE {{
+  {
+    SELECT ?city (1 AS ?isCap) WHERE {
       wd:Q142 wdt:P36 ?city .
-    }}
-  }}
+    }
+  }
   UNION
   # B) Cidades/communes com população >= min_pop (com LIMIT local)
-  {{
-    SELECT ?city (0 AS ?isCap) WHERE {{
-      {{
+  {
+    SELECT ?city (0 AS ?isCap) WHERE {
+      {
         ?city wdt:P31/wdt:P279* wd:Q515
-      }} UNION {{
+      } UNION {
         ?city wdt:P31/wdt:P279* wd:Q484170
-      }}
+      }
       ?city wdt:P17 wd:Q142 ;
             wdt:P1082 ?popFilter .
 
       # Exclusões (evita métropoles, departamentos, regiões, etc.)
-      MINUS {{ ?city wdt:P31/wdt:P279* wd:Q3333855 }}   # métropole
-      MINUS {{ ?city wdt:P31/wdt:P279* wd:Q1907114 }}   # área metropolitana
-      MINUS {{ ?city wdt:P31/wdt:P279* wd:Q6465 }}      # département
-      MINUS {{ ?city wdt:P31/wdt:P279* wd:Q36784 }}     # região de França
-      MINUS {{ ?city wdt:P31/wdt:P279* wd:Q22923920 }}  # collectivité à statut particulier
+      MINUS { ?city wdt:P31/wdt:P279* wd:Q3333855 }   # métropole
+      MINUS { ?city wdt:P31/wdt:P279* wd:Q1907114 }   # área metropolitana
+      MINUS { ?city wdt:P31/wdt:P279* wd:Q6465 }      # département
+      MINUS { ?city wdt:P31/wdt:P279* wd:Q36784 }     # região de França
+      MINUS { ?city wdt:P31/wdt:P279* wd:Q22923920 }  # collectivité à statut particulier
 
-      FILTER(?popFilter >= {min_pop})
-    }} LIMIT {limit}
-  }}
+      FILTER(?popFilter >= ${min_pop})
+    } LIMIT ${limit}
+  }
 
   # Enriquecimento (opcional) — corre para ambos os ramos
-  OPTIONAL {{ ?city wdt:P131 ?admin }}
+  OPTIONAL { ?city wdt:P131 ?admin }
 
-  OPTIONAL {{
+  OPTIONAL {
     ?city p:P625 ?coordStmt .
     ?coordStmt psv:P625 ?coordValue .
     ?coordValue wikibase:geoLatitude ?lat ;
                 wikibase:geoLongitude ?lon .
-  }}
+  }
 
-  OPTIONAL {{
+  OPTIONAL {
     ?city p:P1082 ?popStmt .
     ?popStmt ps:P1082 ?pop .
-    OPTIONAL {{ ?popStmt pq:P585 ?date . BIND(YEAR(?date) AS ?yr) }}
-  }}
-}}
+    OPTIONAL { ?popStmt pq:P585 ?date . BIND(YEAR(?date) AS ?yr) }
+  }
+}
 
 
-"""
+""")
 
-def q_block_ordered(iso3: str, limit: int = 4000, min_pop: int = 1000) -> str:
+def q_fra_wide(limit: int = 300, min_pop: int = 50000) -> str:
     """
-    Variante agregada + ORDER BY (fallback; pode ser pesada).
+    França — padrão “largo” alinhado com o da China:
+    - Capital via P36 garantida.
+    - Cidades = P31/P279* (Q515 ou Q484170) com P17=Q142 e P1082 >= min_pop.
+    - Sem ORDER BY. Devolve múltiplas linhas por cidade (uma por P1082).
     """
-    return f"""
+    return _Q_FRA_TMPL.substitute(limit=limit, min_pop=min_pop)
+
+_Q_ORDERED_TMPL = Template("""
 PREFIX wd: <http://www.wikidata.org/entity/>
 PREFIX wdt: <http://www.wikidata.org/prop/direct/>
 PREFIX p: <http://www.wikidata.org/prop/>
@@ -319,54 +478,50 @@ PREFIX pq: <http://www.wikidata.org/prop/qualifier/>
 PREFIX psv: <http://www.wikidata.org/prop/statement/value/>
 PREFIX wikibase: <http://wikiba.se/ontology#>
 
-SELECT
-  ?city
-  (SAMPLE(?admin) AS ?admin)
-  (MAX(?pop)      AS ?pop)
-  (MAX(?yr)       AS ?yr)
-  (SAMPLE(?lat)   AS ?lat)
-  (SAMPLE(?lon)   AS ?lon)
-  (MAX(?isCap)    AS ?isCap)
-WHERE {{
-  ?country wdt:P298 "{iso3}" .
-  OPTIONAL {{ ?country wdt:P36 ?capital . }}
-
-  VALUES ?cls {{ wd:Q515 wd:Q15284 wd:Q486972 }}
+SELECT ?city ?admin ?pop ?yr ?lat ?lon ?isCap
+WHERE {
+  ?country wdt:P298 "${iso3}" .
+  OPTIONAL { ?country wdt:P36 ?capital . }
+
+  VALUES ?cls { wd:Q515 wd:Q15284 wd:Q486972 }
   ?city wdt:P31/wdt:P279* ?cls .
 
-  {{
+  {
     ?city wdt:P17 ?country .
-  }} UNION {{
+  } UNION {
     ?city (wdt:P131)+ ?admUnit .
     ?admUnit wdt:P17 ?country .
-  }}
+  }
 
-  OPTIONAL {{ ?city wdt:P131 ?admin }}
+  OPTIONAL { ?city wdt:P131 ?admin }
 
   ?city p:P1082 ?stpop .
   ?stpop ps:P1082 ?pop .
-  OPTIONAL {{ ?stpop pq:P585 ?yr }}
+  OPTIONAL { ?stpop pq:P585 ?yr }
 
-  OPTIONAL {{
+  OPTIONAL {
     ?city p:P625 ?st .
     ?st psv:P625 ?coord .
     ?coord wikibase:geoLatitude ?lat ;
            wikibase:geoLongitude ?lon .
-  }}
+  }
 
   BIND(IF(BOUND(?capital) && ?city = ?capital, 1, 0) AS ?isCap)
-  FILTER(?pop >= {min_pop})
-}}
-GROUP BY ?city
-ORDER BY DESC(?pop)
-LIMIT {limit}
-"""
+  FILTER(?pop >= ${min_pop})
+}
+""")
 
-def q_block_no_order(iso3: str, raw_limit: int) -> str:
+def q_block_ordered(iso3: str, min_pop: int = 1000) -> str:
     """
-    Fallback "bruto" clássico (sem ORDER BY), amplo — usado para o resto dos países.
+    Fallback filtrado por população mínima. Já não agrega nem ordena no WDQS
+    (GROUP BY + ORDER BY DESC(?pop) obrigava a um sort global no servidor): devolve linhas
+    brutas (uma por P1082) e o máx. por cidade + Top-N fica para dedup_top.
+    Sem LIMIT: sem ORDER BY, um LIMIT cortava linhas arbitrárias (não as mais populosas);
+    o FILTER de min_pop é que limita o resultado.
     """
-    return f"""
+    return _Q_ORDERED_TMPL.substitute(iso3=iso3, min_pop=min_pop)
+
+_Q_NO_ORDER_TMPL = Template("""
 PREFIX wd: <http://www.wikidata.org/entity/>
 PREFIX wdt: <http://www.wikidata.org/prop/direct/>
 PREFIX p: <http://www.wikidata.org/prop/>
@@ -375,48 +530,45 @@ PREFIX pq: <http://www.wikidata.org/prop/qualifier/>
 PREFIX psv: <http://www.wikidata.org/prop/statement/value/>
 PREFIX wikibase: <http://wikiba.se/ontology#>
 
-SELECT ?city ?admin ?pop ?yr ?isCap ?lat ?lon WHERE {{
-  ?country wdt:P298 "{iso3}" .
-  OPTIONAL {{ ?country wdt:P36 ?capital . }}
+SELECT ?city ?admin ?pop ?yr ?isCap ?lat ?lon WHERE {
+  ?country wdt:P298 "${iso3}" .
+  OPTIONAL { ?country wdt:P36 ?capital . }
 
-  VALUES ?cls {{ wd:Q515 wd:Q15284 wd:Q486972 }}
+  VALUES ?cls { wd:Q515 wd:Q15284 wd:Q486972 }
   ?city wdt:P31/wdt:P279* ?cls .
 
-  {{
+  {
     ?city wdt:P17 ?country .
-  }} UNION {{
+  } UNION {
     ?city (wdt:P131)+ ?admUnit .
     ?admUnit wdt:P17 ?country .
-  }}
+  }
 
-  OPTIONAL {{ ?city wdt:P131 ?admin }}
+  OPTIONAL { ?city wdt:P131 ?admin }
 
   ?city p:P1082 ?stpop .
   ?stpop ps:P1082 ?pop .
-  OPTIONAL {{ ?stpop pq:P585 ?yr }}
+  OPTIONAL { ?stpop pq:P585 ?yr }
 
-  OPTIONAL {{
+  OPTIONAL {
     ?city p:P625 ?st .
     ?st psv:P625 ?coord .
     ?coord wikibase:geoLatitude ?lat ;
            wikibase:geoLongitude ?lon .
-  }}
+  }
 
   BIND(IF(BOUND(?capital) && ?city = ?capital, 1, 0) AS ?isCap)
-}}
-LIMIT {raw_limit}
-"""
+}
+LIMIT ${raw_limit}
+""")
 
-def q_block_stable(iso3: str, limit: int = RAW_LIMIT, min_pop: Optional[int] = STABLE_MIN_POP) -> str:
+def q_block_no_order(iso3: str, raw_limit: int) -> str:
     """
-    Genérica e estável (sem recursões ilimitadas), SEM ORDER BY:
-    - Garante capital (P36).
-    - Aceita Q515, subclasses (1–3) de municipality (Q15284) / commune (Q203934) e fallback Q486972.
-    - País por P17 direto OU P131 (1–2 saltos) para o território ISO-3; suporta territórios com soberano.
-    - População: TODAS as P1082 (Python escolhe o máx. por QID no Top-20).
+    Fallback "bruto" clássico (sem ORDER BY), amplo — usado para o resto dos países.
     """
-    pop_filter = f"\n    FILTER(?pop >= {min_pop})" if isinstance(min_pop, int) else ""
-    return f"""
+    return _Q_NO_ORDER_TMPL.substitute(iso3=iso3, raw_limit=raw_limit)
+
+_Q_STABLE_TMPL = Template("""
 PREFIX wd:  <http://www.wikidata.org/entity/>
 PREFIX wdt: <http://www.wikidata.org/prop/direct/>
 PREFIX p:   <http://www.wikidata.org/prop/>
@@ -426,126 +578,351 @@ PREFIX psv: <http://www.wikidata.org/prop/statement/value/>
 PREFIX wikibase: <http://wikiba.se/ontology#>
 
 SELECT ?city ?admin ?pop ?yr ?lat ?lon ?isCap
-WHERE {{
+WHERE {
   # Território por ISO-3 (e seu soberano, se existir)
-  ?territory wdt:P298 "{iso3}" .
-  OPTIONAL {{ ?territory wdt:P17 ?sovereign }}
+  ?territory wdt:P298 "${iso3}" .
+  OPTIONAL { ?territory wdt:P17 ?sovereign }
   BIND(COALESCE(?sovereign, ?territory) AS ?country_like)
 
   # A) CAPITAL garantida
-  {{
-    OPTIONAL {{ ?territory wdt:P36 ?capital }}
+  {
+    OPTIONAL { ?territory wdt:P36 ?capital }
     BIND(?capital AS ?city)
     FILTER(BOUND(?city))
     BIND(1 AS ?isCap)
-  }}
+  }
   UNION
   # B) Universo estável
-  {{
-    {{
+  {
+    {
       ?city wdt:P31 wd:Q515
-    }} UNION {{
+    } UNION {
       ?city wdt:P31 ?inst1 .
-      {{ ?inst1 wdt:P279 wd:Q15284 }}
-      UNION {{ ?inst1 wdt:P279/wdt:P279 wd:Q15284 }}
-      UNION {{ ?inst1 wdt:P279/wdt:P279/wdt:P279 wd:Q15284 }}
-    }} UNION {{
+      { ?inst1 wdt:P279 wd:Q15284 }
+      UNION { ?inst1 wdt:P279/wdt:P279 wd:Q15284 }
+      UNION { ?inst1 wdt:P279/wdt:P279/wdt:P279 wd:Q15284 }
+    } UNION {
       ?city wdt:P31 ?inst2 .
-      {{ ?inst2 wdt:P279 wd:Q203934 }}
-      UNION {{ ?inst2 wdt:P279/wdt:P279 wd:Q203934 }}
-      UNION {{ ?inst2 wdt:P279/wdt:P279/wdt:P279 wd:Q203934 }}
-    }} UNION {{
+      { ?inst2 wdt:P279 wd:Q203934 }
+      UNION { ?inst2 wdt:P279/wdt:P279 wd:Q203934 }
+      UNION { ?inst2 wdt:P279/wdt:P279/wdt:P279 wd:Q203934 }
+    } UNION {
       ?city wdt:P31 wd:Q486972
-    }}
+    }
 
-    {{
+    {
       ?city wdt:P17 ?territory
-    }} UNION {{
+    } UNION {
       ?city wdt:P131 ?territory
-    }} UNION {{
+    } UNION {
       ?city wdt:P131/wdt:P131 ?territory
-    }} UNION {{
+    } UNION {
       ?city wdt:P17 ?country_like .
-      {{ ?city wdt:P131 ?territory }} UNION {{ ?city wdt:P131/wdt:P131 ?territory }}
-    }}
+      { ?city wdt:P131 ?territory } UNION { ?city wdt:P131/wdt:P131 ?territory }
+    }
 
-    OPTIONAL {{ ?city wdt:P131 ?admin }}
+    OPTIONAL { ?city wdt:P131 ?admin }
 
-    OPTIONAL {{
+    OPTIONAL {
       ?city p:P1082 ?stpop .
       ?stpop ps:P1082 ?pop .
-      OPTIONAL {{ ?stpop pq:P585 ?date . BIND(YEAR(?date) AS ?yr) }}
-    }}{pop_filter}
+      OPTIONAL { ?stpop pq:P585 ?date . BIND(YEAR(?date) AS ?yr) }
+    }${pop_filter}
 
-    OPTIONAL {{
+    OPTIONAL {
       ?city p:P625 ?stc .
       ?stc psv:P625 ?coord .
       ?coord wikibase:geoLatitude ?lat ;
              wikibase:geoLongitude ?lon .
-    }}
+    }
 
     BIND(0 AS ?isCap)
-  }}
-}}
-LIMIT {limit}
+  }
+}
+LIMIT ${limit}
+""")
+
+def q_block_stable(iso3: str, limit: int = RAW_LIMIT, min_pop: Optional[int] = STABLE_MIN_POP) -> str:
+    """
+    Genérica e estável (sem recursões ilimitadas), SEM ORDER BY:
+    - Garante capital (P36).
+    - Aceita Q515, subclasses (1–3) de municipality (Q15284) / commune (Q203934) e fallback Q486972.
+    - País por P17 direto OU P131 (1–2 saltos) para o território ISO-3; suporta territórios com soberano.
+    - População: TODAS as P1082 (Python escolhe o máx. por QID no Top-20).
+    """
+    pop_filter = f"\n    FILTER(?pop >= {min_pop})" if isinstance(min_pop, int) else ""
+    return _Q_STABLE_TMPL.substitute(iso3=iso3, limit=limit, pop_filter=pop_filter)
+
+_PREFIXES = """
+PREFIX wd:  <http://www.wikidata.org/entity/>
+PREFIX wdt: <http://www.wikidata.org/prop/direct/>
+PREFIX p:   <http://www.wikidata.org/prop/>
+PREFIX ps:  <http://www.wikidata.org/prop/statement/>
+PREFIX pq:  <http://www.wikidata.org/prop/qualifier/>
+PREFIX psv: <http://www.wikidata.org/prop/statement/value/>
+PREFIX wikibase: <http://wikiba.se/ontology#>
 """
 
+_COORD_OPTIONAL = """
+  OPTIONAL {
+    ?city p:P625 ?st .
+    ?st psv:P625 ?coord .
+    ?coord wikibase:geoLatitude ?lat ;
+           wikibase:geoLongitude ?lon .
+  }"""
+
+_Q_CAPITAL_TMPL = Template(_PREFIXES + """
+SELECT ?city ?admin ?lat ?lon ?isCap WHERE {
+  ?country wdt:P298 "${iso3}" ;
+           wdt:P36 ?city .
+  OPTIONAL { ?city wdt:P131 ?admin }""" + _COORD_OPTIONAL + """
+  BIND(1 AS ?isCap)
+}
+""")
+
+def q_capital_only(iso3: str) -> str:
+    """Só a capital (P36) com admin e coordenadas — minúscula, sem população."""
+    return _Q_CAPITAL_TMPL.substitute(iso3=iso3)
+
+_Q_POP_PAGE_TMPL = Template(_PREFIXES + """
+SELECT ?city ?pop ?yr WHERE {
+  ?country wdt:P298 "${iso3}" .
+
+  VALUES ?cls { wd:Q515 wd:Q15284 wd:Q486972 }
+  ?city wdt:P31/wdt:P279* ?cls .
+
+  {
+    ?city wdt:P17 ?country .
+  } UNION {
+    ?city (wdt:P131)+ ?admUnit .
+    ?admUnit wdt:P17 ?country .
+  }
+
+  ?city p:P1082 ?stpop .
+  ?stpop ps:P1082 ?pop .
+  OPTIONAL { ?stpop pq:P585 ?yr }${pop_filter}
+}
+ORDER BY ?city
+LIMIT ${page}
+OFFSET ${offset}
+""")
+
+def q_pop_page(iso3: str, min_pop: Optional[int], offset: int, page: int = POP_PAGE) -> str:
+    """
+    Mesmo universo de q_block_no_order, mas só ?city ?pop ?yr (sem OPTIONALs de admin/coords,
+    que multiplicam linhas) e paginado por QID.
+    """
+    pop_filter = f"\n  FILTER(?pop >= {min_pop})" if isinstance(min_pop, int) else ""
+    return _Q_POP_PAGE_TMPL.substitute(iso3=iso3, pop_filter=pop_filter, page=page, offset=offset)
+
+_Q_CITY_ATTRS_TMPL = Template(_PREFIXES + """
+SELECT ?city ?admin ?lat ?lon WHERE {
+  VALUES ?city { ${values} }
+  OPTIONAL { ?city wdt:P131 ?admin }""" + _COORD_OPTIONAL + """
+}
+""")
+
+def q_city_attrs(qids: List[str]) -> str:
+    """Enriquecimento: admin + coordenadas só para as cidades pedidas (Top-N)."""
+    values = " ".join(f"wd:{q}" for q in qids)
+    return _Q_CITY_ATTRS_TMPL.substitute(values=values)
+
 # ──────────────────────────────────────────────────────────────────────────────
 # Parse bruto
 # ──────────────────────────────────────────────────────────────────────────────
-def _parse_int_or_none(x: Optional[str]) -> Optional[int]:
-    if x is None or x == "":
-        return None
-    try:
-        if len(x) >= 4 and x[0:4].isdigit():
-            return int(x[0:4])
-        return int(x)
-    except Exception:
-        return None
-
-def parse_rows(js: Optional[dict]) -> List[Tuple]:
-    """Tuplos: (city_qid, admin_q, is_cap, pop, yr, lat, lon)."""
-    out: List[Tuple] = []
-    if not js:
-        return out
-    for r in js.get("results", {}).get("bindings", []):
-        g = lambda k: r.get(k, {}).get("value")
-        city_qid = (g("city") or "").split("/")[-1]
-        if not city_qid:
-            continue
-        admin_q  = (g("admin") or "").split("/")[-1] if g("admin") else ""
-        cap      = 1 if g("isCap") in ("1","true","True") else 0
+_RAW_COLS = ["city_qid","admin_q","is_cap","pop","yr","lat","lon"]
+_RAW_VARS = ("city", "admin", "isCap", "pop", "yr", "lat", "lon")   # variáveis SPARQL, pela ordem de _RAW_COLS
 
-        pop = g("pop"); yr = g("yr"); lat = g("lat"); lon = g("lon")
+def _qid(s: pd.Series) -> pd.Series:
+    """URI da entidade → QID ("http://www.wikidata.org/entity/Q45" → "Q45")."""
+    return s.str.rsplit("/", n=1).str[-1]
 
-        try: pop_v = int(float(pop)) if pop not in (None, "") else None
-        except: pop_v = None
-        yr_v  = _parse_int_or_none(yr)
-        try: lat_v = float(lat) if lat not in (None, "") else None
-        except: lat_v = None
-        try: lon_v = float(lon) if lon not in (None, "") else None
-        except: lon_v = None
+def parse_frame(js: Optional[dict], iso3: str, country_name: str) -> pd.DataFrame:
+    """
+    Bindings WDQS → DataFrame tipado (o que vai para o tmp): is_cap int8, pop/yr Int64,
+    lat/lon float64 (float32 mudava os dígitos das coordenadas no CSV), QIDs/país como category.
+    O ciclo só recolhe os textos por coluna; QIDs e números são convertidos depois, de uma vez
+    (str.rsplit / pd.to_numeric) — sem try/except nem split por linha.
+    """
+    cols: Dict[str, List] = {v: [] for v in _RAW_VARS}
+    for r in (js or {}).get("results", {}).get("bindings", []):
+        for v in _RAW_VARS:
+            cols[v].append(r[v].get("value") if v in r else None)
+
+    df = pd.DataFrame({c: pd.Series(cols[v], dtype="string") for c, v in zip(_RAW_COLS, _RAW_VARS)})
+    df["city_qid"] = _qid(df["city_qid"])
+    df = df[df["city_qid"].fillna("") != ""]
+    df.insert(0, "iso3", iso3)
+    df.insert(1, "country", country_name)
+    df["admin_q"] = _qid(df["admin_q"]).replace("", pd.NA)
+    df["is_cap"] = df["is_cap"].isin(["1", "true", "True"]).astype("int8")
+    df["pop"] = np.floor(pd.to_numeric(df["pop"], errors="coerce")).astype("Int64")
+    # datas "2020-01-01T00:00:00Z" → 2020
+    df["yr"]  = pd.to_numeric(df["yr"].str.slice(0, 4), errors="coerce").astype("Int64")
+    df["lat"] = pd.to_numeric(df["lat"], errors="coerce").astype("float64")
+    df["lon"] = pd.to_numeric(df["lon"], errors="coerce").astype("float64")
+    return df.reset_index(drop=True).astype({"iso3": "category", "country": "category",
+                                             "city_qid": "category", "admin_q": "category"})
+
+def dedup_top(df: pd.DataFrame, top_n: int = TOP_N) -> pd.DataFrame:
+    """
+    Uma linha por cidade (a de maior população; admin/ano/coords em falta vêm das outras
+    linhas da mesma cidade, capital se alguma linha o for) e Top-N por população.
+    Recebe o DataFrame de parse_frame (ou o tmp relido).
+    """
+    # maior pop primeiro → "first" (que salta NaN) fica com a linha de maior pop e preenche o resto
+    df = df.sort_values("pop", ascending=False, na_position="last", kind="stable")
+    agg = df.groupby("city_qid", as_index=False, sort=False, observed=True).agg(
+        admin_q=("admin_q", "first"), is_cap=("is_cap", "max"), pop=("pop", "first"),
+        yr=("yr", "first"), lat=("lat", "first"), lon=("lon", "first"),
+    )
+    agg["city_qid"] = agg["city_qid"].astype(str)
+    # Top-N sem ordenar todas as cidades: np.partition dá a pop. da N-ésima (O(n)) e só os
+    # candidatos >= esse limiar (empates incluídos) são ordenados
+    pop = agg["pop"].fillna(-1).to_numpy("int64")
+    if len(pop) > top_n:
+        kth = np.partition(pop, len(pop) - top_n)[len(pop) - top_n]
+        agg = agg[pop >= kth]
+    # cidades sem pop contam como -1 (entram só se faltarem cidades); empate → QID maior, como antes
+    return (agg.sort_values(["pop", "city_qid"], ascending=False, na_position="last")
+               .head(top_n).reset_index(drop=True))
+
+def _bindings(js: Optional[dict]) -> List[dict]:
+    return (js or {}).get("results", {}).get("bindings", [])
+
+def fetch_split(iso3: str) -> dict | None:
+    """
+    Capital (1 query) + população paginada (ORDER BY ?city, até < POP_PAGE linhas ou RAW_LIMIT)
+    + admin/coords só do Top-N; junta tudo num pseudo-JSON WDQS, fundido por QID em dedup_top.
+    None se a população falhar/vier vazia ou chegar a RAW_LIMIT (→ queries monolíticas): as
+    páginas vêm por QID, não por população, e cortar aí perdia cidades grandes.
+    """
+    bindings = list(_bindings(sparql_post(q_capital_only(iso3))))
+
+    n_pop = 0
+    for offset in range(0, RAW_LIMIT, POP_PAGE):
+        js = sparql_post(q_pop_page(iso3, STABLE_MIN_POP, offset))
+        if js is None:
+            return None
+        page = _bindings(js)
+        bindings.extend(page)
+        n_pop += len(page)
+        if len(page) < POP_PAGE:
+            break
+    else:
+        print(f"  … split: {iso3} chegou a RAW_LIMIT={RAW_LIMIT} linhas; usar a query monolítica",
+              file=sys.stderr)
+        return None
+    if not n_pop:
+        return None
 
-        out.append((city_qid, admin_q, cap, pop_v, yr_v, lat_v, lon_v))
-    return out
+    top = dedup_top(parse_frame({"results": {"bindings": bindings}}, iso3, ""))
+    need = top.loc[top["admin_q"].isna() | top["lat"].isna(), "city_qid"].tolist()
+    if need:
+        bindings.extend(_bindings(sparql_post(q_city_attrs(need))))
+    return {"results": {"bindings": bindings}}
 
 # ──────────────────────────────────────────────────────────────────────────────
 # Pipeline por país: query -> tmp -> dedupe Top-N -> final (mantendo tmp)
 # ──────────────────────────────────────────────────────────────────────────────
-def process_iso3(iso3: str, country_name: str, writer: csv.writer) -> bool:
-    TMP_DIR.mkdir(parents=True, exist_ok=True)
+# cooldown partilhado entre threads: quem chega ao múltiplo de COOLDOWN_EVERY adia os próximos arranques
+_COOLDOWN_LOCK = threading.Lock()
+_COOLDOWN_UNTIL = 0.0
+_COOLDOWN_SHARED = None           # multiprocessing.Value("d") em modo processos (ver _init_worker)
+
+def _start_cooldown(secs: float) -> None:
+    global _COOLDOWN_UNTIL
+    until = time.monotonic() + secs
+    if _COOLDOWN_SHARED is not None:
+        with _COOLDOWN_SHARED.get_lock():
+            _COOLDOWN_SHARED.value = max(_COOLDOWN_SHARED.value, until)
+        return
+    with _COOLDOWN_LOCK:
+        _COOLDOWN_UNTIL = max(_COOLDOWN_UNTIL, until)
+
+def _wait_cooldown() -> None:
+    if _COOLDOWN_SHARED is not None:
+        wait = _COOLDOWN_SHARED.value - time.monotonic()
+    else:
+        with _COOLDOWN_LOCK:
+            wait = _COOLDOWN_UNTIL - time.monotonic()
+    if wait > 0:
+        time.sleep(wait)
+
+_TMP_HEAD = ["iso3","country","city_qid","admin_q","is_cap","pop","yr","lat","lon"]
+
+def _save_raw(df: pd.DataFrame, path: Path) -> Path:
+    """tmp bruto em parquet (zstd, tipos preservados); sem pyarrow, CSV ao lado."""
+    try:
+        df.to_parquet(path, index=False, engine="pyarrow", compression="zstd")
+        return path
+    except ImportError:
+        out = path.with_suffix(".csv")
+        df.to_csv(out, index=False, encoding="utf-8")
+        return out
 
-    raw: List[Tuple] = []
+def _load_raw(path: Path) -> pd.DataFrame | None:
+    """tmp parquet não vazio e dentro de CACHE_TTL (e cache ligada) → DataFrame; senão None."""
+    if not USE_CACHE:
+        return None
     try:
-        js = None
+        if time.time() - path.stat().st_mtime > CACHE_TTL:
+            return None
+        df = pd.read_parquet(path)
+    except (OSError, ImportError, ValueError):
+        return None
+    return df if not df.empty else None
+
+def _write_tmp_csv(path: Path, rows) -> None:
+    with path.open("w", newline="", encoding="utf-8") as fh:
+        w = csv.writer(fh)
+        w.writerow(_TMP_HEAD)
+        w.writerows(rows)
 
+def write_output(path: Path, rows: List[List]) -> None:
+    """
+    Escreve o CSV final de uma vez, com um único fsync no fim. Com pyarrow: tabela Arrow tipada,
+    pyarrow.csv.write_csv (escrita em C) e um .parquet ao lado; sem pyarrow: csv.writer.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.csv as pacsv
+        import pyarrow.parquet as pq
+    except ImportError:
+        with path.open("w", newline="", encoding="utf-8", buffering=1 << 20) as f:
+            try:
+                w = csv.writer(f)
+                w.writerow(HEAD)
+                w.writerows(rows)
+            finally:
+                f.flush(); os.fsync(f.fileno())
+        return
+
+    schema = pa.schema([("iso3", pa.string()), ("country", pa.string()), ("city", pa.string()),
+                        ("city_qid", pa.string()), ("admin", pa.string()), ("is_capital", pa.int8()),
+                        ("population", pa.int64()), ("year", pa.int64()),
+                        ("lat", pa.float64()), ("lon", pa.float64())])
+    table = pa.Table.from_pylist([dict(zip(HEAD, r)) for r in rows], schema=schema)
+    with path.open("wb") as f:
+        try:
+            pacsv.write_csv(table, f, pacsv.WriteOptions(include_header=True))
+        finally:
+            f.flush(); os.fsync(f.fileno())
+    pq.write_table(table, path.with_suffix(".parquet"), compression="zstd")
+
+def query_iso3(iso3: str) -> dict | None:
+    """Cadeia de queries WDQS de um país (casos específicos → split → monolíticas)."""
+    js = None
+    try:
         # 1) Casos específicos primeiro
         if iso3 == "CHN":
             js = sparql_post(q_chn_user(limit=200, min_pop=1000000))
         elif iso3 == "FRA":
             js = sparql_post(q_fra_wide(limit=200, min_pop=50000))
+        elif SPLIT_QUERIES:
+            js = fetch_split(iso3)
 
-        # 2) Restante mundo → “como estava”: BRUTA sem ORDER BY
+        # 2) Restante mundo (ou split vazio/falhado) → “como estava”: BRUTA sem ORDER BY
         if not js or not js.get("results", {}).get("bindings"):
             js = sparql_post(q_block_no_order(iso3, raw_limit=RAW_LIMIT))
 
@@ -556,155 +933,167 @@ def process_iso3(iso3: str, country_name: str, writer: csv.writer) -> bool:
         if not js or not js.get("results", {}).get("bindings"):
             print("  … ordered vazio; tentar stable genérica", file=sys.stderr)
             js = sparql_post(q_block_stable(iso3, limit=RAW_LIMIT, min_pop=STABLE_MIN_POP))
-
-        raw = parse_rows(js) if js else []
     except Exception as e:
         print(f"  … erro inesperado a consultar WDQS: {e}", file=sys.stderr)
-        raw = []
+        js = None
+    return js
 
-    # 2) Guardar RAW em tmp SEMPRE (mesmo vazio)
-    tmp_path = (TMP_DIR / f"{iso3}.csv").resolve()
-    df_raw = pd.DataFrame(raw, columns=["city_qid","admin_q","is_cap","pop","yr","lat","lon"])
-    df_raw.insert(0, "iso3", iso3)
-    df_raw.insert(1, "country", country_name)
-    df_raw.to_csv(tmp_path, index=False, encoding="utf-8")
-    print(f"[debug] {iso3}: {len(df_raw)} linhas brutas → tmp: {tmp_path}")
+def collect_iso3(iso3: str, country_name: str) -> List[List]:
+    """
+    Query -> tmp -> dedupe Top-N; devolve as linhas finais (HEAD) sem escrever no CSV,
+    com o QID em city/admin (ver apply_labels).
+    Com cache ligada, um tmp/<iso3>.parquet recente evita as queries por completo.
+    """
+    TMP_DIR.mkdir(parents=True, exist_ok=True)
+    tmp_path = (TMP_DIR / f"{iso3}.parquet").resolve()
 
-    # 3) Se vazio, não prossegue; fica para retry
-    if df_raw.empty:
-        return False
+    df = _load_raw(tmp_path)
+    if df is not None:
+        print(f"[cache] {iso3}: {len(df)} linhas brutas ← tmp: {tmp_path}")
+    else:
+        _wait_cooldown()
+        js = query_iso3(iso3)
 
-    # 4) Deduplicação on-the-fly + Top-N (sem ordenar tudo)
-    by_city: Dict[str, Dict] = {}
-    for (cq, aq, cap, pop, yr, lat, lon) in raw:
-        if not cq:
-            continue
-        cur = by_city.get(cq)
-        if cur is None or (pop or -1) > (cur.get("pop") or -1):
-            by_city[cq] = {
-                "admin_q": (aq or (cur["admin_q"] if cur else "")),
-                "is_cap": int(bool(cap)) or (cur["is_cap"] if cur else 0),
-                "pop": pop, "yr": yr, "lat": lat, "lon": lon
-            }
-        else:
-            if cap:
-                cur["is_cap"] = 1
-            if not cur.get("admin_q") and aq:
-                cur["admin_q"] = aq
-            if cur.get("lat") is None and lat is not None:
-                cur["lat"] = lat
-            if cur.get("lon") is None and lon is not None:
-                cur["lon"] = lon
-            if cur.get("yr") is None and yr is not None:
-                cur["yr"] = yr
-
-    top_items = heapq.nlargest(
-        TOP_N,
-        by_city.items(),
-        key=lambda kv: ((kv[1].get("pop") if kv[1].get("pop") is not None else -1), kv[0])
-    )
+        # 2) Guardar RAW em tmp SEMPRE (mesmo vazio)
+        df = parse_frame(js, iso3, country_name)
+        saved = _save_raw(df, tmp_path)
+        print(f"[debug] {iso3}: {len(df)} linhas brutas → tmp: {saved}")
 
-    rows_top: List[List] = []
-    for cq, d in top_items:
-        rows_top.append([
-            cq, d.get("admin_q",""), d.get("is_cap",0), d.get("pop"),
-            d.get("yr"), d.get("lat"), d.get("lon")
+    # 3) Se vazio, não prossegue; fica para retry
+    if df.empty:
+        return []
+
+    # 4) Deduplicação + Top-N vetorizados (groupby/agg)
+    top = dedup_top(df)
+
+    # 5) Linhas finais; city/admin ficam com o QID — as labels vêm depois, num só passo (apply_labels)
+    rows: List[List] = []
+    for r in top.itertuples(index=False):
+        rows.append([
+            iso3, country_name, r.city_qid, r.city_qid, r.admin_q if pd.notna(r.admin_q) else "",
+            int(r.is_cap),
+            int(r.pop) if pd.notna(r.pop) else None,
+            int(r.yr) if pd.notna(r.yr) else None,
+            float(r.lat) if pd.notna(r.lat) else None,
+            float(r.lon) if pd.notna(r.lon) else None,
         ])
-    df_top = pd.DataFrame(rows_top, columns=["city_qid","admin_q","is_cap","pop","yr","lat","lon"])
 
-    # 5) Guardar preview Top-N ao lado do tmp (mantendo temporários)
+    # 6) Guardar preview Top-N ao lado do tmp (mantendo temporários)
     top_path = (TMP_DIR / f"{iso3}_top.csv").resolve()
-    df_prev = df_top.copy()
-    df_prev.insert(0, "iso3", iso3)
-    df_prev.insert(1, "country", country_name)
-    df_prev.to_csv(top_path, index=False, encoding="utf-8")
-    print(f"[debug] {iso3}: Top {len(df_top)} preview → {top_path}")
-
-    # 6) Labels e escrita final (OVERWRITE já garantido no main)
-    lbl_city   = wd_get_labels(df_top["city_qid"].tolist(), "pt")
-    admin_qids = [x for x in df_top["admin_q"].tolist() if x]
-    lbl_admin  = wd_get_labels(admin_qids, "pt") if admin_qids else {}
-
-    wrote = 0
-    for _, r in df_top.iterrows():
-        cq = r["city_qid"]; aq = r["admin_q"] or ""
-        cap = int(r["is_cap"] or 0)
-        pop = int(r["pop"]) if pd.notna(r["pop"]) else None
-        yr  = int(r["yr"]) if pd.notna(r["yr"]) else None
-        lat = float(r["lat"]) if pd.notna(r["lat"]) else None
-        lon = float(r["lon"]) if pd.notna(r["lon"]) else None
-        writer.writerow([
-            iso3, country_name,
-            lbl_city.get(cq, cq), cq,
-            lbl_admin.get(aq, ""), cap, pop, yr, lat, lon
-        ])
-        wrote += 1
+    _write_tmp_csv(top_path, ([r[0], r[1], r[3], *r[4:]] for r in rows))
+    print(f"[debug] {iso3}: Top {len(rows)} preview → {top_path}")
 
-    print(f"[ok] {iso3}: Top {len(df_top)} escritas")
-    return wrote > 0
+    print(f"[ok] {iso3}: Top {len(rows)} recolhidas")
+    return rows
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Workers (threads ou processos)
+# ──────────────────────────────────────────────────────────────────────────────
+def _init_worker(sem, cooldown, use_cache: bool) -> None:
+    """Arranque de cada processo: semáforo/cooldown partilhados, sessões próprias, flag de cache."""
+    global _WDQS_SEM, _COOLDOWN_SHARED, USE_CACHE, SQS, SWD
+    _WDQS_SEM, _COOLDOWN_SHARED, USE_CACHE = sem, cooldown, use_cache
+    SQS, SWD = _session(), _session()
+
+def _collect_worker(item: Tuple[str,str]) -> List[List]:
+    iso3, country = item
+    print(f"[cities] {iso3} {country}", flush=True)
+    try:
+        rows = collect_iso3(iso3, country)
+    except Exception as e:
+        print(f"  … {iso3}: erro inesperado ({e})", file=sys.stderr)
+        rows = []
+    time.sleep(BASE_PAUSE + random.uniform(0,0.2))
+    return rows
+
+def _executor():
+    if not USE_PROCESSES:
+        return ThreadPoolExecutor(max_workers=MAX_WORKERS)
+    global _COOLDOWN_SHARED
+    _COOLDOWN_SHARED = mp.Value("d", 0.0)
+    return ProcessPoolExecutor(max_workers=MAX_WORKERS, initializer=_init_worker,
+                               initargs=(mp.Semaphore(WDQS_MAX_CONCURRENT), _COOLDOWN_SHARED, USE_CACHE))
 
 # ──────────────────────────────────────────────────────────────────────────────
 # Main
 # ──────────────────────────────────────────────────────────────────────────────
 def main():
+    global USE_CACHE
+    if "--no-cache" in sys.argv[1:]:
+        USE_CACHE = False
     seed = load_seed()
 
     if REFRESH_ISO3:
         only = {i.upper() for i in REFRESH_ISO3}
         before = len(seed)
-        seed = seed[seed["iso3"].astype(str).str.upper().isin(only)].copy()
+        seed = seed[seed["iso3"].isin(only)]
         print(f"[debug] seed filtrada: {len(seed)}/{before} países -> {sorted(only)}")
 
     OUT_PATH.parent.mkdir(parents=True, exist_ok=True)
     TMP_DIR.mkdir(parents=True, exist_ok=True)
 
+    # SKIP_DONE: países já escritos (e confirmados pelo hash) são reescritos tal como estavam
+    done = load_done_rows() if SKIP_DONE else {}
+
     # Overwrite total do ficheiro final
     if OUT_PATH.exists():
         OUT_PATH.unlink()
 
-    done = set()
-    f = OUT_PATH.open("w", newline="", encoding="utf-8")
-    w = csv.writer(f)
-    w.writerow(HEAD); f.flush(); os.fsync(f.fileno())
-
     processed = 0
     failed: List[Tuple[str,str]] = []
 
-    for _, r in seed.iterrows():
-        iso3 = str(r["iso3"]).upper().strip()
+    order: List[str] = []
+    todo: List[Tuple[str,str]] = []
+    for iso3, name_pt, name_en in seed[["iso3","name_pt","name_en"]].itertuples(index=False, name=None):
         if not iso3:
             continue
-        country = r.get("name_pt") or r.get("name_en") or iso3
+        country = name_pt or name_en or iso3
+        order.append(iso3)
 
-        if SKIP_DONE and iso3 in read_done_iso3():
+        if iso3 in done:
             print(f"[skip] {iso3} já presente")
             continue
+        todo.append((iso3, country))
 
-        print(f"[cities] {iso3} {country}")
-        ok = process_iso3(iso3, country, w)
-        f.flush(); os.fsync(f.fileno())
-        if ok:
-            done.add(iso3)
-        else:
-            failed.append((iso3, country))
-
-        processed += 1
-        time.sleep(BASE_PAUSE + random.uniform(0,0.2))
-        if processed % COOLDOWN_EVERY == 0:
-            print(f"  … cooldown {COOLDOWN_SECS}s", file=sys.stderr)
-            time.sleep(COOLDOWN_SECS)
-
-    if failed:
-        print(f"\n↻ Repetir países que falharam: {len(failed)}")
-        time.sleep(3)
-        for iso3, country in failed:
-            print(f"[retry] {iso3} {country}")
-            ok = process_iso3(iso3, country, w)
-            f.flush(); os.fsync(f.fileno())
-            time.sleep(BASE_PAUSE * 1.8 + random.uniform(0, 0.2))
-
-    f.close()
+    # 1) recolha: até MAX_WORKERS países em voo (threads, ou processos com USE_PROCESSES); pela ordem da seed
+    #    Ctrl-C → escreve já o que foi recolhido (sem retry) em vez de perder tudo
+    rows_by_iso3: Dict[str, List[List]] = {}
+    interrupted = False
+    try:
+        with _executor() as ex:
+            for (iso3, country), rows in zip(todo, ex.map(_collect_worker, todo)):
+                rows_by_iso3[iso3] = rows
+                if not rows:
+                    failed.append((iso3, country))
+
+                processed += 1
+                if processed % COOLDOWN_EVERY == 0:
+                    print(f"  … cooldown {COOLDOWN_SECS}s", file=sys.stderr)
+                    _start_cooldown(COOLDOWN_SECS)
+
+        if failed:
+            print(f"\n↻ Repetir países que falharam: {len(failed)}")
+            time.sleep(3)
+            for iso3, country in failed:
+                print(f"[retry] {iso3} {country}")
+                rows_by_iso3[iso3] = collect_iso3(iso3, country)
+                time.sleep(BASE_PAUSE * 1.8 + random.uniform(0, 0.2))
+    except KeyboardInterrupt:
+        interrupted = True
+        print(f"\n[interrompido] a gravar {len(rows_by_iso3)} países já recolhidos", file=sys.stderr)
+
+    # 2) labels de todas as cidades/regiões de uma vez (cache + lotes em paralelo) e escrita final
+    #    (write_output: pyarrow quando há, um único fsync no fim, também se a escrita for interrompida)
+    all_rows = [row for rows in rows_by_iso3.values() for row in rows]
+    print(f"[labels] {len(all_rows)} linhas de {len(rows_by_iso3)} países")
+    final: Dict[str, List[List]] = dict(done)          # já com labels
+    for row in apply_labels(all_rows):
+        final.setdefault(row[0], []).append(row)
+    write_output(OUT_PATH, [row for iso3 in order for row in final.get(iso3, ())])
+    save_done_hashes(final)
     print(f"✔️ Atualizado {OUT_PATH}")
+    if interrupted:
+        sys.exit(130)
 
 if __name__ == "__main__":
     main()
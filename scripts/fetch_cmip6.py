@@ -19,7 +19,7 @@ from __future__ import annotations
 from pathlib import Path
 import argparse
 import sys
-import io
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 
 # importa utilidades já existentes no teu projeto
@@ -35,6 +35,7 @@ OUT_BASE.mkdir(parents=True, exist_ok=True)
 
 SCENARIOS = ["historical", "ssp126", "ssp245", "ssp370", "ssp585"]
 DEFAULT_MODELS = ["EC-Earth3", "MPI-ESM1-2-HR", "CMCC-ESM2", "UKESM1-0-LL"]
+FETCH_WORKERS = 8   # séries em simultâneo: é I/O (zarr/fsspec/parquet), o GIL é libertado nas leituras
 BASELINES = {
     "1991-2020": (1991, 2020),
     "1981-2010": (1981, 2010),
@@ -89,18 +90,29 @@ def bake_one_location(name: str, lat: float, lon: float, baseline_key: str) -> N
     location = {"type": "point", "lat": float(lat), "lon": float(lon)}
     rows = []
 
-    # recolha (cria cache parquet da 1ª vez)
-    for _, mrow in members.iterrows():
-        model = mrow["source_id"]; member = mrow["member_id"]; grid = mrow["grid_label"]
-        for exp in SCENARIOS:
-            s = fetch_series_cached(model, member, grid, exp, location=location, annual=True, refresh=False)
+    # recolha (cria cache parquet da 1ª vez); cada (modelo, cenário) é independente → em paralelo.
+    # ex.map devolve pela ordem das tarefas, por isso o CSV sai igual ao da recolha em série
+    tasks = [(model, member, grid, exp)
+             for model, member, grid in members[["source_id", "member_id", "grid_label"]].itertuples(index=False)
+             for exp in SCENARIOS]
+
+    def _fetch(t: tuple[str, str, str, str]) -> pd.Series:
+        model, member, grid, exp = t
+        return fetch_series_cached(model, member, grid, exp, location=location, annual=True, refresh=False)
+
+    # model/scenario como categóricas (categorias fixas e ordenadas → o concat mantém-nas e a ordem não muda)
+    model_cats = sorted({t[0] for t in tasks})
+    scen_cats = sorted(SCENARIOS)
+
+    with ThreadPoolExecutor(max_workers=min(FETCH_WORKERS, len(tasks))) as ex:
+        for (model, member, grid, exp), s in zip(tasks, ex.map(_fetch, tasks)):
             if s.empty:
                 continue
             sa = anomalies(s, baseline=baseline)
             df = pd.DataFrame({"time": s.index, "tas (°C)": s.values})
             df["ΔT (°C)"] = sa.reindex(s.index).values
-            df["model"] = model
-            df["scenario"] = exp
+            df["model"] = pd.Categorical([model] * len(df), categories=model_cats)
+            df["scenario"] = pd.Categorical([exp] * len(df), categories=scen_cats)
             rows.append(df)
 
     if not rows:
@@ -111,20 +123,17 @@ def bake_one_location(name: str, lat: float, lon: float, baseline_key: str) -> N
     full["year"] = full["time"].dt.year
     full = full[full["year"] >= 1950].copy()
 
-    # suavização leve (5 anos) antes da estatística por cenário
-    def _smooth_rolling(g: pd.DataFrame, y: str = "ΔT (°C)", win: int = 5) -> pd.DataFrame:
-        g = g.sort_values("time").copy()
-        g[y] = g[y].rolling(win, center=True, min_periods=1).mean()
-        return g
-
-    smooth = (
-        full.groupby(["model", "scenario"], group_keys=False, observed=False)
-            .apply(_smooth_rolling)
+    # suavização leve (5 anos) antes da estatística por cenário — rolling agrupado, sem callback por grupo
+    smooth = full.sort_values(["model", "scenario", "time"])
+    smooth["ΔT (°C)"] = (
+        smooth.groupby(["model", "scenario"], sort=False, observed=True)["ΔT (°C)"]
+              .rolling(5, center=True, min_periods=1).mean()
+              .reset_index(level=[0, 1], drop=True)
     )
 
     # estatística por cenário
     stat = (
-        smooth.groupby(["scenario", "time"], observed=False)["ΔT (°C)"]
+        smooth.groupby(["scenario", "time"], observed=True)["ΔT (°C)"]
               .agg(["mean", "min", "max"])
               .reset_index()
     )
@@ -133,7 +142,7 @@ def bake_one_location(name: str, lat: float, lon: float, baseline_key: str) -> N
     smooth["decada"] = (smooth["year"] // 10) * 10
     dec = (
         smooth[smooth["year"] >= 1950]
-        .groupby(["scenario", "decada"], observed=False)["ΔT (°C)"]
+        .groupby(["scenario", "decada"], observed=True)["ΔT (°C)"]
         .mean()
         .reset_index()
         .pivot(index="decada", columns="scenario", values="ΔT (°C)")
@@ -148,10 +157,10 @@ def bake_one_location(name: str, lat: float, lon: float, baseline_key: str) -> N
     meta = f"# location={name} lat={lat} lon={lon} baseline={baseline_key}\n"
 
     def _to_csv(path: Path, df: pd.DataFrame):
-        txt = io.StringIO()
-        txt.write(meta)
-        df.to_csv(txt, index=False)
-        path.write_text(txt.getvalue(), encoding="utf-8")
+        # escreve direto no ficheiro (sem montar o CSV inteiro numa string em memória)
+        with path.open("w", encoding="utf-8", newline="") as fh:
+            fh.write(meta)
+            df.to_csv(fh, index=False)
 
     _to_csv(base / "timeseries.csv", full)
     _to_csv(base / "stat_mean_band.csv", stat)
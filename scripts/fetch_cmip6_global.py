@@ -2,12 +2,24 @@
 # -*- coding: utf-8 -*-
 from __future__ import annotations
 
+from concurrent.futures import ThreadPoolExecutor
+import os
+
 import numpy as np
 import pandas as pd
 import xarray as xr
 from intake_esm import esm_datastore
 from pathlib import Path
 
+try:
+    import dask  # noqa: F401  (opcional: zarr em chunks → média global lazy e paralela)
+except ImportError:
+    dask = None
+try:
+    from dask.distributed import Client  # opcional: cluster local para os cálculos dask
+except ImportError:
+    Client = None
+
 CAT = "https://storage.googleapis.com/cmip6/pangeo-cmip6.json"
 #OUT_DIR = Path(__file__).resolve().parents[2] / "data"   # <-- agora em data/
 #OUT_DIR.mkdir(parents=True, exist_ok=True)
@@ -26,6 +38,11 @@ MODELS_PREFERRED = [
     "UKESM1-0-LL", "IPSL-CM6A-LR", "GFDL-ESM4", "NorESM2-LM"
 ]
 BASELINE = (1991, 2020)  # para anomalias
+MODEL_CATS = sorted(MODELS_PREFERRED)   # categorias de model/scenario (ordenadas: a ordem dos CSVs não muda)
+EXP_CATS = sorted(EXPS)
+FETCH_WORKERS = 4        # modelo×cenário em simultâneo (abrir zarr é I/O; cada um segura uma grelha global)
+ZARR_CHUNKS = {"time": 120}   # 10 anos de meses por chunk, grelha inteira (só com dask instalado)
+USE_DASK_CLIENT = True        # arranca um dask.distributed.Client local se estiver instalado
 
 def _open_first_zarr(q) -> xr.Dataset | None:
     if len(q.df) == 0:
@@ -46,15 +63,17 @@ def _open_first_zarr(q) -> xr.Dataset | None:
     if df.empty:
         return None
     z = df.iloc[0]["zstore"]
+    # com dask, a leitura fica lazy e em chunks de tempo (RAM limitada a poucos chunks)
+    chunks = ZARR_CHUNKS if dask is not None else None
     try:
-        ds = xr.open_zarr(z, consolidated=True, storage_options={"token": "anon"})
+        ds = xr.open_zarr(z, consolidated=True, chunks=chunks, storage_options={"token": "anon"})
     except Exception:
-        ds = xr.open_zarr(z, consolidated=False, storage_options={"token": "anon"})
+        ds = xr.open_zarr(z, consolidated=False, chunks=chunks, storage_options={"token": "anon"})
     ds = ds[[VAR]]
     return xr.decode_cf(ds, use_cftime=True)
 
 def _global_mean_tas(ds: xr.Dataset) -> xr.DataArray:
-    """Média global área-ponderada (°C) a partir de 'tas' (K)."""
+    """Média global área-ponderada (°C) a partir de 'tas' (K); lazy se ds vier em chunks dask."""
     da = ds[VAR] - 273.15  # K -> °C
     w = np.cos(np.deg2rad(da["lat"]))
     return da.weighted(w).mean(("lat", "lon"), skipna=True)  # mensal
@@ -63,6 +82,41 @@ def _annual_index_from_years(years: np.ndarray) -> pd.DatetimeIndex:
     # anos -> datas no meio do ano (evita calendários CF exóticos)
     return pd.to_datetime(pd.Series(years.astype(int)).astype(str)) + pd.offsets.MonthBegin(7)
 
+def _fetch_one(cat, model: str, member: str, grid: str, exp: str) -> pd.DataFrame | None:
+    """Série anual global (°C) de um modelo/cenário; None se não abrir ou falhar."""
+    print(f"[CMIP6] {model} / {exp} …")
+    q = cat.search(
+        source_id=model,
+        variable_id=VAR,
+        table_id=TABLE,
+        experiment_id=exp,
+        member_id=member,
+        grid_label=grid,
+    )
+    ds = _open_first_zarr(q)
+    if ds is None or "time" not in ds.dims:
+        print(f"  › falhou: {model} {exp}")
+        return None
+    try:
+        tas_gm = _global_mean_tas(ds)          # mensal °C
+        # ⚠️ xarray.groupby NÃO aceita observed=…
+        ann = tas_gm.groupby("time.year").mean("time", skipna=True).compute()   # um só compute do grafo
+
+        years = np.asarray(ann["year"].values).astype(int)
+        idx = _annual_index_from_years(years)
+        vals = np.asarray(ann.values).reshape(-1)
+
+        s = pd.Series(vals, index=idx)
+        return pd.DataFrame({
+            "time": s.index,
+            "tasC": s.values,
+            "model": pd.Categorical([model] * len(s), categories=MODEL_CATS),
+            "scenario": pd.Categorical([exp] * len(s), categories=EXP_CATS),
+        })
+    except Exception as e:
+        print(f"  › erro a processar {model}/{exp}: {e}")
+        return None
+
 def main() -> None:
     print("[CMIP6] a carregar catálogo…")
     cat = esm_datastore(CAT)
@@ -72,7 +126,7 @@ def main() -> None:
     if not models:
         raise SystemExit("Sem modelos elegíveis no catálogo CMIP6.")
 
-    rows = []
+    tasks = []
     for model in models:
         sub = avail[avail["source_id"] == model]
         if sub.empty:
@@ -84,40 +138,19 @@ def main() -> None:
         else:
             member = sub.iloc[0]["member_id"]
             grid = sub.iloc[0]["grid_label"]
+        tasks += [(model, member, grid, exp) for exp in EXPS]
 
-        for exp in EXPS:
-            print(f"[CMIP6] {model} / {exp} …")
-            q = cat.search(
-                source_id=model,
-                variable_id=VAR,
-                table_id=TABLE,
-                experiment_id=exp,
-                member_id=member,
-                grid_label=grid,
-            )
-            ds = _open_first_zarr(q)
-            if ds is None or "time" not in ds.dims:
-                print(f"  › falhou: {model} {exp}")
-                continue
-            try:
-                tas_gm = _global_mean_tas(ds)          # mensal °C
-                # ⚠️ xarray.groupby NÃO aceita observed=…
-                ann = tas_gm.groupby("time.year").mean("time", skipna=True)
-
-                years = np.asarray(ann["year"].values).astype(int)
-                idx = _annual_index_from_years(years)
-                vals = np.asarray(ann.values).reshape(-1)
-
-                s = pd.Series(vals, index=idx)
-                out = pd.DataFrame({
-                    "time": s.index,
-                    "tasC": s.values,
-                    "model": model,
-                    "scenario": exp,
-                })
-                rows.append(out)
-            except Exception as e:
-                print(f"  › erro a processar {model}/{exp}: {e}")
+    client = None
+    if USE_DASK_CLIENT and Client is not None:
+        client = Client(n_workers=max(1, (os.cpu_count() or 2) // 2), threads_per_worker=2)
+        print(f"[CMIP6] dask: {client.dashboard_link}")
+    try:
+        # cada (modelo, cenário) é independente; ex.map mantém a ordem das tarefas
+        with ThreadPoolExecutor(max_workers=min(FETCH_WORKERS, len(tasks))) as ex:
+            rows = [out for out in ex.map(lambda t: _fetch_one(cat, *t), tasks) if out is not None]
+    finally:
+        if client is not None:
+            client.close()
 
     if not rows:
         raise SystemExit("Sem dados processados.")
@@ -125,23 +158,19 @@ def main() -> None:
     all_models = pd.concat(rows, ignore_index=True)
     all_models["year"] = all_models["time"].dt.year.astype(int)
 
-    # anomalias por modelo vs baseline
-    def _anom(g: pd.DataFrame) -> pd.DataFrame:
-        base = g[(g["year"] >= BASELINE[0]) & (g["year"] <= BASELINE[1])]
-        ref = base["tasC"].mean() if not base.empty else g["tasC"].mean()
-        g["anom"] = g["tasC"] - ref
-        return g
-
-    all_models = (
-        all_models
-        .groupby(["model", "scenario"], group_keys=False)
-        .apply(_anom)
-        .sort_values(["scenario", "model", "time"])
-    )
+    # anomalias por modelo vs baseline (médias de referência num só groupby;
+    # sem anos na baseline usa a média da série inteira)
+    keys = [all_models["model"], all_models["scenario"]]
+    in_base = all_models["year"].between(*BASELINE)
+    ref = all_models["tasC"].where(in_base).groupby(keys, observed=True).transform("mean")
+    ref = ref.where(in_base.groupby(keys, observed=True).transform("any"),
+                    all_models.groupby(keys, observed=True)["tasC"].transform("mean"))
+    all_models["anom"] = all_models["tasC"] - ref
+    all_models = all_models.sort_values(["scenario", "model", "time"])
 
     # estatísticas do ensemble por cenário/ano (em anomalia)
     stats = (
-        all_models.groupby(["scenario", "time"])["anom"]
+        all_models.groupby(["scenario", "time"], observed=True)["anom"]
         .agg(mean="mean", min="min", max="max")
         .reset_index()
         .sort_values(["scenario", "time"])
@@ -306,6 +306,16 @@ def collect_eurostat_purpose(last_years: int = 10) -> pd.DataFrame:
     out["year"] = pd.to_numeric(out["year"], errors="coerce").astype("Int64")
     return out
 
+def _preaggregate(df: pd.DataFrame, keys: list[str], value: str, sort_by: list[str], ascending: list[bool]) -> pd.DataFrame:
+    """
+    Soma `value` por `keys` (as dimensões Eurostat que não guardamos deixavam linhas repetidas)
+    e grava já ordenado, para a app só ter de filtrar pelo país.
+    """
+    keys = [k for k in keys if k in df.columns]
+    df[value] = pd.to_numeric(df[value], errors="coerce")
+    agg = df.groupby(keys, as_index=False, dropna=False, sort=False)[value].sum(min_count=1)
+    return agg.sort_values(sort_by, ascending=ascending, kind="stable").reset_index(drop=True)
+
 # ------------------- main -----------------------------------------------------
 
 def main():
@@ -324,6 +334,9 @@ def main():
     if EUROSTAT_ENABLE:
         origin = collect_eurostat_origin(last_years=10)
         if not origin.empty:
+            origin = _preaggregate(origin, ["geo","origin","year","unit"], "arrivals",
+                                   ["geo","year","arrivals"], [True, True, False])
+            origin["arrivals"] = origin["arrivals"].round().astype("Int64")   # contagens: sem ".0" no CSV
             origin.to_csv(DATA_DIR / "tourism_origin_eu.csv", index=False, sep=";", encoding="utf-8")
             print(f"✔️ tourism_origin_eu.csv: {len(origin):,} linhas")
         else:
@@ -331,6 +344,8 @@ def main():
 
         purpose = collect_eurostat_purpose(last_years=10)
         if not purpose.empty:
+            purpose = _preaggregate(purpose, ["geo","purpose","destination","year","unit"], "trips",
+                                    ["geo","year","purpose"], [True, True, True])
             purpose.to_csv(DATA_DIR / "tourism_purpose_eu.csv", index=False, sep=";", encoding="utf-8")
             print(f"✔️ tourism_purpose_eu.csv: {len(purpose):,} linhas")
         else:
@@ -0,0 +1,59 @@
+# scripts/wdqs_cache.py
+# -*- coding: utf-8 -*-
+"""
+Cache em disco das respostas WDQS (JSON em gzip, um ficheiro por sha256 da query).
+Partilhada por fetch_cities.py e fetch_cities - Copy.py; o USE_CACHE/--no-cache fica em cada script.
+"""
+from __future__ import annotations
+
+from pathlib import Path
+import gzip
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import orjson   # opcional: decode/encode em C
+except ImportError:
+    orjson = None
+
+
+def _loads(b: bytes):
+    return orjson.loads(b) if orjson is not None else json.loads(b)
+
+def _dumps(obj) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+def cache_path(cache_dir: Path, q: str) -> Path:
+    return cache_dir / f"{hashlib.sha256(q.encode('utf-8')).hexdigest()}.json.gz"
+
+def cache_get(cache_dir: Path, q: str, ttl: float) -> dict | None:
+    """Resposta guardada para a query, se existir e tiver menos de ttl segundos; senão None."""
+    p = cache_path(cache_dir, q)
+    try:
+        if time.time() - p.stat().st_mtime > ttl:
+            return None
+        with gzip.open(p, "rb") as fh:
+            return _loads(fh.read())
+    except (OSError, ValueError):
+        return None
+
+def cache_put(cache_dir: Path, q: str, js: dict) -> None:
+    # só respostas com resultados (vazio → o pipeline tenta outra query / retry)
+    if not js.get("results", {}).get("bindings"):
+        return
+    p = cache_path(cache_dir, q)
+    try:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        # tmp por processo/thread + os.replace: escritas concorrentes nunca deixam um .gz a meio
+        tmp = p.with_name(f"{p.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with gzip.open(tmp, "wb") as fh:
+            fh.write(_dumps(js))
+        os.replace(tmp, p)
+    except OSError as e:
+        print(f"  … cache WDQS não gravada ({e})", file=sys.stderr)
@@ -51,17 +51,20 @@ for _n in [
     "load_leaders",
     "load_unesco",
     "load_olympics_summer_csv",
+    "load_olympics_summer_csv_for_iso3",
     "load_flag_info",
     # --- NOVOS ---
     "load_tourism_ts",
     "load_tourism_latest",
     "tourism_series_for_iso3",
+    "tourism_ts_for_iso3",
     "load_tourism_origin_eu",
     "tourism_origin_for_iso3",
     "load_tourism_purpose_eu",
     "tourism_purpose_for_iso3",
     "load_migration_inout",
     "migration_inout_for_iso3",
+    "load_migration_inout_for_iso3",
 ]:
     _export(_n)
 
@@ -33,20 +33,24 @@ migration_inout_path     = DATA_DIR / "migration_inout.csv"
 
 
 # ---- Utils -----------------------------------------------------------------
-def _slugify(s: str) -> str:
-    s = re.sub(r"[^\w\-]+", "_", s, flags=re.U)
-    s = re.sub(r"_+", "_", s).strip("_")
-    return s or "pais"
+# dtypes explícitos para os CSVs longos do World Bank (iso3, indicator, year, value):
+# o parser C já converte para o tipo final e os códigos repetidos ficam em categoria
+_WB_LONG_DTYPES = {
+    "iso3": str, "country": str,
+    "indicator": "category", "indicator_name": "category",
+    "value": "float64",
+}
 
-def _read_csv_safe(path: Path, expected_cols: Optional[Iterable[str]] = None) -> pd.DataFrame:
+def _read_csv_safe(path: Path, expected_cols: Optional[Iterable[str]] = None,
+                   dtype: Optional[dict] = None) -> pd.DataFrame:
     """Lê CSV; se não existir, devolve DF vazio (com colunas esperadas). Tenta separador padrão e ';'."""
     if not path.exists():
         return pd.DataFrame(columns=list(expected_cols) if expected_cols else None)
     try:
-        df = pd.read_csv(path)
+        df = pd.read_csv(path, dtype=dtype)
     except Exception:
         try:
-            df = pd.read_csv(path, sep=";")
+            df = pd.read_csv(path, sep=";", dtype=dtype)
         except Exception:
             return pd.DataFrame(columns=list(expected_cols) if expected_cols else None)
     if expected_cols:
@@ -56,19 +60,55 @@ def _read_csv_safe(path: Path, expected_cols: Optional[Iterable[str]] = None) ->
         df = df[list(expected_cols)]
     return df
 
+def _parquet_sidecar(path: Path) -> Path | None:
+    """<ficheiro>.parquet ao lado do CSV (scripts/build_parquet_cache.py), se existir e não estiver desatualizado."""
+    pq = path.with_suffix(".parquet")
+    if not pq.exists():
+        return None
+    if path.exists() and pq.stat().st_mtime_ns < path.stat().st_mtime_ns:
+        return None
+    return pq
+
+def _read_table_safe(path: Path, expected_cols: Optional[Iterable[str]] = None,
+                     dtype: Optional[dict] = None) -> pd.DataFrame:
+    """Como _read_csv_safe, mas usa o .parquet irmão quando existe (tipos já gravados, iso3/indicator categóricos)."""
+    pq = _parquet_sidecar(path)
+    if pq is not None:
+        try:
+            df = pd.read_parquet(pq)
+            if expected_cols:
+                for c in expected_cols:
+                    if c not in df.columns:
+                        df[c] = pd.NA
+                df = df[list(expected_cols)]
+            return df
+        except Exception:
+            pass
+    return _read_csv_safe(path, expected_cols=expected_cols, dtype=dtype)
+
+def _upper_iso3(df: pd.DataFrame) -> pd.DataFrame:
+    # o parquet já vem em maiúsculas e categórico; só o CSV precisa de normalizar
+    if not isinstance(df["iso3"].dtype, pd.CategoricalDtype):
+        df["iso3"] = df["iso3"].astype(str).str.upper().astype("category")
+    return df
+
 # ---- Profiles (master) ------------------------------------------------------
 def have_master_profiles() -> bool:
     return countries_profiles_path.exists()
 
+@st.cache_data(show_spinner=False, ttl=3600)
 def load_profiles_master() -> pd.DataFrame:
     df = _read_csv_safe(countries_profiles_path)
     if df.empty:
         return df
+    if "iso3" in df.columns:
+        df["iso3"] = df["iso3"].astype(str).str.upper().astype("category")
     for c in ("population","area_km2","population_year"):
         if c in df.columns:
             df[c] = pd.to_numeric(df[c], errors="coerce")
     return df
 
+@st.cache_data(show_spinner=False, ttl=3600)
 def list_available_countries() -> pd.DataFrame:
     """
     Lista países a partir do profiles agregado; se não existir, cai para a seed.
@@ -140,7 +180,7 @@ def wb_series_for_country(iso3: str) -> pd.DataFrame:
 
 # ---- Cities -----------------------------------------------------------------
 def load_cities_all() -> pd.DataFrame:
-    df = _read_csv_safe(cities_path, expected_cols=["iso3","country","city","city_qid","admin","is_capital","population","year"])
+    df = _read_table_safe(cities_path, expected_cols=["iso3","country","city","city_qid","admin","is_capital","population","year"])
     if df.empty:
         return df
     df["iso3"] = df["iso3"].astype(str).str.upper()
@@ -157,16 +197,25 @@ def cities_for_iso3(iso3: str) -> pd.DataFrame:
 
 @st.cache_data(show_spinner=False)
 def _cities_for_iso3_cached(path: str, _mtime_ns: int, iso3u: str) -> pd.DataFrame:
-    # BOM-safe + separador auto (suporta ',' e ';')
-    df = pd.read_csv(path, sep=None, engine="python", encoding="utf-8-sig")
+    # cities_all.parquet (scripts/fetch_cities.py com pyarrow): só as linhas do país, filtradas na leitura
+    df = None
+    pq = _parquet_sidecar(Path(path))
+    if pq is not None:
+        try:
+            df = pd.read_parquet(pq, filters=[("iso3", "==", iso3u)])
+        except Exception:
+            df = None
+    if df is None:
+        # BOM-safe + separador auto (suporta ',' e ';')
+        df = pd.read_csv(path, sep=None, engine="python", encoding="utf-8-sig")
     # garantir colunas esperadas
     for k in ("iso3","city","admin","is_capital","population","year","lat","lon"):
         if k not in df.columns:
             df[k] = pd.NA
     # normalizar tipos
     df["iso3"] = df["iso3"].astype(str).str.upper()
-    df["lat"]  = pd.to_numeric(df["lat"], errors="coerce")
-    df["lon"]  = pd.to_numeric(df["lon"], errors="coerce")
+    df["lat"]  = pd.to_numeric(df["lat"], errors="coerce").astype("float64")
+    df["lon"]  = pd.to_numeric(df["lon"], errors="coerce").astype("float64")
     df["population"] = pd.to_numeric(df["population"], errors="coerce")
     df["year"]       = pd.to_numeric(df["year"], errors="coerce").astype("Int64")
     return df[df["iso3"] == iso3u].reset_index(drop=True)
@@ -186,6 +235,7 @@ def load_unesco_all() -> pd.DataFrame:
     for c in ("year","lat","lon"):
         if c in df.columns:
             df[c] = pd.to_numeric(df[c], errors="coerce")
+    df[["lat","lon"]] = df[["lat","lon"]].astype("float64")   # coords sempre float (1-D por coluna)
     return df
 
 def unesco_for_iso3(iso3: str) -> pd.DataFrame:
@@ -207,7 +257,9 @@ def load_leaders_current() -> pd.DataFrame:
     )
     if df.empty:
         return df
-    df["iso3"] = df["iso3"].astype(str).str.upper()
+    # poucos valores distintos → categorias (máscaras por ISO3/função comparam códigos)
+    df["iso3"] = df["iso3"].astype(str).str.upper().astype("category")
+    df["role"] = df["role"].astype("category")
     return df
 
 def load_leaders_history() -> pd.DataFrame:
@@ -218,17 +270,23 @@ def load_leaders_history() -> pd.DataFrame:
     )
     if df.empty:
         return df
-    df["iso3"] = df["iso3"].astype(str).str.upper()
+    # poucos valores distintos → categorias (máscaras por ISO3/função comparam códigos)
+    df["iso3"] = df["iso3"].astype(str).str.upper().astype("category")
+    df["role"] = df["role"].astype("category")
     return df
 
 def leaders_for_iso3(iso3: str) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """(atuais, histórico) do ISO3, com start/end já em datetime (só as linhas do país são convertidas)."""
     iso3u = str(iso3).upper()
     cur  = load_leaders_current()
     hist = load_leaders_history()
-    return (
-        cur[cur["iso3"] == iso3u].copy(),
-        hist[hist["iso3"] == iso3u].copy(),
-    )
+    out = []
+    for df in (cur, hist):
+        d = df[df["iso3"] == iso3u].copy()
+        for c in ("start", "end"):
+            d[c] = pd.to_datetime(d[c], errors="coerce")
+        out.append(d)
+    return out[0], out[1]
 
 # ---- Gastronomia ------------------------------------------------------------
 Gastro = namedtuple("Gastro", ["dishes", "beverages"])
@@ -422,10 +480,30 @@ def load_olympics_summer_csv(path: str | None = None) -> pd.DataFrame:
     # tipos finais
     for c in ("summer_gold","summer_silver","summer_bronze","summer_total","year"):
         out[c] = pd.to_numeric(out[c], errors="coerce").fillna(0).astype(int)
+    out["iso3"] = out["iso3"].astype("category")
 
     return out
 
 
+@lru_cache(maxsize=1)
+def _olympics_summer_all(path: str, mtime_ns: int) -> pd.DataFrame:
+    return load_olympics_summer_csv(path)
+
+def load_olympics_summer_csv_for_iso3(iso3: str, path: str | None = None) -> pd.DataFrame:
+    """Só as linhas do ISO3 pedido (mesmas colunas de load_olympics_summer_csv); cache invalida com o mtime."""
+    p = Path(path) if path else olympics_summer_path
+    if not p.exists():
+        return load_olympics_summer_csv(str(p))   # DF vazio com as colunas esperadas
+    return _olympics_for_iso3_cached(str(p), p.stat().st_mtime_ns, str(iso3).upper())
+
+@st.cache_data(show_spinner=False)
+def _olympics_for_iso3_cached(path: str, mtime_ns: int, iso3u: str) -> pd.DataFrame:
+    df = _olympics_summer_all(path, mtime_ns)
+    return df[df["iso3"] == iso3u].reset_index(drop=True)
+
+
+_RELIGION_COLS = ("christian","muslim","unaffiliated","hindu","buddhist","folk_religions","other_religions","jewish")
+
 @lru_cache(maxsize=1)
 def load_religion(path: str | None = None) -> pd.DataFrame:
     """
@@ -436,13 +514,31 @@ def load_religion(path: str | None = None) -> pd.DataFrame:
     Unidades: PERCENTAGEM da população (0-100).
     """
     p = Path(path) if path else (DATA_DIR / "religion.csv")
-    df = pd.read_csv(p)
-    df["iso3"] = df["iso3"].astype(str).str.upper()
-    for c in ["christian","muslim","unaffiliated","hindu","buddhist","folk_religions","other_religions","jewish"]:
+    df = None
+    pq = _parquet_sidecar(p)
+    if pq is not None:
+        try:
+            df = pd.read_parquet(pq)
+        except Exception:
+            df = None
+    if df is None:
+        df = pd.read_csv(p, dtype={"iso3": str, "country": str, **{c: "float64" for c in _RELIGION_COLS}})
+    df = _upper_iso3(df)
+    for c in _RELIGION_COLS:
         if c in df.columns:
             df[c] = pd.to_numeric(df[c], errors="coerce").fillna(0.0)
     return df
 
+@lru_cache(maxsize=1)
+def _religion_by_iso3() -> dict[str, pd.DataFrame]:
+    df = load_religion()
+    return {k: g for k, g in df.groupby("iso3", sort=False, observed=True)}
+
+def religion_for_iso3(iso3: str) -> pd.DataFrame:
+    """Linha(s) de load_religion() para o ISO3 (lookup num dict montado uma vez)."""
+    g = _religion_by_iso3().get(str(iso3).upper())
+    return g if g is not None else load_religion().iloc[0:0]
+
 @lru_cache(maxsize=1)
 def load_migration_latest(path: str | None = None) -> pd.DataFrame:
     """
@@ -451,8 +547,8 @@ def load_migration_latest(path: str | None = None) -> pd.DataFrame:
       iso3, country, indicator, indicator_name, year, value
     """
     p = Path(path) if path else (DATA_DIR / "migration_latest.csv")
-    df = pd.read_csv(p)
-    df["iso3"] = df["iso3"].astype(str).str.upper()
+    df = pd.read_csv(p, dtype=_WB_LONG_DTYPES)
+    df = _upper_iso3(df)
     return df
 
 @lru_cache(maxsize=1)
@@ -463,8 +559,8 @@ def load_migration_ts(path: str | None = None) -> pd.DataFrame:
       iso3, country, indicator, indicator_name, year, value
     """
     p = Path(path) if path else (DATA_DIR / "migration_timeseries.csv")
-    df = pd.read_csv(p)
-    df["iso3"] = df["iso3"].astype(str).str.upper()
+    df = pd.read_csv(p, dtype=_WB_LONG_DTYPES)
+    df = _upper_iso3(df)
     return df
 
 _BN_HEADERS = {"User-Agent": "GeoApp/1.0 (+https://github.com/)"}
@@ -558,10 +654,11 @@ def load_tourism_ts(path: str | None = None) -> pd.DataFrame:
     colunas: iso3; country; indicator; indicator_name; year; value
     """
     p = Path(path) if path else tourism_timeseries_path
-    df = _read_csv_safe(p, expected_cols=["iso3","country","indicator","indicator_name","year","value"])
+    df = _read_table_safe(p, expected_cols=["iso3","country","indicator","indicator_name","year","value"],
+                         dtype=_WB_LONG_DTYPES)
     if df.empty:
         return df
-    df["iso3"] = df["iso3"].astype(str).str.upper()
+    df = _upper_iso3(df)
     for c in ("year","value"):
         df[c] = pd.to_numeric(df[c], errors="coerce")
     return df
@@ -572,14 +669,37 @@ def load_tourism_latest(path: str | None = None) -> pd.DataFrame:
     Lê data/tourism_latest.csv (último valor por iso3+indicator)
     """
     p = Path(path) if path else tourism_latest_path
-    df = _read_csv_safe(p, expected_cols=["iso3","country","indicator","indicator_name","year","value"])
+    df = _read_table_safe(p, expected_cols=["iso3","country","indicator","indicator_name","year","value"],
+                         dtype=_WB_LONG_DTYPES)
     if df.empty:
         return df
-    df["iso3"] = df["iso3"].astype(str).str.upper()
+    df = _upper_iso3(df)
     for c in ("year","value"):
         df[c] = pd.to_numeric(df[c], errors="coerce")
     return df
 
+@lru_cache(maxsize=1)
+def _tourism_ts_by_key() -> dict[tuple[str, str], pd.DataFrame]:
+    # {(iso3, indicator): linhas} — montado uma vez; a página do país faz lookups em vez de máscaras.
+    # Ordenado por ano UMA vez aqui (estável), para quem consome não ter de reordenar.
+    df = load_tourism_ts()
+    if df.empty:
+        return {}
+    df = df.sort_values(["iso3", "indicator", "year"], kind="stable")
+    return {k: g for k, g in df.groupby(["iso3", "indicator"], sort=False, observed=True)}
+
+def tourism_ts_for_iso3(iso3: str, indicators) -> pd.DataFrame:
+    """
+    Linhas de load_tourism_ts() para o ISO3 e os indicadores pedidos (mesmas colunas),
+    agrupadas por indicador (pela ordem pedida) e ordenadas por ano dentro de cada um.
+    """
+    idx = _tourism_ts_by_key()
+    iso3u = str(iso3).upper()
+    parts = [idx[(iso3u, c)] for c in indicators if (iso3u, c) in idx]
+    if not parts:
+        return load_tourism_ts().iloc[0:0]
+    return pd.concat(parts, ignore_index=True)
+
 def tourism_series_for_iso3(iso3: str) -> pd.DataFrame:
     df = load_tourism_ts()
     if df.empty:
@@ -607,12 +727,15 @@ def load_tourism_origin_eu(path: str | None = None) -> pd.DataFrame:
     df = _read_csv_semicolon(p, expected_cols=["geo","origin","year","arrivals","unit"])
     if df.empty:
         return df
-    for c in ("year","arrivals"):
-        df[c] = pd.to_numeric(df[c], errors="coerce")
-    df["geo"] = df["geo"].astype(str).str.upper()
-    df["origin"] = df["origin"].astype(str).str.upper()
+    df["year"] = pd.to_numeric(df["year"], errors="coerce")
+    # chegadas são contagens: inteiro nullable já no servidor (sem formatação float no cliente)
+    df["arrivals"] = pd.to_numeric(df["arrivals"], errors="coerce").round().astype("Int64")
+    # códigos repetidos (<40 geo, ~200 origens): category → máscaras por país comparam ints
+    for c in ("geo","origin"):
+        df[c] = df[c].astype(str).str.upper().astype("category")
     return df
 
+@st.cache_data(show_spinner=False)
 def tourism_origin_for_iso3(iso3: str) -> pd.DataFrame:
     """
     Filtra por país de destino (iso3→iso2). Devolve dataframe com colunas:
@@ -624,8 +747,9 @@ def tourism_origin_for_iso3(iso3: str) -> pd.DataFrame:
     iso2 = _ISO3_TO_ISO2_EU.get(str(iso3).upper())
     if not iso2:
         return pd.DataFrame(columns=df.columns)
-    sub = df[df["geo"] == iso2].copy()
-    return sub[["origin","year","arrivals","unit"]].sort_values(["year","arrivals"], ascending=[True, False])
+    sub = df.loc[df["geo"] == iso2, ["origin","year","arrivals","unit"]]
+    # o fetcher já grava agregado e ordenado (geo, year, arrivals desc); sort estável fica barato
+    return sub.sort_values(["year","arrivals"], ascending=[True, False], kind="stable")
 
 @lru_cache(maxsize=1)
 def load_tourism_purpose_eu(path: str | None = None) -> pd.DataFrame:
@@ -638,11 +762,11 @@ def load_tourism_purpose_eu(path: str | None = None) -> pd.DataFrame:
         return df
     for c in ("year","trips"):
         df[c] = pd.to_numeric(df[c], errors="coerce")
-    df["geo"] = df["geo"].astype(str).str.upper()
-    df["purpose"] = df["purpose"].astype(str).str.upper()
-    df["destination"] = df["destination"].astype(str).str.upper()
+    for c in ("geo","purpose","destination"):
+        df[c] = df[c].astype(str).str.upper().astype("category")
     return df
 
+@st.cache_data(show_spinner=False)
 def tourism_purpose_for_iso3(iso3: str) -> pd.DataFrame:
     """
     Filtra por país (residentes do país geo=iso2). Devolve purpose/destination/year/trips.
@@ -653,8 +777,8 @@ def tourism_purpose_for_iso3(iso3: str) -> pd.DataFrame:
     iso2 = _ISO3_TO_ISO2_EU.get(str(iso3).upper())
     if not iso2:
         return pd.DataFrame(columns=df.columns)
-    sub = df[df["geo"] == iso2].copy()
-    return sub[["purpose","destination","year","trips","unit"]].sort_values(["year","purpose"])
+    sub = df.loc[df["geo"] == iso2, ["purpose","destination","year","trips","unit"]]
+    return sub.sort_values(["year","purpose"], kind="stable")
 
 
 try:
@@ -848,10 +972,18 @@ def _empty(cols: list[str]) -> pd.DataFrame:
 def _filter_iso3_csv(path: Path, iso3: str, usecols: list[str], dtypes: dict[str,str] | None = None,
                      chunksize: int = 200_000) -> pd.DataFrame:
     """Lê em chunks e devolve só as linhas do ISO3 pedido. Requer coluna 'iso3' no ficheiro."""
+    iso3u = str(iso3).upper()
+    # 1) parquet (pyarrow): filtro por ISO3 aplicado na leitura; falhando, segue para o CSV
+    pq = _parquet_sidecar(path)
+    if pq is not None:
+        try:
+            df = pd.read_parquet(pq, columns=usecols, filters=[("iso3", "==", iso3u)])
+            return (df.astype(dtypes) if dtypes else df).reset_index(drop=True)
+        except Exception:
+            pass
     if not path.exists():
         st.warning(f"Ficheiro não encontrado: {path}")
         return _empty(usecols)
-    iso3u = str(iso3).upper()
     frames = []
     for ch in pd.read_csv(path, usecols=usecols, dtype=dtypes, chunksize=chunksize, low_memory=False):
         ch["iso3"] = ch["iso3"].astype(str).str.upper()
@@ -980,8 +1112,10 @@ except NameError:
         "load_cities_all","cities_for_iso3","country_has_cities",
         "load_unesco_all","unesco_for_iso3",
         "load_leaders_current","load_leaders_history","leaders_for_iso3",
+        # Olympics
+        "load_olympics_summer_csv","load_olympics_summer_csv_for_iso3",
         # Tourism
-        "load_tourism_ts","load_tourism_latest","tourism_series_for_iso3",
+        "load_tourism_ts","load_tourism_latest","tourism_series_for_iso3","tourism_ts_for_iso3",
         "load_tourism_origin_eu","tourism_origin_for_iso3",
         "load_tourism_purpose_eu","tourism_purpose_for_iso3",
         # Migration (full and per-ISO3)
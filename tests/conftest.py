@@ -0,0 +1,6 @@
+# tests/conftest.py
+# raiz do projeto no sys.path (paises.py, services/ …), também quando corre só `pytest`
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
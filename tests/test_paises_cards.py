@@ -0,0 +1,101 @@
+# tests/test_paises_cards.py
+# -*- coding: utf-8 -*-
+"""Smoke test dos cards de métricas das secções Migração e Turismo (paises.py)."""
+from __future__ import annotations
+
+import pandas as pd
+import pytest
+
+for _mod in ("streamlit", "altair", "pydeck", "plotly"):
+    pytest.importorskip(_mod)
+
+import paises  # noqa: E402
+
+
+class _FakeCol:
+    def __init__(self, calls: list):
+        self.calls = calls
+
+    def metric(self, label, value, delta=None):
+        self.calls.append(("metric", label, value, delta))
+
+
+class _FakeSt:
+    def __init__(self):
+        self.calls: list = []
+
+    def markdown(self, body, unsafe_allow_html=False):
+        self.calls.append(("markdown", body))
+
+    def columns(self, n):
+        return [_FakeCol(self.calls) for _ in range(n)]
+
+
+_MIG_KMAP = {
+    "SM.POP.NETM":          "Migração líquida (pessoas)",
+    "BX.TRF.PWKR.CD.DT":    "Remessas recebidas (US$)",
+    "BX.TRF.PWKR.DT.GD.ZS": "Remessas (% PIB)",
+}
+_MIG_UNIT = {"SM.POP.NETM": "int", "BX.TRF.PWKR.CD.DT": "money", "BX.TRF.PWKR.DT.GD.ZS": "pct"}
+
+
+def _mig_frames() -> tuple[pd.DataFrame, pd.DataFrame]:
+    ts = pd.DataFrame({
+        "indicator": ["SM.POP.NETM", "SM.POP.NETM", "BX.TRF.PWKR.CD.DT", "BX.TRF.PWKR.CD.DT",
+                      "BX.TRF.PWKR.DT.GD.ZS"],
+        "year":  [2021, 2022, 2021, 2022, 2022],
+        "value": [10_000, 12_500, 3.1e9, 3.6e9, 1.7],
+    })
+    return ts.iloc[0:0], ts
+
+
+def _tour_frame() -> pd.DataFrame:
+    return pd.DataFrame({
+        "indicator": ["ST.INT.ARVL", "ST.INT.ARVL", "ST.INT.RCPT.CD", "ST.INT.RCPT.XP.ZS"],
+        "year":  [2018, 2019, 2019, 2019],
+        "value": [20_000_000, 24_000_000, 2.2e10, 17.5],
+    })
+
+
+def test_migration_cards():
+    latest, ts = _mig_frames()
+    cards = paises._migration_cards(latest, ts, _MIG_KMAP, _MIG_UNIT)
+    assert cards == [
+        ("Migração líquida (pessoas) · 2022", "12 500", "+2 500"),
+        ("Remessas recebidas (US$) · 2022", "3.60 B", "+0.50 B"),
+        ("Remessas (% PIB) · 2022", "1.7%", ""),
+    ]
+
+
+def test_tourism_cards():
+    cards = paises._tourism_cards(_tour_frame())
+    assert [c[0] for c in cards] == [
+        "Chegadas (turistas internacionais) · 2019",
+        "Receitas do turismo (US$ correntes) · 2019",
+        "Receitas do turismo (% exportações) · 2019",
+    ]
+    assert cards[0][1:] == ("24 000 000", "+4 000 000")
+
+
+@pytest.mark.parametrize("html_mode", [True, False])
+def test_render_metric_cards_both_sections(monkeypatch, html_mode):
+    fake = _FakeSt()
+    monkeypatch.setattr(paises, "st", fake)
+    monkeypatch.setattr(paises, "_METRIC_CARDS_HTML", html_mode)
+
+    latest, ts = _mig_frames()
+    paises._render_metric_cards(paises._migration_cards(latest, ts, _MIG_KMAP, _MIG_UNIT))
+    paises._render_metric_cards(paises._tourism_cards(_tour_frame()))
+
+    if html_mode:
+        assert [c[0] for c in fake.calls] == ["markdown", "markdown"]
+        assert "Migração líquida" in fake.calls[0][1] and "Chegadas" in fake.calls[1][1]
+    else:
+        assert [c[0] for c in fake.calls] == ["metric"] * 6
+
+
+def test_render_metric_cards_empty(monkeypatch):
+    fake = _FakeSt()
+    monkeypatch.setattr(paises, "st", fake)
+    paises._render_metric_cards([])
+    assert fake.calls == []